@@ -0,0 +1,268 @@
+import os
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import eam
+from trajectory import open_trajectory, write_columns, read_columns
+
+
+# pair cutoff in nearest neighbour distances: between the first and second shell of fcc/hcp,
+# between the second and third shell of bcc
+CUTOFF_FACTOR = 1.207
+
+# atoms with fewer neighbours are surface atoms (12 in the bulk, 8 or 9 on the faces of the fcc cube)
+SURFACE_COORDINATION = 10
+
+
+## Helpers
+def frame_chunks(n_frames, chunk):
+    return [range(i, min(i + chunk, n_frames)) for i in range(0, n_frames, chunk)]
+
+
+def minimum_image(d, cell, pbc):
+    """
+    Shortest periodic images of the difference vectors d in the (possibly triclinic) cell
+    """
+    vectors, _ = eam.cell_vectors(cell)
+    pbc = np.asarray(pbc, dtype=bool)
+    if not pbc.any():
+        return d
+    fractional = d @ np.linalg.inv(vectors)
+    fractional[:, pbc] -= np.round(fractional[:, pbc])
+    return fractional @ vectors
+
+
+def nearest_distance(positions, cell, pbc, guess=4.0):
+    """
+    Median distance of the atoms to their nearest neighbour
+    """
+    i, _, d = eam.neighbor_pairs(positions, cell, pbc, guess)
+    nearest = np.full(len(positions), np.inf)
+    np.minimum.at(nearest, i, np.linalg.norm(d, axis=1))
+    return float(np.median(nearest[np.isfinite(nearest)]))
+
+
+def lindemann(pairs, sum_r, sum_r2, count, n_atoms):
+    """
+    Per-atom Lindemann index from sums of the pair distances over `count` frames: the relative fluctuation
+    sqrt(<r^2> - <r>^2) / <r> of the pairs, averaged over the pairs of every atom
+    """
+    mean = sum_r / count
+    delta = np.sqrt(np.maximum(sum_r2 / count - mean * mean, 0.0)) / mean
+    i, j = pairs
+    total = np.bincount(i, weights=delta, minlength=n_atoms) + np.bincount(j, weights=delta, minlength=n_atoms)
+    n_pairs = np.bincount(i, minlength=n_atoms) + np.bincount(j, minlength=n_atoms)
+    return total / np.maximum(n_pairs, 1)
+
+
+## Streaming analysis
+def analyse_frames(path, frames, reference, pairs, cutoff, surface_coordination):
+    """
+    MSD, coordination, surface fraction and the sums for the Lindemann index of a range of frames.
+    Runs in a worker process, only the frames of the range are read
+    """
+    traj = open_trajectory(path)
+    n = len(reference)
+    i, j = pairs
+    steps, msd, mean_coordination, surface = [], [], [], []
+    coordination = np.zeros((len(frames), n), dtype=np.uint8)
+    sum_r, sum_r2 = np.zeros(len(i)), np.zeros(len(i))
+    for k, frame in enumerate(frames):
+        positions, cell = traj.positions(frame), traj.cell(frame)
+        steps.append(traj.timesteps[frame])
+        # displacements relative to the centre of mass, the cluster may drift as a whole
+        displacement = positions - reference
+        displacement -= displacement.mean(axis=0)
+        msd.append(np.mean(np.einsum("ij,ij->i", displacement, displacement)))
+
+        r = np.linalg.norm(minimum_image(positions[i] - positions[j], cell, traj.pbc), axis=1)
+        sum_r += r
+        sum_r2 += r * r
+
+        neighbors = np.bincount(eam.neighbor_pairs(positions, cell, traj.pbc, cutoff)[0], minlength=n)
+        coordination[k] = np.minimum(neighbors, 255)
+        mean_coordination.append(neighbors.mean())
+        surface.append(np.mean(neighbors < surface_coordination))
+    return {"frames": list(frames), "step": steps, "msd": msd, "coordination": mean_coordination,
+            "surface_fraction": surface, "atom_coordination": coordination,
+            "sum_r": sum_r, "sum_r2": sum_r2, "count": len(frames)}
+
+
+def analyse_trajectory(path, chunk=50, max_workers=None, cutoff=None, surface_coordination=SURFACE_COORDINATION,
+                       output=None):
+    """
+    Lindemann index, MSD, coordination numbers and surface fraction of the trajectory of a dump path (the binary
+    trajectory <path>.mdtraj when it exists, the text dump otherwise).
+    Frames are streamed in ranges of `chunk` frames by worker processes, so memory is bounded by the chunk size.
+    Every range is also one window of the windowed Lindemann index. The pairs of the Lindemann index are the
+    neighbours of the first frame within `cutoff` (default CUTOFF_FACTOR nearest neighbour distances).
+    The results are written to `output` (default: analysis/ next to the trajectory) and returned as dict
+    """
+    traj = open_trajectory(path)
+    n_frames = len(traj)
+    if n_frames == 0:
+        raise ValueError(f"{path} contains no frames")
+    reference, cell = traj.positions(0), traj.cell(0)
+    cutoff = cutoff or CUTOFF_FACTOR * nearest_distance(reference, cell, traj.pbc)
+    i, j, _ = eam.neighbor_pairs(reference, cell, traj.pbc, cutoff)
+    pairs = (i[i < j], j[i < j])
+
+    chunks = frame_chunks(n_frames, chunk)
+    n = len(reference)
+    # workers read the trajectory themselves, a fresh interpreter keeps them independent of the caller's imports
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(chunks), os.cpu_count() or 1),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        parts = list(pool.map(analyse_frames, [path] * len(chunks), chunks, [reference] * len(chunks),
+                              [pairs] * len(chunks), [cutoff] * len(chunks), [surface_coordination] * len(chunks)))
+
+    series = {name: np.concatenate([part[name] for part in parts]).astype(float)
+              for name in ["step", "msd", "coordination", "surface_fraction"]}
+    windows = {
+        "first_step": np.array([part["step"][0] for part in parts], dtype=float),
+        "last_step": np.array([part["step"][-1] for part in parts], dtype=float),
+        "lindemann": np.array([lindemann(pairs, part["sum_r"], part["sum_r2"], part["count"], n).mean()
+                               for part in parts]),
+    }
+    atom_lindemann = lindemann(pairs, sum(part["sum_r"] for part in parts), sum(part["sum_r2"] for part in parts),
+                               n_frames, n)
+    results = {"series": series, "windows": windows, "lindemann": float(atom_lindemann.mean()),
+               "atom_lindemann": atom_lindemann.astype(np.float32),
+               "atom_coordination": np.concatenate([part["atom_coordination"] for part in parts]),
+               "cutoff": cutoff}
+
+    output = output or os.path.join(os.path.dirname(os.path.abspath(path)), "analysis")
+    os.makedirs(output, exist_ok=True)
+    write_columns(os.path.join(output, "series.bin"), series, cutoff=cutoff)
+    write_columns(os.path.join(output, "windows.bin"), windows, lindemann=results["lindemann"], chunk=chunk)
+    np.save(os.path.join(output, "atom_lindemann.npy"), results["atom_lindemann"])
+    np.save(os.path.join(output, "atom_coordination.npy"), results["atom_coordination"])
+    return results
+
+
+def load_analysis(directory):
+    """
+    Results written by analyse_trajectory, the per-atom coordination is memory-mapped
+    """
+    return {"series": read_columns(os.path.join(directory, "series.bin")),
+            "windows": read_columns(os.path.join(directory, "windows.bin")),
+            "atom_lindemann": np.load(os.path.join(directory, "atom_lindemann.npy")),
+            "atom_coordination": np.load(os.path.join(directory, "atom_coordination.npy"), mmap_mode="r")}
+
+
+## Radial distribution and structure factor
+def pair_histogram(positions, cell, pbc, r_max, n_bins, block=512):
+    """
+    Ordered pairs (every pair counted from both atoms) per distance bin up to r_max. Periodic cells use the
+    neighbor grid of eam.neighbor_pairs, non-periodic clusters are binned in blocks of rows so that the distances
+    up to the cluster diameter fit into memory
+    """
+    scale = n_bins / r_max
+    if np.any(pbc):
+        _, _, d = eam.neighbor_pairs(positions, cell, pbc, r_max)
+        bins = (np.linalg.norm(d, axis=1) * scale).astype(np.int64)
+        return np.bincount(bins[bins < n_bins], minlength=n_bins)
+    hist = np.zeros(n_bins, dtype=np.int64)
+    for start in range(0, len(positions), block):
+        # pairs i < j of the rows of this block, counted twice below
+        rows = positions[start:start + block]
+        d = rows[:, None, :] - positions[None, start:, :]
+        upper = np.arange(len(rows))[:, None] < np.arange(len(positions) - start)[None, :]
+        bins = (np.sqrt(np.einsum("ijk,ijk->ij", d, d)[upper]) * scale).astype(np.int64)
+        hist += np.bincount(bins[bins < n_bins], minlength=n_bins)
+    return 2 * hist
+
+
+def number_density(positions, cell, pbc):
+    """
+    Atoms per volume: of the cell for periodic systems, of the bounding box of the atoms for clusters
+    """
+    if np.any(pbc):
+        vectors, _ = eam.cell_vectors(cell)
+        return len(positions) / abs(np.linalg.det(vectors))
+    return len(positions) / np.prod(np.ptp(positions, axis=0))
+
+
+def default_r_max(cell, pbc):
+    """
+    Half the smallest width of a periodic cell, the diagonal of the cell of a cluster (all pairs, needed for S(q))
+    """
+    vectors, _ = eam.cell_vectors(cell)
+    if np.any(pbc):
+        volume = abs(np.linalg.det(vectors))
+        widths = [volume / np.linalg.norm(np.cross(vectors[(k + 1) % 3], vectors[(k + 2) % 3])) for k in range(3)]
+        return 0.5 * min(widths)
+    return float(np.linalg.norm(vectors.sum(axis=0)))
+
+
+def rdf_window(path, frames, r_max, n_bins):
+    """
+    Pair histogram of a window of frames, accumulated frame by frame, and the sum of N*density for its normalisation.
+    Runs in a worker process
+    """
+    traj = open_trajectory(path)
+    hist = np.zeros(n_bins, dtype=np.int64)
+    norm, n_atoms = 0.0, 0
+    for frame in frames:
+        positions, cell = traj.positions(frame), traj.cell(frame)
+        hist += pair_histogram(positions, cell, traj.pbc, r_max, n_bins)
+        norm += len(positions) * number_density(positions, cell, traj.pbc)
+        n_atoms += len(positions)
+    return {"first_step": traj.timesteps[frames[0]], "last_step": traj.timesteps[frames[-1]], "hist": hist,
+            "norm": norm, "n_atoms": n_atoms, "density": norm / n_atoms}
+
+
+def structure_factor(r, hist, n_atoms, g, density, q, periodic, r_max):
+    """
+    S(q) of one window. Clusters use the Debye sum over all pair distances, S(q) = 1 + sum h(r) sin(qr)/(qr) / N,
+    periodic systems the Fourier transform of g(r) - 1 with the Lorch window
+    """
+    qr = np.outer(q, r)
+    sinc = np.sinc(qr / np.pi)
+    if not periodic:
+        return 1.0 + sinc @ hist / n_atoms
+    dr = r[1] - r[0]
+    lorch = np.sinc(r / r_max)
+    return 1.0 + 4 * np.pi * density * sinc @ (r * r * (g - 1.0) * lorch) * dr
+
+
+def rdf_trajectory(path, window=25, r_max=None, n_bins=200, q=None, max_workers=None, cache=False):
+    """
+    g(r) and S(q) over windows of `window` frames of the trajectory of a dump path. Windows are processed in
+    parallel by worker processes. With cache=True the result is stored in analysis/ next to the trajectory under
+    a key of the trajectory, the window and the binning, and reused.
+    Returns dict with r, q, first_step, last_step (per window), g (windows x bins) and S (windows x q)
+    """
+    traj = open_trajectory(path)
+    n_frames = len(traj)
+    if n_frames == 0:
+        raise ValueError(f"{path} contains no frames")
+    periodic = bool(np.any(traj.pbc))
+    r_max = r_max or default_r_max(traj.cell(0), traj.pbc)
+    q = np.linspace(0.5, 12.0, 231) if q is None else np.asarray(q, dtype=float)
+
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), "analysis")
+    key = (f"rdf_{os.path.basename(traj.path)}_{os.path.getsize(traj.path)}_{n_frames}_w{window}_r{r_max:.4f}"
+           f"_b{n_bins}_q{len(q)}-{q[0]:g}-{q[-1]:g}.npz")
+    if cache and os.path.exists(os.path.join(directory, key)):
+        with np.load(os.path.join(directory, key)) as stored:
+            return dict(stored)
+
+    windows = frame_chunks(n_frames, window)
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(windows), os.cpu_count() or 1),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        parts = list(pool.map(rdf_window, [path] * len(windows), windows, [r_max] * len(windows),
+                              [n_bins] * len(windows)))
+
+    edges = np.linspace(0.0, r_max, n_bins + 1)
+    r = 0.5 * (edges[1:] + edges[:-1])
+    shell = 4.0 / 3.0 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+    g = np.array([part["hist"] / (part["norm"] * shell) for part in parts])
+    S = np.array([structure_factor(r, part["hist"], part["n_atoms"], g_window, part["density"], q, periodic, r_max)
+                  for part, g_window in zip(parts, g)])
+    results = {"r": r, "q": q, "g": g, "S": S,
+               "first_step": np.array([part["first_step"] for part in parts]),
+               "last_step": np.array([part["last_step"] for part in parts])}
+    if cache:
+        os.makedirs(directory, exist_ok=True)
+        np.savez(os.path.join(directory, key), **results)
+    return results
@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+from dataclasses import replace
+import numpy as np
+import functions_library as fl
+
+
+# systems of the benchmark, the box lengths of the notebooks plus larger boxes. The neighbor settings are pinned,
+# tuned settings cached by earlier runs would make the rows depend on the history of the machine
+SYSTEMS = {
+    "Al": fl.MD_system(Project_name="Al", element="Al", lattice_constant=4.05, start_temperature=300, end_temperature=1500,
+                       neighbor_tuning="fixed"),
+    "Cu": fl.MD_system(Project_name="Cu", element="Cu", lattice_constant=3.615, start_temperature=300, end_temperature=2000,
+                       neighbor_tuning="fixed"),
+    "Ti": fl.MD_system(Project_name="Ti", element="Ti", lattice_constant=2.95, start_temperature=300, end_temperature=1500,
+                       neighbor_tuning="fixed"),
+}
+BOX_LENGTHS = {"Al": [3, 4, 5, 6, 8, 10], "Cu": [3, 4, 5, 6, 8, 10], "Ti": [8, 9, 10, 11, 14, 18]}
+QUICK_BOX_LENGTHS = {"Al": [3, 6], "Cu": [3], "Ti": [8, 11]}
+
+# output settings: dump written or not, binary trajectory or text dump
+OUTPUTS = {
+    "none": {"dump_trajectory": False},
+    "text": {"dump_trajectory": True, "trajectory_format": "text"},
+    "binary": {"dump_trajectory": True, "trajectory_format": "binary"},
+}
+
+# metrics compared against a baseline, True where larger is better
+METRICS = {
+    "atom_steps_per_s": True,
+    "ns_per_day": True,
+    "setup_s": False,
+    "run_s": False,
+    "dump_io_s": False,
+    "convert_s": False,
+    "animate_open_s": False,
+}
+
+# times below this are dominated by noise and are not compared
+MIN_TIME = 0.05
+
+# cold import of functions_library in a fresh interpreter in s, and the backends it must not import by itself
+IMPORT_BUDGET = 1.0
+HEAVY_MODULES = ["lammps", "ovito", "matplotlib", "ipywidgets"]
+
+
+class StepLimit:
+    """
+    Chunk stage which ends the run after a fixed number of steps
+    """
+    def __init__(self, steps):
+        self.every = steps
+        self.last = None
+
+    def setup(self, lmp):
+        self.last = int(lmp.extract_global("ntimestep")) + self.every
+
+    def sample(self, lmp, step):
+        return step >= self.last
+
+    def finish(self, lmp):
+        pass
+
+
+def has_openmp():
+    from lammps import lammps
+    lmp = lammps(cmdargs=["-log", "none", "-screen", "none"])
+    try:
+        return lmp.has_package("OPENMP")
+    finally:
+        lmp.close()
+
+
+def case_name(element, box_length, threads, output):
+    return f"{element}-L{box_length}-t{threads}-{output}"
+
+
+def animate_open_time(s:fl.MD_system):
+    """
+    Time animate() needs before the first frame can be shown: open the trajectory, style the pipeline and
+    compute frame 0
+    """
+    start_time = time.time()
+    pipeline, n_frames = fl.trajectory_pipeline(s)
+    fl.style_pipeline(s, pipeline)
+    pipeline.compute(0)
+    return time.time() - start_time
+
+
+def run_case(s:fl.MD_system, steps):
+    """
+    Set up and run one case for `steps` steps in its own Lammps instance, returns the measured times
+    """
+    start_time = time.time()
+    fl.setup_run(s, build=True)
+    fl.write_input(s)
+    setup_s = time.time() - start_time
+
+    from lammps import lammps
+    args = ["-log", os.path.join(s.run_dir, "log.lammps"), "-screen", "none"]
+    lmp = lammps(cmdargs=args + fl.accelerator_args(fl.execution_config(s)))
+    try:
+        lmp.file(os.path.join(s.run_dir, "lammps_input"))
+        atoms = int(lmp.get_natoms())
+        start_time = time.time()
+        step = fl.run_in_chunks(lmp, s, [StepLimit(steps)], steps)
+        run_s = time.time() - start_time
+    finally:
+        lmp.close()
+
+    start_time = time.time()
+    fl.finish_run(s)
+    convert_s = time.time() - start_time
+    row = {"atoms": atoms, "steps": step, "setup_s": setup_s, "run_s": run_s, "convert_s": convert_s,
+           "atom_steps_per_s": atoms * step / run_s,
+           "ns_per_day": step * float(s.timestep) / 1000 / run_s * 86400}
+    timing = fl.lammps_timing(os.path.join(s.run_dir, "log.lammps"))
+    if timing is not None:
+        row["lammps_fractions"] = timing["fractions"]
+        row["neighbor_builds"] = timing["neighbor_builds"]
+    if s.dump_trajectory:
+        row["animate_open_s"] = animate_open_time(s)
+    return row
+
+
+def run_benchmark(elements=("Al", "Cu", "Ti"), box_lengths=None, threads=(1,), outputs=("none", "binary"),
+                  steps=1000, directory="./benchmark_runs", callback=None):
+    """
+    Run every combination of element, box length, thread count and output setting and return the report.
+    dump_io_s is the extra run time of a case with dump over the same case without dump, plus the conversion
+    """
+    box_lengths = box_lengths or BOX_LENGTHS
+    if max(threads) > 1 and not has_openmp():
+        print("Lammps is built without OPENMP, thread counts above 1 are skipped")
+        threads = [n for n in threads if n == 1]
+
+    cases = {}
+    for element in elements:
+        for box_length in box_lengths[element]:
+            for n in threads:
+                for output in outputs:
+                    name = case_name(element, box_length, n, output)
+                    # chunked input without run command, the benchmark drives the steps
+                    s = replace(SYSTEMS[element], Project_name=os.path.join(directory, name), box_length=box_length,
+                                checkpoint_every=steps, insitu_every=0, accelerator="omp" if n > 1 else "none",
+                                threads=n, **OUTPUTS[output])
+                    row = {"element": element, "box_length": box_length, "threads": n, "output": output}
+                    try:
+                        row.update(run_case(s, steps))
+                    except Exception as e:
+                        row["error"] = str(e)
+                    cases[name] = row
+                    if callback is not None:
+                        callback(name, row)
+
+    for name, row in cases.items():
+        plain = cases.get(case_name(row["element"], row["box_length"], row["threads"], "none"))
+        if row["output"] != "none" and plain is not None and "run_s" in row and "run_s" in plain:
+            row["dump_io_s"] = row["run_s"] - plain["run_s"] + row["convert_s"]
+
+    shutil.rmtree(directory, ignore_errors=True)
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "steps": steps, "machine": machine_info(), "cases": cases}
+
+
+def machine_info():
+    from lammps import lammps
+    lmp = lammps(cmdargs=["-log", "none", "-screen", "none"])
+    try:
+        version = lmp.version()
+    finally:
+        lmp.close()
+    return {"host": platform.node(), "python": platform.python_version(), "numpy": np.__version__,
+            "lammps": version, "cpus": os.cpu_count()}
+
+
+def import_time(module="functions_library", repeat=5):
+    """
+    Cold import of a module, the best of `repeat` fresh interpreters, and the heavy backends loaded by the import
+    """
+    code = (f"import sys, time\nstart_time = time.perf_counter()\nimport {module}\n"
+            f"print(time.perf_counter() - start_time)\nprint(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    times, loaded = [], []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split("\n")
+        times.append(float(output[0]))
+        loaded = output[1].split()
+    return {"seconds": min(times), "budget": IMPORT_BUDGET, "heavy_modules": loaded}
+
+
+def check_import(result):
+    """
+    Problems of an import_time() result: over the budget or heavy backends imported, as list of strings
+    """
+    problems = []
+    if result["seconds"] > result["budget"]:
+        problems.append(f"import takes {result['seconds']:.3f} s, the budget is {result['budget']:.3f} s")
+    if result["heavy_modules"]:
+        problems.append(f"import loads {', '.join(result['heavy_modules'])}")
+    return problems
+
+
+def compare(report, baseline, tolerance=0.1):
+    """
+    Regressions of the report against a baseline report: every metric of a case which got worse by more than
+    `tolerance` (relative), as list of dicts
+    """
+    regressions = []
+    for name, row in report["cases"].items():
+        old = baseline["cases"].get(name)
+        if old is None:
+            continue
+        for metric, larger_is_better in METRICS.items():
+            if metric not in row or metric not in old:
+                continue
+            new_value, old_value = row[metric], old[metric]
+            if not larger_is_better and max(new_value, old_value) < MIN_TIME:
+                continue
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            if (larger_is_better and change < -tolerance) or (not larger_is_better and change > tolerance):
+                regressions.append({"case": name, "metric": metric, "baseline": old_value, "value": new_value,
+                                    "change": change})
+    return regressions
+
+
+def print_case(name, row):
+    if "error" in row:
+        print(f"{name:28s} failed: {row['error']}")
+        return
+    print(f"{name:28s} {row['atoms']:7d} atoms  {row['atom_steps_per_s']:12.4g} atom-steps/s  "
+          f"{row['ns_per_day']:8.3f} ns/day  setup {row['setup_s']:.3f} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the MD pipeline")
+    parser.add_argument("--elements", nargs="+", default=["Al", "Cu", "Ti"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1])
+    parser.add_argument("--outputs", nargs="+", choices=list(OUTPUTS), default=["none", "binary"])
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--quick", action="store_true", help="only a small and a large box per element")
+    parser.add_argument("--output", default="benchmark.json", help="report file")
+    parser.add_argument("--baseline", help="baseline report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--import-only", action="store_true", help="only check the import time of functions_library")
+    args = parser.parse_args(argv)
+
+    imported = import_time()
+    problems = check_import(imported)
+    print(f"Import of functions_library {imported['seconds']:.3f} s (budget {imported['budget']:.3f} s)")
+    for problem in problems:
+        print(f"Import regression: {problem}")
+    if args.import_only:
+        return 1 if problems else 0
+
+    report = run_benchmark(args.elements, QUICK_BOX_LENGTHS if args.quick else BOX_LENGTHS, args.threads,
+                           args.outputs, args.steps, callback=print_case)
+    report["import"] = imported
+    with open(args.output, "w") as fw:
+        json.dump(report, fw, indent=1)
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as fr:
+            regressions = compare(report, json.load(fr), args.tolerance)
+        for r in regressions:
+            print(f"Regression {r['case']} {r['metric']}: {r['baseline']:.4g} -> {r['value']:.4g} ({r['change']:+.1%})")
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
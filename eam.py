@@ -0,0 +1,421 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+# metal units of LAMMPS: g/mol, Angstrom, ps, eV, K
+MVV2E = 1.0364269e-4
+BOLTZ = 8.617343e-5
+
+# bump when the layout of the parsed-potential cache changes
+CACHE_VERSION = 1
+
+
+## setfl potentials
+def spline_coefficients(f, delta):
+    """
+    Cubic spline coefficients of a tabulated function, the same construction as the interpolate() of LAMMPS' pair eam.
+    Row m holds the value coefficients (c3, c4, c5, c6) and the derivative coefficients (d0, d1, d2)
+    """
+    n = len(f)
+    c = np.zeros((n, 7))
+    c[:, 6] = f
+    c[0, 5] = f[1] - f[0]
+    c[1, 5] = 0.5 * (f[2] - f[0])
+    c[n - 2, 5] = 0.5 * (f[n - 1] - f[n - 3])
+    c[n - 1, 5] = f[n - 1] - f[n - 2]
+    c[2:n - 2, 5] = ((f[0:n - 4] - f[4:n]) + 8.0 * (f[3:n - 1] - f[1:n - 3])) / 12.0
+    c[:n - 1, 4] = 3.0 * (f[1:] - f[:-1]) - 2.0 * c[:n - 1, 5] - c[1:, 5]
+    c[:n - 1, 3] = c[:n - 1, 5] + c[1:, 5] - 2.0 * (f[1:] - f[:-1])
+    c[:, 2] = c[:, 5] / delta
+    c[:, 1] = 2.0 * c[:, 4] / delta
+    c[:, 0] = 3.0 * c[:, 3] / delta
+    return c
+
+
+def spline_eval(c, x, delta):
+    """
+    Value and derivative of a tabulated function at x
+    """
+    p = np.asarray(x) / delta
+    m = np.clip(p.astype(np.int64), 0, len(c) - 2)
+    p = np.minimum(p - m, 1.0)
+    k = c[m]
+    value = ((k[..., 3] * p + k[..., 4]) * p + k[..., 5]) * p + k[..., 6]
+    derivative = (k[..., 0] * p + k[..., 1]) * p + k[..., 2]
+    return value, derivative
+
+
+class EAMPotential:
+    """
+    Tables of a setfl (eam/alloy) potential: embedding energy F(rho), electron density rho(r) and pair potential phi(r)
+    """
+    def __init__(self, elements, masses, lattice, nrho, drho, nr, dr, cutoff, F, rho, z2r, comments="", splines=None):
+        self.elements = list(elements)
+        self.masses = np.asarray(masses, dtype=float)
+        self.lattice = lattice
+        self.nrho, self.drho = nrho, drho
+        self.nr, self.dr = nr, dr
+        self.cutoff = cutoff
+        self.comments = comments
+        # F[i], rho[i] per element, z2r[i, j] = r*phi_ij(r) (symmetric)
+        self.F = np.asarray(F, dtype=float)
+        self.rho = np.asarray(rho, dtype=float)
+        self.z2r = np.asarray(z2r, dtype=float)
+        if splines is None:
+            splines = (np.array([spline_coefficients(f, drho) for f in self.F]),
+                       np.array([spline_coefficients(f, dr) for f in self.rho]),
+                       np.array([[spline_coefficients(f, dr) for f in row] for row in self.z2r]))
+        self.F_spline, self.rho_spline, self.z2r_spline = splines
+        self.rhomax = (nrho - 1) * drho
+
+    @property
+    def r(self):
+        return np.arange(self.nr) * self.dr
+
+    @property
+    def density_grid(self):
+        return np.arange(self.nrho) * self.drho
+
+    @property
+    def phi(self):
+        """
+        Pair potential phi(r) on the r grid, undefined (nan) at r = 0
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            phi = self.z2r / self.r
+        phi[..., 0] = np.nan
+        return phi
+
+    def index(self, element):
+        return self.elements.index(element)
+
+    def embedding(self, element_index, density):
+        """
+        F(rho) and F'(rho), beyond the table F is continued linearly like in LAMMPS
+        """
+        value, derivative = spline_eval(self.F_spline[element_index], np.minimum(density, self.rhomax), self.drho)
+        return value + derivative * np.maximum(density - self.rhomax, 0.0), derivative
+
+    def density(self, element_index, r):
+        return spline_eval(self.rho_spline[element_index], r, self.dr)
+
+    def pair(self, i, j, r):
+        """
+        phi(r) and phi'(r) from the tabulated r*phi(r)
+        """
+        z, dz = spline_eval(self.z2r_spline[i, j], r, self.dr)
+        phi = z / r
+        return phi, (dz - phi) / r
+
+
+def read_setfl(path):
+    """
+    Parse a setfl (.eam.alloy) file
+    """
+    with open(path) as fr:
+        lines = fr.readlines()
+    comments = "".join(lines[:3])
+    head = lines[3].split()
+    elements = head[1:1 + int(head[0])]
+    nrho, drho, nr, dr, cutoff = lines[4].split()[:5]
+    nrho, nr = int(nrho), int(nr)
+    drho, dr, cutoff = float(drho), float(dr), float(cutoff)
+
+    tokens = " ".join(lines[5:]).split()
+    pos = 0
+    masses, lattice, F, rho = [], [], [], []
+    for _ in elements:
+        _, mass, a, structure = tokens[pos:pos + 4]
+        pos += 4
+        masses.append(float(mass))
+        lattice.append((float(a), structure))
+        F.append(np.array(tokens[pos:pos + nrho], dtype=float))
+        pos += nrho
+        rho.append(np.array(tokens[pos:pos + nr], dtype=float))
+        pos += nr
+    n = len(elements)
+    z2r = np.zeros((n, n, nr))
+    for i in range(n):
+        for j in range(i + 1):
+            z2r[i, j] = z2r[j, i] = np.array(tokens[pos:pos + nr], dtype=float)
+            pos += nr
+    return EAMPotential(elements, masses, lattice, nrho, drho, nr, dr, cutoff, F, rho, z2r, comments)
+
+
+## Parsed-potential cache
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fr:
+        for block in iter(lambda: fr.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def save_potential(potential, directory):
+    """
+    Write the tables and spline coefficients of a potential as .npy files plus meta.json.
+    The directory is written under a temporary name and renamed, so readers never see a partial cache
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    arrays = {"masses": potential.masses, "F": potential.F, "rho": potential.rho, "z2r": potential.z2r,
+              "F_spline": potential.F_spline, "rho_spline": potential.rho_spline, "z2r_spline": potential.z2r_spline}
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+    meta = {"version": CACHE_VERSION, "elements": potential.elements, "lattice": potential.lattice,
+            "nrho": potential.nrho, "drho": potential.drho, "nr": potential.nr, "dr": potential.dr,
+            "cutoff": potential.cutoff, "comments": potential.comments}
+    with open(os.path.join(tmp, "meta.json"), "w") as fw:
+        json.dump(meta, fw)
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        # another process has written the same cache in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def open_potential(directory):
+    """
+    Potential from a cache directory, the tables are memory-mapped
+    """
+    with open(os.path.join(directory, "meta.json")) as fr:
+        meta = json.load(fr)
+    if meta["version"] != CACHE_VERSION:
+        raise ValueError(f"{directory} has cache version {meta['version']}, expected {CACHE_VERSION}")
+    arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+              for name in ["masses", "F", "rho", "z2r", "F_spline", "rho_spline", "z2r_spline"]}
+    return EAMPotential(meta["elements"], arrays["masses"], [tuple(l) for l in meta["lattice"]],
+                        meta["nrho"], meta["drho"], meta["nr"], meta["dr"], meta["cutoff"],
+                        arrays["F"], arrays["rho"], arrays["z2r"], meta["comments"],
+                        splines=(arrays["F_spline"], arrays["rho_spline"], arrays["z2r_spline"]))
+
+
+def load_potential(path, cache_dir=None):
+    """
+    Potential of a setfl file through the binary cache, keyed by content hash and cache version.
+    The file is parsed only the first time, later loads map the cached arrays.
+    The cache defaults to .cache next to the potential file
+    """
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+    key = f"{os.path.basename(path)}-{file_hash(path)[:16]}-v{CACHE_VERSION}"
+    directory = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        save_potential(read_setfl(path), directory)
+    return open_potential(directory)
+
+
+## Neighbor search
+def cell_vectors(cell):
+    """
+    Cell vectors as rows and origin of a cell matrix (cell vectors and origin as columns)
+    """
+    cell = np.asarray(cell, dtype=float)
+    return cell[:, :3].T, cell[:, 3]
+
+
+def neighbor_pairs(positions, cell, pbc, cutoff):
+    """
+    All pairs (i, j, d) with |d| < cutoff, d = x_i - x_j for the closest periodic image(s) of j.
+    Periodic images are added as ghost atoms, so boxes smaller than twice the cutoff work as well.
+    The search uses a cell list with bins of the cutoff size and is fully vectorized
+    """
+    positions = np.asarray(positions, dtype=float)
+    n = len(positions)
+    vectors, origin = cell_vectors(cell)
+    inverse = np.linalg.inv(vectors)
+    fractional = (positions - origin) @ inverse
+    pbc = np.asarray(pbc, dtype=bool)
+    fractional[:, pbc] %= 1.0
+
+    # width of the cell perpendicular to each pair of cell vectors
+    volume = abs(np.linalg.det(vectors))
+    widths = np.array([volume / np.linalg.norm(np.cross(vectors[(k + 1) % 3], vectors[(k + 2) % 3])) for k in range(3)])
+    margin = cutoff / widths
+    images = np.where(pbc, np.ceil(margin).astype(int), 0)
+    shifts = np.array(np.meshgrid(*[np.arange(-m, m + 1) for m in images], indexing="ij")).reshape(3, -1).T
+
+    owner, ghost_fractional = [np.arange(n)], [fractional]
+    for shift in shifts:
+        if not shift.any():
+            continue
+        shifted = fractional + shift
+        keep = np.all((shifted > -margin) | ~pbc, axis=1) & np.all((shifted < 1.0 + margin) | ~pbc, axis=1)
+        owner.append(np.nonzero(keep)[0])
+        ghost_fractional.append(shifted[keep])
+    owner = np.concatenate(owner)
+    all_positions = np.concatenate(ghost_fractional) @ vectors + origin
+
+    # cell list over the local and ghost atoms
+    low = all_positions.min(axis=0)
+    n_bins = np.maximum(((all_positions.max(axis=0) - low) / cutoff).astype(int), 1)
+    bins = np.minimum(((all_positions - low) / cutoff).astype(int), n_bins - 1)
+    bin_id = np.ravel_multi_index(bins.T, n_bins)
+    order = np.argsort(bin_id, kind="stable")
+    bin_start = np.searchsorted(bin_id[order], np.arange(np.prod(n_bins) + 1))
+
+    pairs_i, pairs_j = [], []
+    local = np.arange(n)
+    for offset in np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij")).reshape(3, -1).T:
+        neighbor = bins[local] + offset
+        valid = np.all((neighbor >= 0) & (neighbor < n_bins), axis=1)
+        i = local[valid]
+        nb = np.ravel_multi_index(neighbor[valid].T, n_bins)
+        start, count = bin_start[nb], bin_start[nb + 1] - bin_start[nb]
+        i = np.repeat(i, count)
+        within = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        pairs_i.append(i)
+        pairs_j.append(order[np.repeat(start, count) + within])
+    i, j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+    d = all_positions[i] - all_positions[j]
+    r2 = np.einsum("ij,ij->i", d, d)
+    keep = (r2 < cutoff * cutoff) & (i != j)
+    return i[keep], owner[j[keep]], d[keep]
+
+
+## Energies and forces
+class EAMCalculator:
+    """
+    Vectorized EAM energy and forces of a structure, types are 1-based Lammps types mapped to elements of the potential
+    """
+    def __init__(self, potential, elements):
+        self.potential = potential
+        if isinstance(elements, str):
+            elements = [elements]
+        self.type_index = np.array([potential.index(e) for e in elements])
+
+    def compute(self, positions, cell, pbc, types):
+        """
+        Total potential energy, per-atom energies and forces (eV, eV/Angstrom)
+        """
+        pot = self.potential
+        n = len(positions)
+        species = self.type_index[np.asarray(types, dtype=int) - 1]
+        i, j, d = neighbor_pairs(positions, cell, pbc, pot.cutoff)
+        r = np.sqrt(np.einsum("ij,ij->i", d, d))
+
+        # densities rho_{type j}(r) at i and rho_{type i}(r) at j, per species to keep the tables vectorized
+        rho_j, drho_j = np.zeros_like(r), np.zeros_like(r)
+        rho_i, drho_i = np.zeros_like(r), np.zeros_like(r)
+        phi, dphi = np.zeros_like(r), np.zeros_like(r)
+        for a in np.unique(species):
+            mask = species[j] == a
+            rho_j[mask], drho_j[mask] = pot.density(a, r[mask])
+            mask = species[i] == a
+            rho_i[mask], drho_i[mask] = pot.density(a, r[mask])
+            for b in np.unique(species):
+                mask = (species[i] == a) & (species[j] == b)
+                phi[mask], dphi[mask] = pot.pair(a, b, r[mask])
+
+        density = np.bincount(i, weights=rho_j, minlength=n)
+        embed, dembed = np.zeros(n), np.zeros(n)
+        for a in np.unique(species):
+            mask = species == a
+            embed[mask], dembed[mask] = pot.embedding(a, density[mask])
+
+        energies = embed + 0.5 * np.bincount(i, weights=phi, minlength=n)
+        scale = (dembed[i] * drho_j + dembed[j] * drho_i + dphi) / r
+        forces = -np.column_stack([np.bincount(i, weights=scale * d[:, k], minlength=n) for k in range(3)])
+        return energies.sum(), energies, forces
+
+
+## Molecular dynamics
+def temperature(velocities, masses):
+    n = len(velocities)
+    kinetic = 0.5 * MVV2E * np.sum(masses[:, None] * velocities ** 2)
+    return 2.0 * kinetic / (max(3 * n - 3, 1) * BOLTZ)
+
+
+def create_velocities(masses, T, seed):
+    """
+    Gaussian velocities (Angstrom/ps) at temperature T without centre-of-mass motion
+    """
+    rng = np.random.default_rng(seed)
+    v = rng.normal(size=(len(masses), 3)) * np.sqrt(BOLTZ * T / (masses[:, None] * MVV2E))
+    v -= np.average(v, axis=0, weights=masses)
+    if T > 0:
+        v *= np.sqrt(T / temperature(v, masses))
+    return v
+
+
+def run_md(calculator, positions, cell, pbc, types, masses, steps, timestep=0.001, start_temperature=300.0,
+           end_temperature=None, tdamp=0.1, seed=100, thermo_every=100, callback=None):
+    """
+    Velocity-Verlet integration with a Nose-Hoover thermostat ramped from start to end temperature, like fix nvt.
+    Atom masses are per atom (g/mol). callback(step, positions, velocities, energy) is called every thermo_every steps.
+    Returns positions, velocities and the thermo rows (step, temperature, potential energy, total energy)
+    """
+    end_temperature = start_temperature if end_temperature is None else end_temperature
+    masses = np.asarray(masses, dtype=float)
+    x = np.array(positions, dtype=float)
+    v = create_velocities(masses, start_temperature, seed)
+    n_dof = max(3 * len(x) - 3, 1)
+    energy, _, f = calculator.compute(x, cell, pbc, types)
+    accel = f / (masses[:, None] * MVV2E)
+    xi = 0.0
+    thermo = []
+
+    for step in range(steps + 1):
+        if step % thermo_every == 0 or step == steps:
+            T = temperature(v, masses)
+            kinetic = 0.5 * MVV2E * np.sum(masses[:, None] * v ** 2)
+            thermo.append((step, T, energy, energy + kinetic))
+            if callback is not None:
+                callback(step, x, v, energy)
+        if step == steps:
+            break
+        target = start_temperature + (end_temperature - start_temperature) * step / max(steps, 1)
+        # half step of the thermostat friction, velocities and positions
+        kinetic = 0.5 * MVV2E * np.sum(masses[:, None] * v ** 2)
+        xi += 0.5 * timestep * (2.0 * kinetic / (n_dof * BOLTZ * max(target, 1e-6)) - 1.0) / tdamp ** 2
+        v = (v + 0.5 * timestep * accel) * np.exp(-0.5 * timestep * xi)
+        x += timestep * v
+        energy, _, f = calculator.compute(x, cell, pbc, types)
+        accel = f / (masses[:, None] * MVV2E)
+        v = (v * np.exp(-0.5 * timestep * xi)) + 0.5 * timestep * accel
+        kinetic = 0.5 * MVV2E * np.sum(masses[:, None] * v ** 2)
+        xi += 0.5 * timestep * (2.0 * kinetic / (n_dof * BOLTZ * max(target, 1e-6)) - 1.0) / tdamp ** 2
+    return x, v, np.array(thermo)
+
+
+## Lammps data files
+def read_data(path):
+    """
+    Read positions, cell matrix, types and masses of an atomic Lammps data file
+    """
+    with open(path) as fr:
+        lines = [line.split("#")[0].strip() for line in fr]
+    n_atoms, bounds, tilt, masses = 0, {}, (0.0, 0.0, 0.0), {}
+    atoms = None
+    k = 1
+    while k < len(lines):
+        words = lines[k].split()
+        if words[-1:] == ["atoms"]:
+            n_atoms = int(words[0])
+        elif words[-2:] in (["xlo", "xhi"], ["ylo", "yhi"], ["zlo", "zhi"]):
+            bounds[words[2][0]] = (float(words[0]), float(words[1]))
+        elif words[-3:] == ["xy", "xz", "yz"]:
+            tilt = tuple(float(w) for w in words[:3])
+        elif words[:1] == ["Masses"]:
+            k += 2
+            while k < len(lines) and lines[k]:
+                type_id, mass = lines[k].split()[:2]
+                masses[int(type_id)] = float(mass)
+                k += 1
+        elif words[:1] == ["Atoms"]:
+            k += 2
+            atoms = np.array([lines[k + m].split()[:5] for m in range(n_atoms)], dtype=float)
+            break
+        k += 1
+    atoms = atoms[np.argsort(atoms[:, 0])]
+    (xlo, xhi), (ylo, yhi), (zlo, zhi) = bounds["x"], bounds["y"], bounds["z"]
+    xy, xz, yz = tilt
+    cell = np.array([[xhi - xlo, xy, xz, xlo],
+                     [0.0, yhi - ylo, yz, ylo],
+                     [0.0, 0.0, zhi - zlo, zlo]])
+    types = atoms[:, 1].astype(int)
+    return atoms[:, 2:5], cell, types, masses
@@ -1,22 +1,38 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import os
 import subprocess
 import time
-from dataclasses import dataclass
+import csv
+import json
+import hashlib
+import re
+import functools
+import fcntl
+import itertools
+import threading
+import tempfile
+import atexit
+from contextlib import contextmanager, nullcontext
+import multiprocessing
+from collections import OrderedDict
+from dataclasses import dataclass, fields, replace
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import shutil
-import ipywidgets
-from ipywidgets import interact, fixed, interact_manual, widgets, Button, Layout, AppLayout, VBox
-from ovito.io import import_file
-from ovito.modifiers import PolyhedralTemplateMatchingModifier
-from ovito.vis import *
-from ovito.pipeline import *
-from ovito.data import DataCollection
-from lammps import lammps
+# ovito, lammps and ipywidgets are imported by the functions which use them, so scripts and worker processes
+# which only set up runs or read results do not pay their import time
+import eam
+import lattice
+import analysis
+import jobqueue
+from trajectory import open_trajectory, convert_dump, export_dump, SeriesWriter, write_columns, read_columns, SUFFIX as TRAJECTORY_SUFFIX
+from trajectory import write_frame_types, read_frame_types, TYPES_SUFFIX
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+# number of steps of the solid-solid phase transformation run
+PT_RUNNING_STEPS = 60000
+
 
 # Dataclass
 @dataclass
@@ -31,6 +47,21 @@ class MD_system:
     end_temperature: int =None
     thermo_time :int = 200
     running_steps :int = 150000
+    trajectory_format :str = "binary"
+    dump_trajectory :bool = True
+    insitu_every :int = 0
+    checkpoint_every :int = 0
+    extended_steps :int = 0
+    accelerator :str = "none"
+    threads :int = 0
+    mpi_ranks :int = 1
+    neighbor_tuning :str = "fixed"
+    dump_every :int = 0
+    stop_on_transition :str = ""
+    transition_every :int = 1000
+    transition_settle :int = 10000
+    frame_budget :int = 0
+    queue :bool = True
     
     @property
     def potential_name(self):
@@ -61,6 +92,54 @@ class MD_system:
             melting_point = self.atoms["melting_point"]
         return alat_min, alat_max, atom_mass, melting_point, color
     
+    @property
+    def run_dir(self):
+        return os.path.abspath(f"./{self.Project_name}")
+
+    @property
+    def dump_name(self):
+        if self.element == 'Ti':
+            return "phasetransfomation"
+        return "melting"
+
+    @property
+    def dump_interval(self):
+        # steps between dump frames, dump_every=0 keeps the cadence of the notebooks
+        if self.dump_every:
+            return self.dump_every
+        if self.element == 'Ti':
+            return self.thermo_time
+        return 200
+
+    @property
+    def adaptive_dump(self):
+        # lammps writes the frames with a stride switched between chunks, dense while the system changes quickly,
+        # at most frame_budget of them
+        return self.dump_trajectory and self.frame_budget > 0
+
+    @property
+    def nearest_distance(self):
+        # nearest neighbour distance of the initial lattice: a/sqrt(2) for fcc, sqrt(a^2/3 + c^2/4) for the hcp
+        # cell of Ti, whose c/a of 1.588 is below the ideal ratio so the atoms of the adjacent planes are closer than a
+        a = float(self.lattice_constant)
+        if self.element == 'Ti':
+            c = lattice.HCP_CELL[2, 2] * a
+            return min(a, np.sqrt(a * a / 3 + c * c / 4))
+        return a / np.sqrt(2)
+
+    @property
+    def chunked(self):
+        # the run is driven from Python in chunks instead of a single run command, MPI runs use a single run command
+        return (bool(self.insitu_every or self.checkpoint_every or self.stop_on_transition or self.adaptive_dump)
+                and self.mpi_ranks <= 1)
+
+    @property
+    def total_steps(self):
+        # temperature ramp plus the steps added by extend()
+        if self.element == 'Ti':
+            return PT_RUNNING_STEPS + self.extended_steps
+        return self.running_steps + self.extended_steps
+
     @property
     def random_number(self):
         seed = np.int64(self.seed)
@@ -81,63 +160,172 @@ def copy_file(source, target):
     
 def Checkdir(keyword):
     '''
-    Check whether the file with corresponding key already existed.
-    When the file existed, it will be removed
+    Check whether the directory named keyword already existed.
+    When the directory existed, it will be removed. Only the exact name matches, other entries of the working
+    directory (structures, potentials, caches, other projects) are kept
     '''
-    root = os.getcwd()
-    dir_list = os.listdir("./")
-    for path in dir_list:
-        if keyword in path:
-            dir_path = f"{root}/{path}"
-            if os.path.exists(dir_path):
-                print(f"The dictionary {dir_path} will be removed!")
-                shutil.rmtree(dir_path)
-            else:
-                pass
+    dir_path = os.path.join(os.getcwd(), keyword)
+    if os.path.isdir(dir_path):
+        print(f"The dictionary {dir_path} will be removed!")
+        shutil.rmtree(dir_path)
     
     
 def showtime(func):
     """
-    Show the running time of a function
+    Show the running time of a function, the time of the last call is kept in wrapper.running_time
     """
-    def wrapper(System):
+    @functools.wraps(func)
+    def wrapper(System, *args, **kwargs):
         start_time = time.time()
-        func(System)
+        result = func(System, *args, **kwargs)
         end_time = time.time()
+        wrapper.running_time = end_time - start_time
         print('Running time is {} s'.format(end_time - start_time))
+        return result
+    wrapper.running_time = None
     return wrapper
 
 
 ## Lammps simulation
 def copy_potential(s:MD_system):
-    copy_file(f"./potentials/{s.potential_name}", f"./{s.Project_name}/{s.potential_name}")
+    """
+    Reference the potential from the run directory with a symbolic link, files are copied where links are not supported
+    """
+    source = os.path.abspath(f"./potentials/{s.potential_name}")
+    target = os.path.join(s.run_dir, s.potential_name)
+    try:
+        os.symlink(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
 
 def copy_structure(s:MD_system):
     copy_file(f"./structures/initial_{s.element}", f"./{s.Project_name}/initial_{s.element}")
 
-def write_input_melting(System):
+def run_file(s:MD_system, name):
     """
-    Write input-file for running Lammps
+    Quoted absolute path of a file in the run directory, so that the input does not depend on the working directory
     """
-    with open(f"./{System.Project_name}/lammps_input", "w+") as fw:
-        fw.write(f"""
-dimension 3
+    return f'"{os.path.join(s.run_dir, name)}"'
+
+
+def ensemble_fix(s:MD_system, start_temperature, end_temperature):
+    """
+    Thermostat (Al/Cu) or thermostat and barostat (Ti) from start to end temperature
+    """
+    if s.element in ['Ti']:
+        return f"fix ensemble all npt temp {start_temperature} {end_temperature} 0.1 x 10.0 10.0 1.0 y 10.0 10.0 1.0 z 10.0 10.0 1.0 xy 0.0 0.0 1.0 xz 0.0 0.0 1.0 yz 0.0 0.0 1.0"
+    return f"fix 2 all nvt temp {start_temperature} {end_temperature} 0.1"
+
+
+def run_segments(s:MD_system, step=0):
+    """
+    Segments (fix, first step, last step, ramp start, ramp stop) which take the system from `step` to its last step:
+    the temperature ramp of the input, then the steps added by extend() at the end temperature
+    """
+    ramp = s.total_steps - s.extended_steps
+    segments = []
+    if step < ramp:
+        segments.append((None, step, ramp, 0, ramp))
+    if s.extended_steps and step < s.total_steps:
+        fix = ensemble_fix(s, s.end_temperature, s.end_temperature)
+        segments.append((fix, max(step, ramp), s.total_steps, ramp, s.total_steps))
+    return segments
+
+
+def run_commands(s:MD_system, step=0):
+    """
+    The run commands at the end of the input, left out when the run is driven in chunks from Python
+    """
+    if s.chunked:
+        return ""
+    lines = []
+    for fix, first, last, ramp_start, ramp_stop in run_segments(s, step):
+        if fix is not None:
+            lines.append(fix)
+        if (first, last) == (ramp_start, ramp_stop):
+            lines.append(f"run {last - first}")
+        else:
+            lines.append(f"run {last - first} start {ramp_start} stop {ramp_stop}")
+    return "\n".join(lines)
+
+
+def read_command(s:MD_system, restart=None):
+    """
+    Read the initial structure, or the restart file when a run is resumed
+    """
+    if restart is not None:
+        return f'read_restart "{restart}"'
+    return f'read_data {run_file(s, f"initial_{s.element}")}'
+
+
+SETTINGS = """dimension 3
 units metal
 atom_style atomic
-boundary p p p
+boundary p p p"""
+
+# free surfaces of the melting cluster, 3 Angstrom of vacuum around the block
+CLUSTER_BOX = """change_box all x delta 0 3 
+change_box all y delta 0 3 
+change_box all z delta 0 3 boundary s s s"""
+
+
+def fresh_only(restart, command):
+    """
+    Commands which only belong to a new run, the restart file already holds their result
+    """
+    if restart is not None:
+        return ""
+    return command
+
+
+def print_command(s:MD_system, restart=None):
+    # runs driven in chunks collect the thermo output in memory (ThermoCapture)
+    if s.chunked:
+        return ""
+    mode = "file" if restart is None else "append"
+    return f"fix thermo all print {s.thermo_time} '$t $m' {mode} {run_file(s, 'thermo_output.dat')} screen no"
+
+
+def dump_style(s:MD_system):
+    """
+    Columns and dump_modify options of the trajectory dump
+    """
+    if s.element == 'Ti':
+        return ("id type xsu ysu zsu fx fy fz vx vy vz",
+                'sort id format line "%d %d %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g"')
+    return "id type xs ys zs", ""
+
+
+def dump_command(s:MD_system, command, restart=None, step=0):
+    """
+    Dump commands of the input. A resumed run appends to the dump and skips the frame of the restart step.
+    Adaptive output defines its own dump (AdaptiveDump) and has no dump command
+    """
+    if not s.dump_trajectory or s.adaptive_dump:
+        return ""
+    if restart is not None and command.startswith("dump "):
+        command += f"\ndump_modify 1 append yes delay {step + 1}"
+    return command
+
+
+def write_input_melting(System, input_name="lammps_input", restart=None, step=0):
+    """
+    Write input-file for running Lammps, with a restart file the input continues a run from `step`
+    """
+    with open(f"./{System.Project_name}/{input_name}", "w+") as fw:
+        fw.write(f"""
+{fresh_only(restart, SETTINGS)}
 
-read_data ../structures/initial_{System.element}
+{read_command(System, restart)}
 
 pair_style eam/alloy
-pair_coeff * * {System.potential_name} {System.element}
+pair_coeff * * {run_file(System, System.potential_name)} {System.element}
 
-neighbor 3.0 bin
+{neighbor_commands(System, "neighbor 3.0 bin")}
 
-write_data original
+{fresh_only(restart, f'write_data {run_file(System, "original")}')}
 
-change_box all x delta 0 3 
-change_box all y delta 0 3 
-change_box all z delta 0 3 boundary s s s
+{fresh_only(restart, CLUSTER_BOX)}
 
 timestep {System.timestep}
 
@@ -147,112 +335,1421 @@ thermo_style custom step temp vol press
 
 variable t equal step
 variable m equal temp
-fix thermo all print {System.thermo_time} '$t $m' file thermo_output.dat screen no
+{print_command(System, restart)}
 
-velocity all create {System.start_temperature} {System.random_number} mom yes rot yes dist gaussian
+{fresh_only(restart, f"velocity all create {System.start_temperature} {System.random_number} mom yes rot yes dist gaussian")}
 
-dump 1 all custom 200 melting id type xs ys zs
+{dump_command(System, f'dump 1 all custom {System.dump_interval} {run_file(System, "melting")} {dump_style(System)[0]}', restart, step)}
 
-fix 2 all nvt temp {System.start_temperature} {System.end_temperature} 0.1
+{ensemble_fix(System, System.start_temperature, System.end_temperature)}
 
-run {System.running_steps}
+{run_commands(System, step)}
         """)
         
-def write_sturcture_Ti(s:MD_system):
+def write_input_PT(System, input_name="lammps_input", restart=None, step=0):
+    # PT:Phasetransformation
     """
-    write the structure file of primivte cell of Ti
+    Write input-file for running Lammps, with a restart file the input continues a run from `step`
     """
-    aLat = s.lattice_constant
-    with open(f"./structures/hcp_Ti", "w+") as fw:
-        fw.write(f"""Start File for LAMMPS
-2 atoms
-1 atom types
+    with open(f"./{System.Project_name}/{input_name}", "w+") as fw:
+        fw.write(f"""
+{fresh_only(restart, SETTINGS)}
+box tilt large
+
+{read_command(System, restart)}
+
+pair_style eam/alloy
+pair_coeff * * {run_file(System, System.potential_name)} {System.element}
+
+{neighbor_commands(System, "")}
+
+{fresh_only(restart, f'write_data {run_file(System, "original")}')}
 
-0.0 {1.00*aLat} xlo xhi
-0.0 {0.866025*aLat} ylo yhi
-0.0 {1.588*aLat} zlo zhi
-{0.5*aLat} 0E-15 0E-15 xy xz yz
+timestep {System.timestep}
+
+{ensemble_fix(System, System.start_temperature, System.end_temperature)}
 
-Masses
+{fresh_only(restart, f"velocity all create {System.start_temperature} {System.random_number} dist gaussian")}
 
-1 47.867000
+{dump_command(System, f'dump 1 all custom {System.dump_interval} {run_file(System, "phasetransfomation")} {dump_style(System)[0]}', restart, step)}
+{dump_command(System, f'dump_modify 1 {dump_style(System)[1]}')}
+thermo_style custom step temp pe etotal vol
+# thermo_style custom step temp pe etotal pxx pxy pxz pyy pyz pzz vol
+thermo_modify format float %20.15g
+thermo {System.thermo_time}
 
-Atoms
+variable t equal step
+variable m equal temp
+{print_command(System, restart)}
 
-1 1 0.000000000000000 0.000000000000000 0.000000000000000
-2 1 0.000000000000000 {0.577350269189626*aLat} {0.794000000000000*aLat}      
+{run_commands(System, step)}
         """)
+    
 
+## Lammps sessions
+def process_memory():
+    """
+    Resident memory of the process in bytes (peak memory where /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm") as fr:
+            return int(fr.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
 
-def write_input_PT(System):
-    # PT:Phasetransformation
+
+class LammpsPool:
     """
-    Write input-file for running Lammps
+    Small pool of warm Lammps instances. A returned instance is reset with clear, it is closed instead when the pool
+    is full or the session raised, so every instance is either idle in the pool or closed.
+    The memory of the process before and after each session is recorded per instance
     """
-    with open(f"./{System.Project_name}/lammps_input", "w+") as fw:
-        fw.write(f"""
-dimension 3
+    def __init__(self, size=2):
+        self.size = size
+        self.idle = []
+        self.stats = {}
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    @contextmanager
+    def session(self, screen=True, log=None, args=()):
+        """
+        Lammps instance for one use, e.g. `with lammps_pool.session(log=path) as lmp: ...`.
+        args are further command line arguments (accelerator suffix and package), instances are only shared between
+        sessions with the same arguments
+        """
+        cmdargs = ["-log", "none"] + ([] if screen else ["-screen", "none"]) + list(args)
+        with self.lock:
+            matching = [entry for entry in self.idle if entry[1] == cmdargs]
+            if matching:
+                self.idle.remove(matching[-1])
+        if not matching:
+            from lammps import lammps
+        lmp = matching[-1][0] if matching else lammps(cmdargs=cmdargs)
+        stats = self.stats.setdefault(id(lmp), {"uses": 0, "closed": False, "memory": 0, "peak_memory": 0})
+        before = process_memory()
+        reuse = False
+        try:
+            if log is not None:
+                lmp.command(f'log "{log}"')
+            yield lmp
+            reuse = True
+        finally:
+            stats["uses"] += 1
+            stats["memory"] = process_memory() - before
+            stats["peak_memory"] = max(stats["peak_memory"], stats["memory"])
+            self.release(lmp, cmdargs, reuse)
+
+    def release(self, lmp, cmdargs, reuse):
+        if reuse:
+            try:
+                lmp.command("clear")
+                lmp.command("log none")
+            except Exception:
+                reuse = False
+        with self.lock:
+            if reuse and len(self.idle) < self.size:
+                self.idle.append((lmp, cmdargs))
+                return
+        self.stats[id(lmp)]["closed"] = True
+        lmp.close()
+
+    def report(self):
+        """
+        Uses and memory (bytes) of the last and the largest session per instance
+        """
+        return [dict(instance=key, **value) for key, value in self.stats.items()]
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for lmp, _ in idle:
+            self.stats[id(lmp)]["closed"] = True
+            lmp.close()
+
+
+lammps_pool = LammpsPool()
+
+
+def run_lammps(input_file, screen=True, on_start=None, driver=None, execution=None):
+    """
+    Run a Lammps input file with an instance of the pool, the log is written next to the input file.
+    on_start(lmp) is called with the Lammps instance before the input is executed,
+    driver(lmp) afterwards for runs which are driven from Python.
+    execution is a resolved setting of execution_config(), runs with several MPI ranks are started with mpirun
+    """
+    execution = execution or {"accelerator": "none", "threads": 1, "mpi_ranks": 1}
+    if execution["mpi_ranks"] > 1:
+        if driver is not None:
+            raise ValueError("Runs driven from Python cannot use several MPI ranks")
+        return run_mpi(input_file, execution, on_start=on_start)
+    log = os.path.join(os.path.dirname(os.path.abspath(input_file)), "log.lammps")
+    with lammps_pool.session(screen=screen, log=log, args=accelerator_args(execution)) as lmp:
+        if on_start is not None:
+            on_start(lmp)
+        lmp.file(input_file)
+        if driver is not None:
+            driver(lmp)
+        return int(lmp.extract_global("ntimestep"))
+
+
+## Execution settings
+ACCELERATORS = ["none", "opt", "omp"]
+
+# calibrated settings per element, size class, machine and Lammps version
+EXECUTION_CACHE = "./.md_cache/execution.json"
+
+
+def accelerator_args(execution):
+    """
+    Command line arguments of Lammps for an accelerator package: -sf opt, or -sf omp with the number of threads
+    """
+    if execution["accelerator"] == "opt":
+        return ["-sf", "opt"]
+    if execution["accelerator"] == "omp":
+        return ["-sf", "omp", "-pk", "omp", str(execution["threads"])]
+    return []
+
+
+def execution_config(s:MD_system):
+    """
+    Execution setting of the system as dict (accelerator, threads, mpi_ranks). accelerator="auto" picks the fastest
+    setting for the number of atoms from a cached calibration of the structure in the run directory,
+    threads=0 uses all cores of the machine
+    """
+    threads = s.threads or os.cpu_count() or 1
+    if s.accelerator == "auto":
+        return dict(calibrated_config(s), mpi_ranks=s.mpi_ranks)
+    if s.accelerator not in ACCELERATORS:
+        raise ValueError(f"Unknown accelerator {s.accelerator}, use one of {ACCELERATORS + ['auto']}")
+    return {"accelerator": s.accelerator, "threads": threads if s.accelerator == "omp" else 1, "mpi_ranks": s.mpi_ranks}
+
+
+class MPIProcess:
+    """
+    Handle of a Lammps run under mpirun, in place of the Lammps instance passed to on_start.
+    force_timeout() stops the processes and records the cancel request
+    """
+    def __init__(self, process):
+        self.process = process
+        self.cancelled = False
+
+    def force_timeout(self):
+        self.cancelled = True
+        if self.process.poll() is None:
+            self.process.terminate()
+
+
+def run_mpi(input_file, execution, on_start=None):
+    """
+    Run a Lammps input file with execution["mpi_ranks"] MPI ranks through mpi4py (see mpi_run.py), returns the last step
+    """
+    log = os.path.join(os.path.dirname(os.path.abspath(input_file)), "log.lammps")
+    runner = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mpi_run.py")
+    command = ["mpirun", "-np", str(execution["mpi_ranks"]), sys.executable, runner, input_file, log]
+    command += accelerator_args(execution)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    handle = MPIProcess(process)
+    if on_start is not None:
+        on_start(handle)
+    output, _ = process.communicate()
+    # mpirun may report the terminated ranks with any exit code
+    if process.returncode != 0 and not handle.cancelled:
+        raise RuntimeError(f"mpirun failed with exit code {process.returncode}:\n{output[-2000:]}")
+    steps = re.findall(r"^step (\d+)$", output, re.MULTILINE)
+    if steps:
+        return int(steps[-1])
+    sample = None
+    with open(log, errors="ignore") as fr:
+        for line in fr:
+            match = re.match(r"Loop time of .* for (\d+) steps", line)
+            if match:
+                sample = int(match.group(1))
+    return sample or 0
+
+
+def size_class(n_atoms):
+    # calibrations are shared by systems within a factor of two of atoms
+    return int(np.log2(max(n_atoms, 1)))
+
+
+def pilot_run(s:MD_system, structure, execution, steps, settings=""):
+    """
+    Short run of the structure file at the end temperature with an execution setting and further input commands
+    (e.g. neighbor settings). Returns the atom-steps per second and the Lammps timing of the run
+    """
+    boundary = "s s s" if s.element in ['Al', 'Cu'] else "p p p"
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, "log.lammps")
+        with lammps_pool.session(screen=False, log=log, args=accelerator_args(execution)) as lmp:
+            lmp.commands_string(f"""
 units metal
 atom_style atomic
 boundary p p p
 box tilt large
+read_data "{structure}"
+change_box all boundary {boundary}
+pair_style eam/alloy
+pair_coeff * * "{os.path.abspath(f'./potentials/{s.potential_name}')}" {s.element}
+{settings}
+timestep {s.timestep}
+velocity all create {s.end_temperature or 1000} {s.random_number} mom yes rot yes dist gaussian
+fix 2 all nve
+run 10 post no
+""")
+            start_time = time.time()
+            lmp.command(f"run {steps} pre no")
+            elapsed = time.time() - start_time
+            rate = lmp.get_natoms() * steps / elapsed
+        return rate, lammps_timing(log)
+
+
+def calibration_candidates():
+    """
+    Execution settings worth measuring with the accelerator packages of the installed Lammps
+    """
+    with lammps_pool.session(screen=False) as lmp:
+        packages = set(lmp.installed_packages)
+    candidates = [{"accelerator": "none", "threads": 1}]
+    if "OPT" in packages:
+        candidates.append({"accelerator": "opt", "threads": 1})
+    if "OPENMP" in packages:
+        cores = os.cpu_count() or 1
+        threads = sorted({n for n in [2, 4, 8, 16, 32, cores] if 1 < n <= cores})
+        candidates += [{"accelerator": "omp", "threads": n} for n in threads]
+    return candidates
+
+
+def calibrate(s:MD_system, structure, steps=200):
+    """
+    Measure every candidate setting on a structure file of the system, returns the rates as list of (setting, rate)
+    """
+    results = []
+    for candidate in calibration_candidates():
+        try:
+            results.append((candidate, pilot_run(s, structure, candidate, steps)[0]))
+        except Exception as e:
+            print(f"Calibration of {candidate} failed: {e}")
+    return results
 
-read_data ../structures/initial_Ti
 
-pair_style eam/alloy
-pair_coeff * * {System.potential_name} {System.element}
+def read_json_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fr:
+        return json.load(fr)
 
-write_data original
 
-timestep {System.timestep}
+def update_json_cache(path, key, value):
+    """
+    Add an entry to a JSON cache shared by several processes. The file is read again under a lock, so entries
+    which other processes added meanwhile are kept
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            cache = dict(read_json_cache(path), **{key: value})
+            with open(f"{path}.{os.getpid()}.tmp", "w") as fw:
+                json.dump(cache, fw, indent=1)
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return value
+
+
+def calibrated_config(s:MD_system, path=EXECUTION_CACHE):
+    """
+    Fastest single-process setting for the size of the system, calibrated once per element, size class, machine and
+    Lammps version and kept in the execution cache
+    """
+    with lammps_pool.session(screen=False) as lmp:
+        version = lmp.version()
+    structure = os.path.join(s.run_dir, f"initial_{s.element}")
+    key = f"{s.element}-{size_class(count_atoms(structure))}-{os.cpu_count()}-{version}"
+    cache = read_json_cache(path)
+    if key not in cache:
+        results = calibrate(s, structure)
+        if not results:
+            return {"accelerator": "none", "threads": 1}
+        best, rate = max(results, key=lambda item: item[1])
+        cache[key] = update_json_cache(path, key, dict(best, rate=rate))
+    return {"accelerator": cache[key]["accelerator"], "threads": cache[key]["threads"]}
 
-fix ensemble all npt temp {System.start_temperature} {System.end_temperature} 0.1 x 10.0 10.0 1.0 y 10.0 10.0 1.0 z 10.0 10.0 1.0 xy 0.0 0.0 1.0 xz 0.0 0.0 1.0 yz 0.0 0.0 1.0
 
-velocity all create {System.start_temperature} {System.random_number} dist gaussian
+## Neighbor list tuning
+# tuned neighbor settings per element, number of atoms, temperature range and execution setting
+NEIGHBOR_CACHE = "./.md_cache/neighbor.json"
 
-dump 1 all custom {System.thermo_time} phasetransfomation id type xsu ysu zsu fx fy fz vx vy vz
-dump_modify 1 sort id format line "%d %d %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g %20.15g"
-thermo_style custom step temp pe etotal vol
-# thermo_style custom step temp pe etotal pxx pxy pxz pyy pyz pzz vol
-thermo_modify format float %20.15g
-thermo {System.thermo_time}
+NEIGHBOR_SKINS = [0.5, 1.0, 1.5, 2.0, 3.0]
+NEIGHBOR_CADENCES = [(1, 0), (2, 0), (5, 0), (10, 0), (10, 10)]
 
-variable t equal step
-variable m equal temp
-fix thermo all print {System.thermo_time} '$t $m' file thermo_output.dat screen no
 
-run 60000
-        """)
-    
+def neighbor_lines(settings):
+    return (f"neighbor {settings['skin']} {settings['binning']}\n"
+            f"neigh_modify every {settings['every']} delay {settings['delay']} check yes")
+
 
-def run_lammps(input_file):
-    lmp = lammps() #cmdargs=["-sc", "log"])
-    lmp.file(f"./{input_file}")
+def neighbor_commands(s:MD_system, fixed):
+    """
+    Neighbor commands of the input: the tuned settings with neighbor_tuning="auto", the commands of the notebooks
+    (`fixed`) with neighbor_tuning="fixed"
+    """
+    if s.neighbor_tuning == "fixed":
+        return fixed
+    if s.neighbor_tuning != "auto":
+        raise ValueError(f"Unknown neighbor_tuning {s.neighbor_tuning}, use auto or fixed")
+    return neighbor_lines(tuned_neighbor(s))
 
 
-def animate(s:MD_system):
+def tune_neighbor(s:MD_system, structure, steps=500):
+    """
+    Pilot runs of a structure file at the end temperature which choose the skin, binning and rebuild cadence with
+    the most atom-steps per second among the settings without dangerous builds
+    """
+    execution = execution_config(s)
+
+    def measure(settings):
+        # settings with dangerous builds lose forces, they are never chosen
+        rate, timing = pilot_run(s, structure, execution, steps, neighbor_lines(settings))
+        return rate if timing is None or timing["dangerous_builds"] == 0 else 0.0
+
+    # skin with rebuilds checked every step, then binning and rebuild cadence for that skin
+    best, best_rate = None, 0.0
+    for skin in NEIGHBOR_SKINS:
+        settings = {"skin": skin, "binning": "bin", "every": 1, "delay": 0}
+        rate = measure(settings)
+        if rate > best_rate:
+            best, best_rate = settings, rate
+    if best is None:
+        return {"skin": 3.0, "binning": "bin", "every": 1, "delay": 0}
+    if count_atoms(structure) < 500:
+        settings = dict(best, binning="nsq")
+        rate = measure(settings)
+        if rate > best_rate:
+            best, best_rate = settings, rate
+    for every, delay in NEIGHBOR_CADENCES[1:]:
+        settings = dict(best, every=every, delay=delay)
+        rate = measure(settings)
+        if rate > best_rate:
+            best, best_rate = settings, rate
+    return dict(best, rate=best_rate)
+
+
+def tuned_neighbor(s:MD_system, path=NEIGHBOR_CACHE):
+    """
+    Neighbor settings of the system from the neighbor cache, tuned with pilot runs of the structure in the run
+    directory the first time
+    """
+    execution = execution_config(s)
+    structure = os.path.join(s.run_dir, f"initial_{s.element}")
+    key = (f"{s.element}-{count_atoms(structure)}-{s.start_temperature}-{s.end_temperature}-"
+           f"{execution['accelerator']}-{execution['threads']}")
+    cache = read_json_cache(path)
+    if key not in cache:
+        cache[key] = update_json_cache(path, key, tune_neighbor(s, structure))
+    return cache[key]
+
+
+## Runs driven in chunks
+def run_in_chunks(lmp, s:MD_system, stages, every, resume=False):
+    """
+    Run the steps of the system in chunks of `every` steps. After each chunk the stages inspect the atoms through
+    the Lammps Python interface, a stage returning True from sample() ends the run.
+    start/stop keep the temperature ramp of the thermostat identical to a single run command.
+    A resumed run continues from the step of the restart file without sampling it again
+    """
+    step = int(lmp.extract_global("ntimestep"))
+    segments = run_segments(s, step)
+    for stage in stages:
+        stage.setup(lmp)
+    if not resume:
+        # fix vector sizes its storage from the stop step of the run which initialises it, the chunks after this
+        # run skip the initialisation (pre no)
+        bounds = f" start {segments[0][3]} stop {segments[0][4]}" if segments else ""
+        lmp.command(f"run 0{bounds} post no")
+        for stage in stages:
+            stage.sample(lmp, step)
+
+    finished = False
+    for fix, first, last, start, stop in segments:
+        pre = "no"
+        if fix is not None:
+            lmp.command(fix)
+            pre = "yes"
+        while step < last:
+            target = min(step + every, last)
+            # post yes writes the timing breakdown of every chunk to the log, see lammps_timing()
+            lmp.command(f"run {target - step} start {start} stop {stop} pre {pre} post yes")
+            pre = "no"
+            step = int(lmp.extract_global("ntimestep"))
+            finished = any([stage.sample(lmp, step) for stage in stages])
+            # a cancelled run (force_timeout) ends its chunks early
+            if finished or step < target:
+                break
+        if finished or step < last:
+            break
+
+    for stage in stages:
+        stage.finish(lmp)
+    return step
+
+
+def chunk_driver(s:MD_system, resume=False):
+    """
+    Driver for run_lammps with the stages requested by the system, None for a plain run
+    """
+    if not s.chunked:
+        return None
+    stages = [ThermoCapture(s, resume=resume)]
+    if s.insitu_every:
+        stages.append(InSituAnalysis(s, append=resume))
+    if s.stop_on_transition:
+        stages.append(TransitionDetector(s))
+    if s.adaptive_dump:
+        stages.append(AdaptiveDump(s))
+    if s.checkpoint_every:
+        stages.append(Checkpoint(s))
+    every = min(stage.every for stage in stages)
+    return lambda lmp: run_in_chunks(lmp, s, stages, every, resume)
+
+
+class InSituAnalysis:
+    """
+    Analysis of the running system every s.insitu_every steps: structure fractions from the common neighbour analysis,
+    mean coordination and mean-square displacement, streamed to insitu.bin in the run directory
+    """
+    structures = ["other", "fcc", "hcp", "bcc", "ico"]
+
+    def __init__(self, s:MD_system, append=False):
+        self.system = s
+        self.every = s.insitu_every
+        self.path = os.path.join(s.run_dir, "insitu.bin")
+        self.append = append
+        self.writer = None
+
+    @property
+    def cutoff(self):
+        # between the first and second neighbour shell of fcc/hcp, between the second and third of bcc
+        return 1.207 * self.system.nearest_distance
+
+    def setup(self, lmp):
+        lmp.commands_string(f"""
+compute insitu_cna all cna/atom {self.cutoff}
+compute insitu_coord all coord/atom cutoff {self.cutoff}
+compute insitu_msd all msd com yes
+""")
+        columns = ["step", "temp"] + [f"fraction_{name}" for name in self.structures] + ["coordination", "msd"]
+        self.writer = SeriesWriter(self.path, columns, append=self.append, element=self.system.element)
+
+    def sample(self, lmp, step):
+        from lammps import LMP_STYLE_GLOBAL, LMP_STYLE_ATOM, LMP_TYPE_SCALAR, LMP_TYPE_VECTOR
+        cna = lmp.numpy.extract_compute("insitu_cna", LMP_STYLE_ATOM, LMP_TYPE_VECTOR)
+        coord = lmp.numpy.extract_compute("insitu_coord", LMP_STYLE_ATOM, LMP_TYPE_VECTOR)
+        msd = lmp.numpy.extract_compute("insitu_msd", LMP_STYLE_GLOBAL, LMP_TYPE_VECTOR)
+        temp = lmp.extract_compute("thermo_temp", LMP_STYLE_GLOBAL, LMP_TYPE_SCALAR)
+        # cna/atom: 1 fcc, 2 hcp, 3 bcc, 4 icosahedral, 0 and 5 unknown
+        counts = np.bincount(np.asarray(cna, dtype=int), minlength=6)
+        fractions = np.array([counts[0] + counts[5], *counts[1:5]]) / max(len(cna), 1)
+        self.writer.append(step, temp, *fractions, np.mean(coord), msd[3])
+        return False
+
+    def finish(self, lmp):
+        self.writer.close()
+
+
+class AdaptiveDump:
+    """
+    Trajectory dump whose stride is switched between chunks: every `sparse` steps while the system is quiet and
+    every s.dump_interval steps while the potential energy rises faster than the thermal trend.
+    The activity is the slope of a line fitted to the thermo log over the last chunk, compared with the median and
+    spread of the slopes of the quiet chunks before, so single noisy samples do not count. Lammps writes the frames
+    itself (dump_modify every v_dump_next), the chunks keep the cadence of the thermo capture.
+    Half of s.frame_budget is spent on the evenly spaced frames, the other half on the dense frames
+    """
+    # slopes further above the median of the quiet slopes than this many standard deviations are active
+    activity_sigmas = 4.0
+    # quiet slopes needed before the activity is judged
+    min_history = 5
+
+    def __init__(self, s:MD_system):
+        self.system = s
+        self.every = 10 * s.thermo_time
+        self.interval = s.dump_interval
+        self.path = os.path.join(s.run_dir, s.dump_name)
+        sparse_frames = max(s.frame_budget // 2, 1)
+        self.sparse = max(self.interval, int(np.ceil(s.total_steps / sparse_frames / self.interval)) * self.interval)
+        self.dense_budget = max(s.frame_budget - s.total_steps // self.sparse - 1, 0)
+        self.dense_frames = 0
+        self.dense = False
+        self.slopes = []
+        self.last = None
+
+    def setup(self, lmp):
+        self.last = int(lmp.extract_global("ntimestep"))
+        # a resumed run continues after the frame of its restart step
+        first = "no" if os.path.exists(self.path) else "yes"
+        columns, modify = dump_style(self.system)
+        lmp.commands_string(f"""
+variable dump_stride equal {self.sparse}
+variable dump_next equal (floor(step/v_dump_stride)+1)*v_dump_stride
+dump adaptive all custom {self.sparse} "{self.path}" {columns}
+dump_modify adaptive every v_dump_next first {first} append yes {modify}
+""")
+
+    def active(self, step):
+        """
+        Whether the potential energy rose faster than its thermal trend during the chunk which ended at step
+        """
+        log = live_thermo.get(self.system.run_dir)
+        if log is None:
+            return False
+        window = (log.step > step - self.every) & (log.step <= step)
+        if window.sum() < 3:
+            return False
+        slope = np.polyfit(log.step[window], log.pe[window], 1)[0]
+        if len(self.slopes) >= self.min_history:
+            median = np.median(self.slopes)
+            spread = 1.4826 * np.median(np.abs(np.array(self.slopes) - median))
+            if spread > 0 and slope > median + self.activity_sigmas * spread:
+                return True
+        self.slopes.append(slope)
+        return False
+
+    def sample(self, lmp, step):
+        if self.dense:
+            self.dense_frames += (step - self.last) // self.interval
+        self.last = step
+        # a dense chunk may only start while the budget covers all of its frames
+        dense = self.active(step) and self.dense_budget - self.dense_frames >= self.every // self.interval
+        if dense != self.dense:
+            lmp.command(f"variable dump_stride equal {self.interval if dense else self.sparse}")
+            self.dense = dense
+        return False
+
+    def finish(self, lmp):
+        pass
+
+
+THERMO_NAME = "thermo.bin"
+THERMO_COLUMNS = ["step", "temp", "pe", "etotal", "press", "vol", "xy", "xz", "yz"]
+
+# thermo logs of the runs going on in this process, by run directory
+live_thermo = {}
+
+
+class ThermoLog:
+    """
+    Thermo quantities of a run in preallocated arrays which grow while the run goes on.
+    Columns are attributes, e.g. log.temp, and only cover the rows written so far
+    """
+    def __init__(self, capacity=1024, columns=THERMO_COLUMNS):
+        self.columns = list(columns)
+        self.data = np.full((len(self.columns), max(capacity, 1)), np.nan)
+        self.n = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.n
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get("columns", []):
+            return self.data[self.columns.index(name), :self.n]
+        raise AttributeError(name)
+
+    def append(self, row):
+        with self.lock:
+            if self.n == self.data.shape[1]:
+                self.data = np.concatenate([self.data, np.full_like(self.data, np.nan)], axis=1)
+            self.data[:, self.n] = row
+            self.n += 1
+
+    def latest(self):
+        """
+        Last row as dict, None while the log is empty
+        """
+        with self.lock:
+            if self.n == 0:
+                return None
+            return dict(zip(self.columns, self.data[:, self.n - 1]))
+
+    def truncate(self, step):
+        """
+        Drop the rows after `step`, e.g. the rows written after the checkpoint a run is resumed from
+        """
+        with self.lock:
+            self.n = int(np.searchsorted(self.data[0, :self.n], step, side="right"))
+
+    def save(self, path, **meta):
+        with self.lock:
+            columns = {name: self.data[i, :self.n].copy() for i, name in enumerate(self.columns)}
+        write_columns(path, columns, **meta)
+
+    @classmethod
+    def load(cls, path, extra=0):
+        """
+        Log of a saved thermo.bin with room for `extra` more rows
+        """
+        columns = read_columns(path)
+        names = list(columns)
+        log = cls(len(columns[names[0]]) + extra, names)
+        log.n = len(columns[names[0]])
+        log.data[:, :log.n] = [columns[name] for name in names]
+        return log
+
+
+def thermo_log(s:MD_system):
+    """
+    Thermo log of the system: the live log while it runs in this process, else the saved thermo.bin,
+    None without either
+    """
+    if s.run_dir in live_thermo:
+        return live_thermo[s.run_dir]
+    path = os.path.join(s.run_dir, THERMO_NAME)
+    if os.path.exists(path):
+        return ThermoLog.load(path)
+    return None
+
+
+class ThermoCapture:
+    """
+    Thermo quantities every s.thermo_time steps, stored by fix vector in Lammps and copied into a ThermoLog after
+    every chunk. The log is registered in live_thermo while the run goes on and saved to thermo.bin together with
+    the checkpoints and at the end of the run
+    """
+    variables = {"step": "step", "etotal": "etotal", "vol": "vol", "xy": "xy", "xz": "xz", "yz": "yz"}
+    computes = {"temp": "thermo_temp", "pe": "thermo_pe", "press": "thermo_press"}
+
+    def __init__(self, s:MD_system, resume=False):
+        self.system = s
+        # chunks of ten thermo outputs keep the live log current
+        self.every = 10 * s.thermo_time
+        self.save_every = s.checkpoint_every or s.total_steps
+        self.path = os.path.join(s.run_dir, THERMO_NAME)
+        self.resume = resume
+        self.log = None
+        self.rows = 0
+        self.first = None
+        self.last_save = None
+
+    def setup(self, lmp):
+        start = int(lmp.extract_global("ntimestep"))
+        capacity = (self.system.total_steps - start) // self.system.thermo_time + 2
+        if self.resume and os.path.exists(self.path):
+            self.log = ThermoLog.load(self.path, capacity)
+            self.log.truncate(start)
+        else:
+            self.log = ThermoLog(capacity)
+        live_thermo[self.system.run_dir] = self.log
+        self.last_save = start
+
+        values = []
+        for name in THERMO_COLUMNS:
+            if name in self.variables:
+                lmp.command(f"variable thermo_{name} equal {self.variables[name]}")
+                values.append(f"v_thermo_{name}")
+            else:
+                values.append(f"c_{self.computes[name]}")
+        lmp.command(f"fix thermo_capture all vector {self.system.thermo_time} {' '.join(values)}")
+        self.rows = 0
+        # fix vector stores a row on every multiple of its interval from the current step on
+        self.first = -(-start // self.system.thermo_time) * self.system.thermo_time
+
+    def stored(self, step):
+        # rows fix vector holds at `step`
+        return max((step - self.first) // self.system.thermo_time + 1, 0)
+
+    def drain(self, lmp):
+        """
+        Copy the rows fix vector stored since the last call. The library does not check the row index, so the
+        number of rows follows from the current step
+        """
+        from lammps import LMP_STYLE_GLOBAL, LMP_TYPE_ARRAY
+        rows = self.stored(int(lmp.extract_global("ntimestep")))
+        for i in range(self.rows, rows):
+            row = [lmp.extract_fix("thermo_capture", LMP_STYLE_GLOBAL, LMP_TYPE_ARRAY, i, j)
+                   for j in range(len(THERMO_COLUMNS))]
+            # the restart step of a resumed run is already in the log
+            if len(self.log) == 0 or row[0] > self.log.step[-1]:
+                self.log.append(row)
+        self.rows = max(self.rows, rows)
+
+    def sample(self, lmp, step):
+        self.drain(lmp)
+        if step >= self.last_save + self.save_every:
+            self.save()
+            self.last_save = step
+        return False
+
+    def save(self):
+        self.log.save(self.path, element=self.system.element)
+
+    def finish(self, lmp):
+        self.drain(lmp)
+        self.save()
+        live_thermo.pop(self.system.run_dir, None)
+
+
+TRANSITION_NAME = "transition.json"
+
+# Lindemann ratio sqrt(MSD)/nearest neighbour distance above which the atoms are no longer bound to their sites
+LINDEMANN_THRESHOLD = 0.2
+
+# rise of the potential energy above the extrapolated solid (eV/atom), a fraction of the latent heat of Al, Cu and Ti
+ENERGY_JUMP = 0.02
+
+
+def read_transition(s:MD_system):
+    """
+    Transition recorded by TransitionDetector (criterion, step, temperature, stopped), None without a transition
+    """
+    path = os.path.join(s.run_dir, TRANSITION_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fr:
+        return json.load(fr)
+
+
+class TransitionDetector:
+    """
+    Detect the melting of the cube or the hcp->bcc transformation of Ti every s.transition_every steps and end the
+    run s.transition_settle steps later. Criteria (s.stop_on_transition):
+    lindemann: sqrt(MSD) exceeds LINDEMANN_THRESHOLD nearest neighbour distances,
+    ptm: the initial structure (fcc or hcp) falls below half of its initial fraction, or bcc outweighs hcp for Ti,
+    from ptm/atom when Lammps has the PTM package and from cna/atom otherwise,
+    energy: the potential energy per atom of the latest samples rises ENERGY_JUMP above the line fitted against the
+    ramp temperature over the earlier samples.
+    The transition step and temperature are written to transition.json
+    """
+    criteria = ["lindemann", "ptm", "energy"]
+
+    # energy criterion: steps before samples enter the baseline (velocity create starts with all energy kinetic),
+    # ramp span in K the baseline needs before it is used, and the number of latest samples compared against it
+    equilibration = 5000
+    baseline_span = 100.0
+    recent = 5
+
+    def __init__(self, s:MD_system):
+        if s.stop_on_transition not in self.criteria:
+            raise ValueError(f"Unknown stop_on_transition {s.stop_on_transition}, use one of {self.criteria}")
+        self.system = s
+        self.criterion = s.stop_on_transition
+        self.every = s.transition_every
+        self.path = os.path.join(s.run_dir, TRANSITION_NAME)
+        self.transition = None
+        self.samples = []
+        self.initial = None
+        self.ptm = False
+        self.last = None
+
+    def setup(self, lmp):
+        self.transition = read_transition(self.system)
+        self.last = int(lmp.extract_global("ntimestep")) - self.every
+        if self.criterion == "lindemann":
+            lmp.command("compute transition_msd all msd com yes")
+        if self.criterion == "ptm":
+            self.ptm = lmp.has_package("PTM")
+            if self.ptm:
+                lmp.command("compute transition_structure all ptm/atom fcc-hcp-bcc 0.1 all")
+            else:
+                lmp.command(f"compute transition_structure all cna/atom {1.207 * self.system.nearest_distance}")
+
+    def order_parameter(self, lmp):
+        """
+        Value which crosses 0 at the transition
+        """
+        from lammps import LMP_STYLE_GLOBAL, LMP_STYLE_ATOM, LMP_TYPE_SCALAR, LMP_TYPE_VECTOR, LMP_TYPE_ARRAY
+        if self.criterion == "lindemann":
+            msd = lmp.numpy.extract_compute("transition_msd", LMP_STYLE_GLOBAL, LMP_TYPE_VECTOR)
+            return np.sqrt(msd[3]) / self.system.nearest_distance - LINDEMANN_THRESHOLD
+        if self.criterion == "ptm":
+            if self.ptm:
+                # ptm/atom: structure type in the first column, the same numbering as cna/atom
+                kinds = lmp.numpy.extract_compute("transition_structure", LMP_STYLE_ATOM, LMP_TYPE_ARRAY)[:, 0]
+            else:
+                kinds = lmp.numpy.extract_compute("transition_structure", LMP_STYLE_ATOM, LMP_TYPE_VECTOR)
+            fractions = np.bincount(np.asarray(kinds, dtype=int), minlength=6) / max(len(kinds), 1)
+            initial = 2 if self.system.element == 'Ti' else 1
+            if self.initial is None:
+                self.initial = fractions[initial]
+            if self.system.element == 'Ti' and fractions[3] > fractions[2]:
+                return 1.0
+            return 0.5 * self.initial - fractions[initial]
+        step = int(lmp.extract_global("ntimestep"))
+        if step < self.equilibration:
+            return -1.0
+        pe = lmp.extract_compute("thermo_pe", LMP_STYLE_GLOBAL, LMP_TYPE_SCALAR) / lmp.get_natoms()
+        # the thermostat target instead of the instantaneous temperature keeps the noise out of the abscissa
+        self.samples.append((self.ramp_temperature(step), pe))
+        baseline, recent = np.array(self.samples[:-self.recent]), np.array(self.samples[-self.recent:])
+        if len(baseline) < 2 or np.ptp(baseline[:, 0]) < self.baseline_span:
+            return -1.0
+        slope, offset = np.polyfit(baseline[:, 0], baseline[:, 1], 1)
+        return float(np.mean(recent[:, 1] - (slope * recent[:, 0] + offset))) - ENERGY_JUMP
+
+    def ramp_temperature(self, step):
+        # target temperature of the thermostat, the end temperature during extended steps
+        s = self.system
+        ramp = s.total_steps - s.extended_steps
+        start, end = float(s.start_temperature), float(s.end_temperature)
+        return start + (end - start) * min(step / ramp, 1.0)
+
+    def sample(self, lmp, step):
+        if self.transition is not None:
+            # an extended run goes on after the transition it already stopped at
+            return self.transition["stopped"] is None and self.finished(step)
+        if step < self.last + self.every:
+            return False
+        self.last = step
+        if self.order_parameter(lmp) > 0:
+            from lammps import LMP_STYLE_GLOBAL, LMP_TYPE_SCALAR
+            temp = lmp.extract_compute("thermo_temp", LMP_STYLE_GLOBAL, LMP_TYPE_SCALAR)
+            self.transition = {"criterion": self.criterion, "step": step, "temperature": temp, "stopped": None}
+            self.write()
+            print(f"Transition ({self.criterion}) at step {step}, {temp:.0f} K")
+        return False
+
+    def finished(self, step):
+        if step < self.transition["step"] + self.system.transition_settle:
+            return False
+        self.transition["stopped"] = step
+        self.write()
+        return True
+
+    def finish(self, lmp):
+        pass
+
+    def write(self):
+        with open(f"{self.path}.tmp", "w") as fw:
+            json.dump(self.transition, fw)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+CHECKPOINT_NAME = "checkpoint.json"
+
+
+def checkpoint_outputs(s:MD_system):
+    """
+    Output files of a run which grow while it runs and are cut back to the checkpoint on resume
+    """
+    names = ["thermo_output.dat", s.dump_name, "insitu.bin"]
+    return {name: os.path.join(s.run_dir, name) for name in names}
+
+
+class Checkpoint:
+    """
+    Restart file of the running system every s.checkpoint_every steps and at the end of the run.
+    checkpoint.json records the step, the extended steps and the sizes of the output files at that step, both are
+    replaced atomically so a crash leaves the previous checkpoint intact
+    """
+    def __init__(self, s:MD_system):
+        self.system = s
+        self.every = s.checkpoint_every
+        self.restart = os.path.join(s.run_dir, "checkpoint.restart")
+        self.last = None
+
+    def setup(self, lmp):
+        self.last = int(lmp.extract_global("ntimestep"))
+
+    def sample(self, lmp, step):
+        if step >= self.last + self.every:
+            self.write(lmp, step)
+        return False
+
+    def finish(self, lmp):
+        step = int(lmp.extract_global("ntimestep"))
+        if step != self.last:
+            self.write(lmp, step)
+
+    def write(self, lmp, step):
+        # dumps and fix print flush after every write, the sizes belong to this step
+        lmp.command(f'write_restart "{self.restart}.tmp"')
+        os.replace(f"{self.restart}.tmp", self.restart)
+        outputs = {name: os.path.getsize(path) for name, path in checkpoint_outputs(self.system).items()
+                   if os.path.exists(path)}
+        write_checkpoint(self.system, {"step": step, "restart": os.path.basename(self.restart),
+                                       "extended_steps": self.system.extended_steps, "outputs": outputs})
+        self.last = step
+
+
+def build_structure(s:MD_system):
+    """
+    Initial structure of the system built with NumPy: fcc block for Al/Cu (the same atoms as create_atoms in a
+    block of box_length+0.1 lattice units), replicated hcp cell for Ti
+    """
+    if s.lattice_constant is None:
+        raise ValueError(f"{s.Project_name} has no lattice constant, press Preview or set lattice_constant")
     if s.element in ['Al', 'Cu']:
-        pipeline = import_file(f"./{s.Project_name}/melting", multiple_frames=True)
-        data_in = np.loadtxt(f"./{s.Project_name}/thermo_output.dat")
-        timestep = data_in[:,0]
-        temperature = data_in[:,1]
-        
+        structure = lattice.cubic_block("fcc", float(s.lattice_constant), s.box_length + 0.1)
     if s.element in ['Ti']:
-        pipeline = import_file(f"./{s.Project_name}/phasetransfomation", multiple_frames=True)
-        data_in = np.loadtxt(f"./{s.Project_name}/thermo_output.dat")
-        timestep = data_in[:,0]
-        temperature = data_in[:,1]
-        ptm_modifier = PolyhedralTemplateMatchingModifier()
-        ptm_modifier.rmsd_cutoff = 0.3
-        ptm_modifier.structures[PolyhedralTemplateMatchingModifier.Type.FCC].enabled = False
-        pipeline.modifiers.append(ptm_modifier)
-        
+        structure = lattice.hcp_block(float(s.lattice_constant), (s.box_length, s.box_length, 6))
+    structure.masses = {1: s.lattice[2]}
+    return structure
+
+
+def write_structure(s:MD_system, path):
+    """
+    Write the initial structure of the system as Lammps data file
+    """
+    lattice.write_data(build_structure(s), path)
+
+
+def fill_data(data: "DataCollection", cell, pbc, positions, types):
+    """
+    Fill an ovito data collection with cell, positions and particle types
+    """
+    from ovito.data import ParticleType
+    data.create_cell(cell, pbc=pbc)
+    particles = data.create_particles(count=len(positions))
+    particles.create_property('Position', data=positions)
+    type_property = particles.create_property('Particle Type', data=types)
+    for type_id in np.unique(types):
+        type_property.types.append(ParticleType(id=int(type_id)))
+    return particles
+
+
+def structure_pipeline(structure):
+    """
+    Pipeline showing a structure which only exists in memory
+    """
+    from ovito.data import DataCollection
+    from ovito.pipeline import Pipeline, StaticSource
+    data = DataCollection()
+    fill_data(data, structure.cell, structure.pbc, structure.positions, structure.types)
+    return Pipeline(source=StaticSource(data=data))
+
+
+def finish_run(s:MD_system):
+    """
+    Convert the text dump of a finished run into the binary trajectory, unless text output was requested.
+    The frames of a resumed run are appended to the trajectory of the earlier part
+    """
+    dump = os.path.join(s.run_dir, s.dump_name)
+    if s.trajectory_format == "binary" and os.path.exists(dump):
+        convert_dump(dump, remove=True, append=True, element=s.element)
+
+
+def setup_run(s:MD_system, build=False, metrics=None):
+    """
+    Create the run directory with potential and structure, the input file is written by write_input().
+    With build=True the structure is generated for this system instead of copied from ./structures
+    """
+    with timed(metrics, "directory"):
+        if os.path.exists(s.run_dir):
+            shutil.rmtree(s.run_dir)
+        os.makedirs(s.run_dir)
+    with timed(metrics, "copy"):
+        copy_potential(s)
+        if build:
+            write_structure(s, os.path.join(s.run_dir, f"initial_{s.element}"))
+        else:
+            if not os.path.exists(f"./structures/initial_{s.element}"):
+                raise FileNotFoundError(f"There is no structure ./structures/initial_{s.element}, press Preview first")
+            copy_structure(s)
+
+
+def write_input(s:MD_system, metrics=None):
+    """
+    Write the input file into the run directory, with neighbor_tuning="auto" the neighbor settings are tuned first
+    """
+    if s.neighbor_tuning == "auto":
+        with timed(metrics, "neighbor_tuning"):
+            tuned_neighbor(s)
+    with timed(metrics, "input"):
+        if s.element in ['Al', 'Cu']:
+            write_input_melting(s)
+        if s.element in ['Ti']:
+            write_input_PT(s)
+
+
+@functools.lru_cache(maxsize=None)
+def trajectory_source():
+    """
+    Ovito pipeline source class which reads single frames of a binary trajectory or an indexed text dump,
+    None before ovito 3.9 which has no Python pipeline sources
+    """
+    try:
+        from ovito.data import DataCollection
+        from ovito.pipeline import PipelineSourceInterface
+    except ImportError:
+        return None
+
+    class TrajectorySource(PipelineSourceInterface):
+        vectors = {"Force": ["fx", "fy", "fz"], "Velocity": ["vx", "vy", "vz"]}
+
+        def __init__(self, trajectory, **kwargs):
+            super().__init__(**kwargs)
+            self.trajectory = trajectory
+
+        def compute_trajectory_length(self, **kwargs):
+            return self.trajectory.refresh()
+
+        def create(self, data: DataCollection, *, frame: int, **kwargs):
+            traj = self.trajectory
+            particles = fill_data(data, traj.cell(frame), traj.pbc, traj.positions(frame), traj.types(frame))
+            for name, columns in self.vectors.items():
+                if all(c in traj.columns for c in columns):
+                    particles.create_property(name, data=np.column_stack([traj.column(frame, c) for c in columns]))
+
+    return TrajectorySource
+
+
+def trajectory_pipeline(s:MD_system):
+    """
+    Pipeline over the trajectory of a run and its number of frames.
+    With ovito >= 3.9 frames are read on demand from the binary trajectory or through the frame index of the text dump,
+    older ovito versions import the text dump
+    """
+    from ovito.io import import_file
+    dump = os.path.join(s.run_dir, s.dump_name)
+    if trajectory_source() is not None:
+        from ovito.pipeline import Pipeline, PythonSource
+        source = trajectory_source()(open_trajectory(dump))
+        return Pipeline(source=PythonSource(delegate=source)), len(source.trajectory)
+    traj_path = dump + TRAJECTORY_SUFFIX
+    if os.path.exists(traj_path) and not os.path.exists(dump):
+        export_dump(traj_path, dump)
+    pipeline = import_file(dump, multiple_frames=True)
+    return pipeline, pipeline.source.num_frames
+
+
+def ptm_modifier():
+    """
+    PTM of the Ti runs: hcp and bcc, fcc disabled
+    """
+    from ovito.modifiers import PolyhedralTemplateMatchingModifier
+    ptm_modifier = PolyhedralTemplateMatchingModifier()
+    ptm_modifier.rmsd_cutoff = 0.3
+    ptm_modifier.structures[PolyhedralTemplateMatchingModifier.Type.FCC].enabled = False
+    return ptm_modifier
+
+
+def style_pipeline(s:MD_system, pipeline):
+    """
+    Colour and radius of the atoms, for Ti the structure types are identified with PTM.
+    Precomputed structure types (precompute_ptm) are used instead of running PTM for every displayed frame
+    """
+    from ovito.data import DataCollection
+    if s.element in ['Ti']:
+        cached = cached_ptm(s)
+        if cached is None:
+            pipeline.modifiers.append(ptm_modifier())
+        else:
+            pipeline.modifiers.append(ptm_colouring(cached))
 
     def modify_pipeline_input(frame: int, data: DataCollection):
         data.particles_.particle_types_.type_by_id_(1).color = s.lattice[4]
         data.particles_.particle_types_.type_by_id_(1).radius = 0.5
-    
+
     pipeline.modifiers.append(modify_pipeline_input)
+    return pipeline
+
+
+## Precomputed structure types
+def ptm_path(s:MD_system):
+    return os.path.join(s.run_dir, s.dump_name + TYPES_SUFFIX)
+
+
+def ptm_source(s:MD_system):
+    """
+    Number of frames and size of the trajectory the structure types are computed from
+    """
+    trajectory = open_trajectory(os.path.join(s.run_dir, s.dump_name))
+    return len(trajectory), os.path.getsize(trajectory.path)
+
+
+def cached_ptm(s:MD_system):
+    """
+    Structure types (n_frames, n_atoms) of the stored PTM results, None when there are none for the current trajectory
+    """
+    path = ptm_path(s)
+    if not os.path.exists(path):
+        return None
+    header, types, _ = read_frame_types(path)
+    try:
+        if [header["source_frames"], header["source_size"]] != list(ptm_source(s)):
+            return None
+    except (OSError, IndexError, ValueError):
+        return None
+    return types
+
+
+def ptm_frames(s:MD_system, frames):
+    """
+    Structure types of frames of a run, computed with PTM in a worker process which owns its own pipeline
+    """
+    pipeline, _ = trajectory_pipeline(s)
+    pipeline.modifiers.append(ptm_modifier())
+    return {frame: np.asarray(pipeline.compute(frame).particles["Structure Type"], dtype=np.uint8) for frame in frames}
+
+
+def precompute_ptm(s:MD_system, max_workers=None, chunk=16, force=False):
+    """
+    Run PTM over all frames of a run in worker processes and store the per-atom structure types and the per-frame
+    counts next to the trajectory (<dump>.ptm). Returns the path, existing results for the same trajectory are kept
+    """
+    path = ptm_path(s)
+    if not force and cached_ptm(s) is not None:
+        return path
+    n_frames, size = ptm_source(s)
+    if n_frames == 0:
+        return None
+    types = [None] * n_frames
+    chunks = [range(i, min(i + chunk, n_frames)) for i in range(0, n_frames, chunk)]
+    # ovito is not fork-safe, every worker starts a fresh interpreter
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(chunks), os.cpu_count() or 1),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        for result in pool.map(ptm_frames, [s] * len(chunks), chunks):
+            for frame, frame_types in result.items():
+                types[frame] = frame_types
+    structures = [t.name for t in ptm_modifier().structures]
+    write_frame_types(path, np.stack(types), len(structures), structures=structures, source_frames=n_frames,
+                      source_size=size)
+    return path
+
+
+def ptm_counts(s:MD_system):
+    """
+    Number of atoms of every structure type per frame as dict name -> array, from the stored PTM results
+    """
+    header, _, counts = read_frame_types(ptm_path(s))
+    return {name: np.asarray(counts[:, i]) for i, name in enumerate(header["structures"])}
+
+
+def ptm_colouring(types):
+    """
+    Pipeline function which sets the structure types of the stored PTM results and colours the atoms like the
+    PTM modifier does
+    """
+    from ovito.data import DataCollection
+    palette = np.zeros((max(t.id for t in ptm_modifier().structures) + 1, 3))
+    for t in ptm_modifier().structures:
+        palette[t.id] = t.color
+
+    def colour_structure_types(frame: int, data: DataCollection):
+        frame_types = np.asarray(types[min(frame, len(types) - 1)])
+        data.particles_.create_property("Structure Type", data=frame_types)
+        data.particles_.create_property("Color", data=palette[frame_types])
+
+    return colour_structure_types
+
+
+## Trajectory analysis
+def analyse(s:MD_system, chunk=50, max_workers=None):
+    """
+    Lindemann index, MSD, coordination and surface fraction of the trajectory of a run, written to
+    <run_dir>/analysis (see analysis.analyse_trajectory)
+    """
+    return analysis.analyse_trajectory(os.path.join(s.run_dir, s.dump_name), chunk=chunk, max_workers=max_workers,
+                                       cutoff=analysis.CUTOFF_FACTOR * s.nearest_distance)
+
+
+def rdf(s:MD_system, window=25, r_max=None, n_bins=200, q=None, max_workers=None, cache=True):
+    """
+    g(r) and S(q) over windows of frames of the trajectory of a run (see analysis.rdf_trajectory)
+    """
+    return analysis.rdf_trajectory(os.path.join(s.run_dir, s.dump_name), window=window, r_max=r_max, n_bins=n_bins,
+                                   q=q, max_workers=max_workers, cache=cache)
+
+
+## Pre-rendered playback
+def render_frames(s:MD_system, frames, directory, size=(820, 600), camera_dir=(2, 2, -1)):
+    """
+    Render frames of a run offscreen into directory/frame_XXXXX.png.
+    Runs in a worker process which owns its own pipeline, frames already on disk are skipped
+    """
+    from ovito.vis import Viewport, TachyonRenderer
+    pipeline, _ = trajectory_pipeline(s)
+    style_pipeline(s, pipeline)
+    pipeline.add_to_scene()
+    vp = Viewport(type=Viewport.Type.Ortho, camera_dir=camera_dir)
+    vp.zoom_all(size)
+    paths = {}
+    for frame in frames:
+        path = os.path.join(directory, f"frame_{frame:05d}.png")
+        if not os.path.exists(path):
+            tmp = os.path.join(directory, f"tmp_{os.getpid()}_{frame:05d}.png")
+            vp.render_image(size=size, frame=frame, filename=tmp, renderer=TachyonRenderer())
+            os.replace(tmp, path)
+        paths[frame] = path
+    pipeline.remove_from_scene()
+    return paths
+
+
+class FrameCache:
+    """
+    Memory-bounded LRU cache of rendered frame images (PNG).
+    Frames ahead of the playhead are rendered by worker processes, with persist=True the images are also kept
+    in the run directory and reused by later sessions
+    """
+    def __init__(self, s:MD_system, n_frames, size=(820, 600), max_bytes=256*2**20, ahead=24, chunk=4, max_workers=None, persist=True):
+        self.system = s
+        self.n_frames = n_frames
+        self.size = size
+        self.max_bytes = max_bytes
+        self.ahead = ahead
+        self.chunk = chunk
+        self.persist = persist
+        if persist:
+            self.directory = frames_directory(s, size)
+            os.makedirs(self.directory, exist_ok=True)
+        else:
+            self.directory = tempfile.mkdtemp(prefix="frames_")
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        # ovito is not fork-safe, every worker starts a fresh interpreter
+        self.pool = ProcessPoolExecutor(max_workers=max_workers or max(1, (os.cpu_count() or 2) - 1),
+                                        mp_context=multiprocessing.get_context("spawn"))
+
+    def path(self, frame):
+        return os.path.join(self.directory, f"frame_{frame:05d}.png")
+
+    def _store(self, frame, image):
+        with self.lock:
+            if frame in self.images:
+                self.images.move_to_end(frame)
+                return
+            self.images[frame] = image
+            self.nbytes += len(image)
+            while self.nbytes > self.max_bytes and len(self.images) > 1:
+                _, old = self.images.popitem(last=False)
+                self.nbytes -= len(old)
+
+    def _load(self, frame):
+        with open(self.path(frame), "rb") as fr:
+            image = fr.read()
+        self._store(frame, image)
+        return image
+
+    def prefetch(self, frame):
+        """
+        Schedule rendering of the frames around the playhead which are neither cached nor being rendered
+        """
+        start, stop = max(frame - self.ahead // 4, 0), min(frame + self.ahead, self.n_frames)
+        with self.lock:
+            todo = [f for f in range(start, stop)
+                    if f not in self.images and f not in self.pending and not os.path.exists(self.path(f))]
+            # frames ahead of the playhead first
+            todo.sort(key=lambda f: (f < frame, abs(f - frame)))
+            for i in range(0, len(todo), self.chunk):
+                frames = todo[i:i + self.chunk]
+                future = self.pool.submit(render_frames, self.system, frames, self.directory, self.size)
+                for f in frames:
+                    self.pending[f] = future
+                future.add_done_callback(lambda _, frames=frames: self._finished(frames))
+
+    def _finished(self, frames):
+        with self.lock:
+            for f in frames:
+                self.pending.pop(f, None)
+
+    def get(self, frame):
+        """
+        Image of a frame, waits for the worker when the frame is not rendered yet
+        """
+        with self.lock:
+            if frame in self.images:
+                self.images.move_to_end(frame)
+                return self.images[frame]
+        if not os.path.exists(self.path(frame)):
+            self.prefetch(frame)
+            with self.lock:
+                future = self.pending.get(frame)
+            if future is not None:
+                future.result()
+            if not os.path.exists(self.path(frame)):
+                render_frames(self.system, [frame], self.directory, self.size)
+        return self._load(frame)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if not self.persist:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def frames_directory(s:MD_system, size):
+    # rendered frames shared by FrameCache and render_movie
+    return os.path.join(s.run_dir, f"frames_{size[0]}x{size[1]}")
+
+
+def encode_movie(directory, path, fps):
+    """
+    Encode directory/frame_XXXXX.png into a video (MP4, ...) or GIF with ffmpeg, GIFs fall back to Pillow
+    """
+    if shutil.which("ffmpeg") is not None:
+        command = ["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps),
+                   "-i", os.path.join(directory, "frame_%05d.png")]
+        if not path.lower().endswith(".gif"):
+            # yuv420p needs even dimensions and is what common players expect
+            command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p"]
+        subprocess.run(command + [path], check=True)
+        return path
+    if path.lower().endswith(".gif"):
+        from PIL import Image
+        names = sorted(name for name in os.listdir(directory) if name.startswith("frame_"))
+        images = [Image.open(os.path.join(directory, name)) for name in names]
+        images[0].save(path, save_all=True, append_images=images[1:], duration=int(1000 / fps), loop=0)
+        return path
+    raise RuntimeError("ffmpeg is needed to encode videos, install it or write a .gif")
+
+
+def render_movie(s:MD_system, path, fps=25, resolution=(820, 600), max_workers=None, chunk=8, callback=None):
+    """
+    Render all frames of a run offscreen with the styling of animate() and encode them to a movie (MP4, GIF, ...).
+    Chunks of frames are rendered by worker processes which own their own pipeline. Frames are kept in the run
+    directory, so an interrupted export continues where it stopped and animate(prerender=True) reuses them.
+    callback(done, total) is called whenever frames are finished
+    """
+    n_frames = len(open_trajectory(os.path.join(s.run_dir, s.dump_name)))
+    if n_frames == 0:
+        raise ValueError(f"{s.Project_name} has no trajectory frames")
+    if s.element in ['Ti']:
+        precompute_ptm(s, max_workers=max_workers)
+    directory = frames_directory(s, resolution)
+    os.makedirs(directory, exist_ok=True)
+    todo = [f for f in range(n_frames) if not os.path.exists(os.path.join(directory, f"frame_{f:05d}.png"))]
+    done = n_frames - len(todo)
+    if callback is not None:
+        callback(done, n_frames)
+    if todo:
+        chunks = [todo[i:i + chunk] for i in range(0, len(todo), chunk)]
+        # ovito is not fork-safe, every worker starts a fresh interpreter
+        with ProcessPoolExecutor(max_workers=max_workers or min(len(chunks), os.cpu_count() or 1),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(render_frames, s, frames, directory, resolution) for frames in chunks]
+            for future in as_completed(futures):
+                done += len(future.result())
+                if callback is not None:
+                    callback(done, n_frames)
+    return encode_movie(directory, os.path.abspath(path), fps)
+
+
+def frame_timeline(s:MD_system):
+    """
+    Step and temperature of every trajectory frame. Frames need not be evenly spaced (adaptive output) and need not
+    fall on thermo outputs, the temperature is interpolated between them
+    """
+    steps = np.asarray(open_trajectory(os.path.join(s.run_dir, s.dump_name)).timesteps, dtype=float)
+    thermo_steps, thermo_temperature = read_thermo(s)
+    if len(thermo_steps) == 0:
+        return steps, np.full(len(steps), np.nan)
+    return steps, np.interp(steps, thermo_steps, thermo_temperature)
+
+
+def animate(s:MD_system, prerender=False, cache_bytes=256*2**20):
+    """
+    Show the trajectory of a run. With prerender=True playback shows images which worker processes render
+    ahead of the playhead, instead of rendering every frame in the kernel
+    """
+    from ipywidgets import widgets, fixed, Layout, AppLayout, VBox
+    from ovito.vis import Viewport
+    pipeline, max_frame = trajectory_pipeline(s)
+    style_pipeline(s, pipeline)
+    timestep, temperature = frame_timeline(s)
 
     title_show = widgets.HTML(value="<h1>Animation of Results</h1>", layout=Layout(height='10px', width='100%'))
 
@@ -260,7 +1757,6 @@ def animate(s:MD_system):
     vp = Viewport(type=Viewport.Type.Ortho, camera_dir=(2, 2, -1))
     vp.zoom_all()
 
-    max_frame = pipeline.source.num_frames
     play_image = widgets.Play(
         value=0,
         min=0,
@@ -318,17 +1814,27 @@ def animate(s:MD_system):
     widgets.jslink((play_image, 'value'), (control, 'value'))
 
     def on_frame_change(change):
-      temperature_show.value = f"<h3>Temperature: {temperature[scene.anim.current_frame]:4.0f} K</h3>"
-      time_show.value = f"Time: {timestep[scene.anim.current_frame]/1000:5.0f} ps"
+      temperature_show.value = f"<h3>Temperature: {temperature[change['new']]:4.0f} K</h3>"
+      time_show.value = f"Time: {timestep[change['new']]/1000:5.0f} ps"
     
     play_image.observe(on_frame_change, "value")
 
-    def play(vp, x, w):
-        scene.anim.current_frame = x
-        w.refresh()
+    if prerender:
+        cache = FrameCache(s, max_frame, max_bytes=cache_bytes)
+        cache.prefetch(0)
 
-    window = vp.create_jupyter_widget()
-    window.layout = ipywidgets.Layout(width='auto', height='auto')
+        def play(vp, x, w):
+            w.value = cache.get(x)
+            cache.prefetch(x + 1)
+
+        window = widgets.Image(value=cache.get(0), format='png', layout=Layout(width='auto', height='auto'))
+    else:
+        def play(vp, x, w):
+            scene.anim.current_frame = x
+            w.refresh()
+
+        window = vp.create_jupyter_widget()
+        window.layout = Layout(width='auto', height='auto')
     widgets.interactive(play, x=play_image, vp=fixed(vp), w=fixed(window))
     
     close_button = widgets.Button(
@@ -339,6 +1845,10 @@ def animate(s:MD_system):
     
     def close_click(sender):
         pipeline.remove_from_scene()
+        if prerender:
+            cache.close()
+            close_button.button_style='danger'
+            return
         
         # Here change the code for new/old version
         # older ovito version (3.7.12)
@@ -363,28 +1873,796 @@ def animate(s:MD_system):
     display(Box)
     
 
+## Job queue
+# runs of all kernels on this machine wait in one queue, see jobqueue.py
+job_queue = jobqueue.JobQueue()
+
+# waiting or running jobs of this process by run directory
+queued_jobs = {}
+
+
+def count_atoms(path):
+    """
+    Number of atoms in the header of a Lammps data file
+    """
+    with open(path) as fr:
+        for line in fr:
+            if line.strip().endswith("atoms"):
+                return int(line.split()[0])
+    return 0
+
+
+def requested_cores(s:MD_system):
+    """
+    Cores a run of the system may occupy: all cores while accelerator="auto" calibrates and for OpenMP runs without
+    a thread count, the threads of an OpenMP run, one otherwise, times the MPI ranks
+    """
+    cores = os.cpu_count() or 1
+    if s.accelerator == "auto":
+        threads = cores
+    elif s.accelerator == "omp":
+        threads = s.threads or cores
+    else:
+        threads = 1
+    return threads * max(s.mpi_ranks, 1)
+
+
+@contextmanager
+def queue_slot(s:MD_system, key, force=False, metrics=None, steps=None):
+    """
+    Wait for a slot of the job queue and hold it for the block, yields False when the run was cancelled while
+    waiting. The block covers everything which loads the machine: pilot runs, the run and its post-processing.
+    Unless force is set, a run identical to a queued one waits for it and leaves the queue once its result is in
+    the cache. steps is the number of steps still to run, all steps of the system by default
+    """
+    if not s.queue:
+        yield True
+        return
+    steps = s.total_steps if steps is None else steps
+    job = jobqueue.Job(key, cores=requested_cores(s), name=s.Project_name,
+                       work=count_atoms(os.path.join(s.run_dir, f"initial_{s.element}")) * steps)
+    queued_jobs[s.run_dir] = job
+    try:
+        job_queue.submit(job)
+        with timed(metrics, "queue"):
+            admitted = job_queue.wait(job, skip=None if force else lambda: result_cache.usable(key, s))
+        yield admitted
+        if job.started is not None and not job.cancelled:
+            job_queue.record(job.work, time.time() - job.started)
+    finally:
+        job_queue.remove(job)
+        queued_jobs.pop(s.run_dir, None)
+
+
+## Result cache
+class ResultCache:
+    """
+    Content-addressed store of finished runs. The key covers the physical inputs of the system, the cadence of its
+    outputs, the potential and the initial structure, so an identical submission restores the stored output,
+    whatever its execution and queue settings. An entry is only restored when it has the outputs the system asks for.
+    Entries are evicted least recently used first once the store grows beyond max_bytes
+    """
+    version = 3
+
+    # fields which decide the simulated trajectory, bump version when the generated input changes
+    physics = ["element", "lattice_constant", "box_length", "timestep", "start_temperature", "end_temperature",
+               "seed", "running_steps", "extended_steps", "stop_on_transition", "transition_every",
+               "transition_settle"]
+
+    # fields which decide the rows of the thermo log and the in-situ series and the frames of the trajectory
+    cadence = ["thermo_time", "dump_interval", "frame_budget", "insitu_every"]
+
+    # last step of the stored run
+    result_name = "result.json"
+
+    def __init__(self, directory="./.md_cache", max_bytes=2*2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, s:MD_system):
+        """
+        Hash of the physical inputs and the output cadence of a prepared run directory
+        """
+        sha = hashlib.sha256()
+        values = {name: str(getattr(s, name)) for name in self.physics + self.cadence}
+        sha.update(json.dumps({"version": self.version, "system": values}, sort_keys=True).encode())
+        for name in [s.potential_name, f"initial_{s.element}"]:
+            sha.update(eam.file_hash(os.path.join(s.run_dir, name)).encode())
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def outputs(self, s:MD_system):
+        """
+        Output files an entry needs to stand in for a run of the system
+        """
+        # a chunked run captures the thermo output in thermo.bin instead of fix print
+        names = [THERMO_NAME if s.chunked else "thermo_output.dat"]
+        if s.dump_trajectory:
+            names.append(s.dump_name + (TRAJECTORY_SUFFIX if s.trajectory_format == "binary" else ""))
+        if s.insitu_every:
+            names.append("insitu.bin")
+        return names
+
+    def usable(self, key, s:MD_system):
+        entry = self.path(key)
+        return (os.path.exists(os.path.join(entry, self.result_name))
+                and all(os.path.exists(os.path.join(entry, name)) for name in self.outputs(s)))
+
+    def restore(self, key, s:MD_system):
+        """
+        Copy the stored output into the run directory, returns the last step of the stored run and None when there
+        is no entry with the outputs of the system
+        """
+        entry = self.path(key)
+        if not self.usable(key, s):
+            return None
+        for name in os.listdir(entry):
+            if name != self.result_name:
+                shutil.copyfile(os.path.join(entry, name), os.path.join(s.run_dir, name))
+        with open(os.path.join(entry, self.result_name)) as fr:
+            step = json.load(fr)["step"]
+        # the modification time of an entry is its last use
+        os.utime(entry)
+        return step
+
+    def store(self, key, s:MD_system, step):
+        """
+        Copy the output of a finished run into the store, the input files are not stored.
+        An entry which lacks outputs of this run is replaced
+        """
+        entry = self.path(key)
+        if self.usable(key, s):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        skip = {"lammps_input", "lammps_resume", s.potential_name, f"initial_{s.element}"}
+        for name in os.listdir(s.run_dir):
+            path = os.path.join(s.run_dir, name)
+            if name not in skip and os.path.isfile(path) and not os.path.islink(path):
+                shutil.copyfile(path, os.path.join(tmp, name))
+        with open(os.path.join(tmp, self.result_name), "w") as fw:
+            json.dump({"step": step}, fw)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """
+        Stored entries as (last use, size in bytes, path), least recently used first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for key in os.listdir(self.directory):
+            entry = self.path(key)
+            if key.startswith(".") or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            result.append((os.path.getmtime(entry), size, entry))
+        return sorted(result)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+result_cache = ResultCache()
+
+
+def restore_result(s:MD_system, key, metrics=None):
+    """
+    Restore the output of an identical earlier run, returns its last step and None without a usable entry
+    """
+    with timed(metrics, "cache_restore"):
+        step = result_cache.restore(key, s)
+    if step is not None:
+        print(f"Result restored from the cache ({key[:12]})")
+        if metrics is not None:
+            metrics.restored = True
+    return step
+
+
+def execute_run(s:MD_system, on_start=None, screen=True, force=False, metrics=None):
+    """
+    Run the prepared run directory of the system, or restore the output of an identical earlier run.
+    force=True always runs Lammps. Only runs which reached their last step are stored. Returns the last step
+    """
+    with timed(metrics, "cache_key"):
+        key = result_cache.key(s)
+    restored = None if force else restore_result(s, key, metrics)
+    if restored is not None:
+        return restored
+    with queue_slot(s, key, force, metrics) as admitted:
+        if not admitted:
+            print("Cancelled while waiting in the job queue")
+            return 0
+        # an identical run may have finished while this one was waiting
+        restored = None if force else restore_result(s, key, metrics)
+        if restored is not None:
+            return restored
+        # calibration and neighbor tuning run pilots, they are measured on the machine the queue hands out
+        with timed(metrics, "execution"):
+            execution = execution_config(s)
+        if metrics is not None:
+            metrics.execution = execution
+        write_input(s, metrics)
+        with timed(metrics, "run"):
+            step = run_lammps(os.path.join(s.run_dir, "lammps_input"), screen=screen, on_start=on_start,
+                              driver=chunk_driver(s), execution=execution)
+        with timed(metrics, "convert"):
+            finish_run(s)
+        if s.element in ['Ti'] and s.dump_trajectory:
+            with timed(metrics, "ptm"):
+                precompute_ptm(s, max_workers=requested_cores(s))
+    transition = read_transition(s)
+    if step >= s.total_steps or (transition is not None and transition["stopped"] == step):
+        with timed(metrics, "cache_store"):
+            result_cache.store(key, s, step)
+    return step
+
+
 @showtime
-def calculation(s:MD_system):
-    # Prepare Input file
-    Checkdir(s.Project_name)
-    os.mkdir(f"./{s.Project_name}")
-    copy_potential(s)
-    
-    print(s.element)
+def calculation(s:MD_system, on_start=None, force=False):
+    metrics = RunMetrics(s)
+    with metrics.record():
+        # Prepare Input file
+        with timed(metrics, "directory"):
+            Checkdir(s.Project_name)
+        print(s.element)
+        # the structure is built into the run directory, concurrent runs of the same element do not share a file
+        setup_run(s, build=True, metrics=metrics)
+
+        # Run Lammps, all paths in the input are absolute so the working directory is not changed
+        metrics.step = execute_run(s, on_start=on_start, force=force, metrics=metrics)
+    return metrics.step
+
+
+## Run metrics
+# functions called with the metrics record of every run, e.g. to send it to a monitoring system
+metrics_hooks = []
+
+METRICS_NAME = "metrics.json"
+
+
+def add_metrics_hook(hook):
+    """
+    Call hook(record) with the metrics record (dict) of every run written from now on
+    """
+    metrics_hooks.append(hook)
+
+
+def timed(metrics, name):
+    """
+    Context which adds its wall time to a phase of the metrics, does nothing without metrics
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.phase(name)
+
+
+def lammps_timing(log_path):
+    """
+    Timing breakdown of all runs in a Lammps log: loop time, steps and the summed average time per section
+    (Pair, Neigh, Comm, Output, Modify, Other, ...) in seconds and the number of neighbor list builds,
+    None without timing output
+    """
+    if not os.path.exists(log_path):
+        return None
+    sections = {}
+    loop_time, steps, atoms = 0.0, 0, 0
+    builds = {"Neighbor list builds": 0, "Dangerous builds": 0}
+    in_table = False
+    with open(log_path, errors="ignore") as fr:
+        for line in fr:
+            match = re.match(r"Loop time of (\S+) on \d+ procs for (\d+) steps with (\d+) atoms", line)
+            if match:
+                loop_time += float(match.group(1))
+                steps += int(match.group(2))
+                atoms = int(match.group(3))
+            elif line.split("=")[0].strip() in builds:
+                name, value = line.split("=")
+                builds[name.strip()] += int(value)
+            elif line.startswith("Section |"):
+                in_table = True
+            elif in_table:
+                columns = [c.strip() for c in line.split("|")]
+                if len(columns) < 3:
+                    # the dashed line below the header keeps the table open, an empty line closes it
+                    in_table = line.startswith("---")
+                    continue
+                try:
+                    sections[columns[0]] = sections.get(columns[0], 0.0) + float(columns[2])
+                except ValueError:
+                    pass
+    if steps == 0:
+        return None
+    total = sum(sections.values()) or loop_time
+    return {"loop_time": loop_time, "steps": steps, "atoms": atoms, "sections": sections,
+            "fractions": {name: value / total for name, value in sections.items()},
+            "neighbor_builds": builds["Neighbor list builds"], "dangerous_builds": builds["Dangerous builds"]}
+
+
+class RunMetrics:
+    """
+    Wall time per phase of a run (directory, copy, input, cache_key, cache_restore, execution, run, convert,
+    cache_store) and the timing breakdown of Lammps. record() writes metrics.json to the run directory and passes the
+    record to the hooks
+    """
+    def __init__(self, s:MD_system):
+        self.system = s
+        self.phases = {}
+        self.step = None
+        self.restored = False
+        self.execution = None
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.time() - start_time
+
+    @contextmanager
+    def record(self):
+        start_time = time.time()
+        error = None
+        try:
+            yield self
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self.write(time.time() - start_time, error)
+
+    def write(self, total, error=None):
+        s = self.system
+        record = {
+            "project": s.Project_name,
+            "system": {f.name: getattr(s, f.name) for f in fields(MD_system)},
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "step": self.step,
+            "total_steps": s.total_steps,
+            "restored": self.restored,
+            "execution": self.execution,
+            "error": error,
+            "total_time": total,
+            "phases": self.phases,
+            "lammps": None if self.restored else lammps_timing(os.path.join(s.run_dir, "log.lammps")),
+        }
+        if os.path.isdir(s.run_dir):
+            with open(os.path.join(s.run_dir, METRICS_NAME), "w") as fw:
+                json.dump(record, fw, indent=1)
+        for hook in metrics_hooks:
+            try:
+                hook(record)
+            except Exception as e:
+                print(f"Metrics hook {hook} failed: {e}")
+        return record
+
+
+## Checkpoints and restarts
+def read_checkpoint(s:MD_system):
+    """
+    Content of checkpoint.json of the run directory, None without a checkpoint
+    """
+    path = os.path.join(s.run_dir, CHECKPOINT_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fr:
+        return json.load(fr)
+
+
+def write_checkpoint(s:MD_system, checkpoint):
+    """
+    Replace checkpoint.json of the run directory atomically
+    """
+    path = os.path.join(s.run_dir, CHECKPOINT_NAME)
+    with open(f"{path}.tmp", "w") as fw:
+        json.dump(checkpoint, fw)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_resume_input(s:MD_system, checkpoint):
+    """
+    Cut the outputs back to the checkpoint and write the input which continues the run from its restart file
+    """
+    for name, path in checkpoint_outputs(s).items():
+        if name in checkpoint["outputs"] and os.path.exists(path):
+            os.truncate(path, checkpoint["outputs"][name])
+    restart = os.path.join(s.run_dir, checkpoint["restart"])
     if s.element in ['Al', 'Cu']:
-        copy_structure(s)
-        write_input_melting(s)
+        write_input_melting(s, "lammps_resume", restart, checkpoint["step"])
     if s.element in ['Ti']:
-        copy_structure(s)
-        write_input_PT(s)
+        write_input_PT(s, "lammps_resume", restart, checkpoint["step"])
+    return os.path.join(s.run_dir, "lammps_resume")
 
-    # Run Lammps
-    os.chdir(f"./{s.Project_name}")
-    run_lammps(f"./lammps_input")
-    os.chdir("../")
+
+def resume(s:MD_system, on_start=None, screen=True):
+    """
+    Continue an interrupted or extended run from its last checkpoint, returns the last step.
+    The extended steps recorded in the checkpoint apply, so a new MD_system of the run resumes an extension too.
+    Thermo output, dump and in-situ series continue the files of the earlier part
+    """
+    checkpoint = read_checkpoint(s)
+    if checkpoint is None:
+        raise FileNotFoundError(f"No checkpoint in {s.run_dir}, the run needs checkpoint_every > 0")
+    s.extended_steps = max(s.extended_steps, checkpoint.get("extended_steps", 0))
+    if checkpoint["step"] >= s.total_steps:
+        print(f"{s.Project_name} already reached step {checkpoint['step']}")
+        return checkpoint["step"]
+    with queue_slot(s, result_cache.key(s), force=True, steps=s.total_steps - checkpoint["step"]) as admitted:
+        if not admitted:
+            print("Cancelled while waiting in the job queue")
+            return checkpoint["step"]
+        input_file = write_resume_input(s, checkpoint)
+        step = run_lammps(input_file, screen=screen, on_start=on_start, driver=chunk_driver(s, resume=True),
+                          execution=execution_config(s))
+        finish_run(s)
+        if s.element in ['Ti'] and s.dump_trajectory:
+            precompute_ptm(s, max_workers=requested_cores(s), force=True)
+    return step
+
+
+def extend(s:MD_system, steps, on_start=None, screen=True):
+    """
+    Run a finished system for `steps` more steps at its end temperature.
+    The new total is recorded in checkpoint.json before the run starts, an interrupted extension resumes with it
+    """
+    checkpoint = read_checkpoint(s)
+    if checkpoint is None:
+        raise FileNotFoundError(f"No checkpoint in {s.run_dir}, the run needs checkpoint_every > 0")
+    s.extended_steps = max(s.extended_steps, checkpoint.get("extended_steps", 0)) + steps
+    write_checkpoint(s, {**checkpoint, "extended_steps": s.extended_steps})
+    return resume(s, on_start=on_start, screen=screen)
+
+
+## NumPy EAM engine
+def numpy_system(s:MD_system, structure=None):
+    """
+    Calculator, positions, cell, pbc, types and masses of the system for the NumPy EAM engine.
+    The structure is built for the system unless a data file is given.
+    Al/Cu get the vacuum and open boundaries of the melting input, Ti stays periodic
+    """
+    potential = eam.load_potential(f"./potentials/{s.potential_name}")
+    if structure is None:
+        built = build_structure(s)
+        positions, cell, types, masses = built.positions, built.cell, built.types, built.masses
+    else:
+        positions, cell, types, masses = eam.read_data(structure)
+    if s.element in ['Al', 'Cu']:
+        cell[:, :3] += np.eye(3) * 3.0
+        pbc = (False, False, False)
+    else:
+        pbc = (True, True, True)
+    atom_masses = np.array([masses.get(t, s.lattice[2]) for t in types])
+    return eam.EAMCalculator(potential, s.element), positions, cell, pbc, types, atom_masses
+
+
+def run_numpy(s:MD_system, steps=None, structure=None, callback=None):
+    """
+    Run the system with the NumPy EAM engine (velocity Verlet, Nose-Hoover NVT ramp from start to end temperature).
+    Meant for previews, tests and cross-checks of small boxes, the Ti run is NVT instead of NPT.
+    Returns positions, velocities and thermo rows (step, temperature, potential energy, total energy)
+    """
+    calculator, positions, cell, pbc, types, masses = numpy_system(s, structure)
+    return eam.run_md(calculator, positions, cell, pbc, types, masses, steps or s.total_steps,
+                      timestep=float(s.timestep), start_temperature=float(s.start_temperature),
+                      end_temperature=float(s.end_temperature), seed=int(s.seed),
+                      thermo_every=s.thermo_time, callback=callback)
+
+
+def benchmark_engines(s:MD_system, box_lengths, steps=100):
+    """
+    Steps per second of the NumPy engine and of Lammps for every box length, together with the difference of the
+    initial potential energy of both as cross-check
+    """
+    rows = []
+    for box_length in box_lengths:
+        variant = replace(s, box_length=box_length)
+        with tempfile.TemporaryDirectory() as tmp:
+            structure = os.path.join(tmp, f"initial_{s.element}")
+            write_structure(variant, structure)
+            calculator, positions, cell, pbc, types, masses = numpy_system(variant, structure)
+            pe_numpy = calculator.compute(positions, cell, pbc, types)[0]
+            start_time = time.time()
+            eam.run_md(calculator, positions, cell, pbc, types, masses, steps, timestep=float(s.timestep),
+                       start_temperature=float(s.start_temperature), thermo_every=steps)
+            numpy_time = time.time() - start_time
+
+            boundary = "s s s" if s.element in ['Al', 'Cu'] else "p p p"
+            with lammps_pool.session(screen=False) as lmp:
+                lmp.commands_string(f"""
+units metal
+atom_style atomic
+boundary p p p
+box tilt large
+read_data "{structure}"
+change_box all boundary {boundary}
+pair_style eam/alloy
+pair_coeff * * "{os.path.abspath(f'./potentials/{s.potential_name}')}" {s.element}
+thermo_style custom step pe
+run 0
+""")
+                from lammps import LMP_STYLE_GLOBAL, LMP_TYPE_SCALAR
+                pe_lammps = lmp.extract_compute("thermo_pe", LMP_STYLE_GLOBAL, LMP_TYPE_SCALAR)
+                lmp.commands_string(f"""
+timestep {s.timestep}
+velocity all create {s.start_temperature} {variant.random_number} mom yes rot yes dist gaussian
+fix 2 all nvt temp {s.start_temperature} {s.start_temperature} 0.1
+""")
+                start_time = time.time()
+                lmp.command(f"run {steps}")
+                lammps_time = time.time() - start_time
+        rows.append({"box_length": box_length, "atoms": len(positions),
+                     "numpy_steps_per_s": steps / numpy_time, "lammps_steps_per_s": steps / lammps_time,
+                     "pe_numpy": pe_numpy, "pe_lammps": pe_lammps})
+    return rows
+
+
+## Background execution
+def last_thermo(s:MD_system):
+    """
+    Last (step, temperature) of the thermo output, None before the first output. A run of this process is read
+    from its live thermo log, otherwise only the end of the file is read since Lammps is still appending to it
+    """
+    if s.run_dir in live_thermo:
+        latest = live_thermo[s.run_dir].latest()
+        return None if latest is None else (int(latest["step"]), float(latest["temp"]))
+    saved = os.path.join(s.run_dir, THERMO_NAME)
+    if os.path.exists(saved):
+        columns = read_columns(saved)
+        if len(columns["step"]):
+            return int(columns["step"][-1]), float(columns["temp"][-1])
+    path = os.path.join(s.run_dir, "thermo_output.dat")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as fr:
+        fr.seek(0, os.SEEK_END)
+        fr.seek(max(fr.tell() - 512, 0))
+        lines = fr.read().decode(errors="ignore").split("\n")
+    # the last line is either empty or still being written
+    for line in reversed(lines[:-1]):
+        values = line.split()
+        if len(values) == 2:
+            return int(float(values[0])), float(values[1])
+    return None
+
+
+class BackgroundRun:
+    """
+    Run calculation() of a system on a background thread, so the kernel stays responsive.
+    The run works on a copy of the system, so the widgets can change theirs meanwhile.
+    The progress is read from the thermo output, which Lammps flushes while it runs
+    """
+    def __init__(self, s:MD_system):
+        self.system = replace(s)
+        self.lmp = None
+        self.error = None
+        self.cancelled = False
+        self.start_time = None
+        self._first_sample = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            calculation(self.system, on_start=self._attach)
+        except Exception as e:
+            self.error = e
+
+    def _attach(self, lmp):
+        self.lmp = lmp
+        if self.cancelled:
+            lmp.force_timeout()
+
+    def start(self):
+        self.start_time = time.time()
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        """
+        Stop the run cleanly, Lammps finishes the current step and writes its output
+        """
+        self.cancelled = True
+        if self.system.run_dir in queued_jobs:
+            queued_jobs[self.system.run_dir].cancelled = True
+        if self.lmp is not None:
+            self.lmp.force_timeout()
+
+    @property
+    def running(self):
+        return self.thread.is_alive()
+
+    def progress(self):
+        """
+        Current step, temperature, speed in ns/day, estimated remaining time in s and the queue state while the
+        run waits in the job queue
+        """
+        total = self.system.total_steps
+        info = {"step": 0, "total_steps": total, "temperature": None, "ns_per_day": None, "eta": None, "queue": None}
+        job = queued_jobs.get(self.system.run_dir)
+        if job is not None and job.started is None:
+            info["queue"] = job_queue.status(job)
+            return info
+        sample = last_thermo(self.system)
+        if sample is None:
+            return info
+        step, temperature = sample
+        now = time.time()
+        info.update(step=step, temperature=temperature)
+        if self._first_sample is None or step < self._first_sample[1]:
+            self._first_sample = (now, step)
+        elapsed, done = now - self._first_sample[0], step - self._first_sample[1]
+        if elapsed > 0 and done > 0:
+            rate = done / elapsed
+            info["ns_per_day"] = rate * float(self.system.timestep) * 86400 / 1000
+            info["eta"] = (total - step) / rate
+        return info
+
+
+def progress_html(info):
+    """
+    Format the progress of a background run for the status widget
+    """
+    queue = info.get("queue")
+    if queue is not None:
+        if queue["duplicate"]:
+            text = "waiting for an identical run"
+        else:
+            text = f"position {queue['position']} of {queue['length']}"
+            if queue["eta"] is not None:
+                text += f", starts in about {queue['eta']:4.0f} s"
+        return f"<h3>Molecular Dynamics is queued: {text}</h3>"
+    text = f"Step {info['step']} / {info['total_steps']}"
+    if info["temperature"] is not None:
+        text += f", T = {info['temperature']:4.0f} K"
+    if info["ns_per_day"] is not None:
+        text += f", {info['ns_per_day']:.2f} ns/day, ETA {info['eta']:4.0f} s"
+    return f"<h3>Molecular Dynamics is running: {text}</h3>"
+
+
+def submit_in_background(s:MD_system, submit_button, cancel_button, MD_status_show, MD_finish_show, interval=1.0):
+    """
+    Start calculation() in the background and keep the status widgets updated until it has finished
+    """
+    run = BackgroundRun(s).start()
+    cancel_button.disabled = False
+
+    def monitor():
+        while run.running:
+            MD_status_show.value = progress_html(run.progress())
+            time.sleep(interval)
+        info = run.progress()
+        MD_status_show.value = ""
+        if run.error is not None:
+            MD_finish_show.value = f"<h3>Molecular Dynamics failed: {run.error}</h3>"
+        elif run.cancelled:
+            MD_finish_show.value = f"<h3>Molecular Dynamics was cancelled at step {info['step']}</h3>"
+        else:
+            MD_finish_show.value = f"<h3>Molecular Dynamics is finished</h3>"
+        cancel_button.disabled = True
+        submit_button.button_style='success'
+
+    threading.Thread(target=monitor, daemon=True).start()
+    return run
+
+
+## Parameter sweep
+def sweep_systems(s:MD_system, **grid):
+    """
+    Expand a system into one variant per combination of the given field values, e.g.
+    sweep_systems(s, start_temperature=[300, 500], seed=[1, 2, 3], box_length=[3, 4]).
+    Every variant runs in its own directory ./{Project_name}/run_XXX
+    """
+    names = [f.name for f in fields(MD_system)]
+    for key in grid:
+        if key not in names:
+            raise ValueError(f"MD_system has no field {key}")
+
+    systems = []
+    for i, values in enumerate(itertools.product(*grid.values())):
+        variant = replace(s, **dict(zip(grid.keys(), values)))
+        variant.Project_name = f"{s.Project_name}/run_{i:03d}"
+        systems.append(variant)
+    return systems
+
+
+def read_thermo(s:MD_system):
+    """
+    Step and temperature of the thermo log, or as written by fix print for runs with a single run command.
+    Returns two empty arrays when there is no output
+    """
+    log = thermo_log(s)
+    if log is not None:
+        return np.array(log.step), np.array(log.temp)
+    path = os.path.join(s.run_dir, "thermo_output.dat")
+    if not os.path.exists(path):
+        return np.array([]), np.array([])
+    data_in = np.loadtxt(path, ndmin=2)
+    if data_in.size == 0:
+        return np.array([]), np.array([])
+    return data_in[:,0], data_in[:,1]
+
+
+def run_single(s:MD_system):
+    """
+    Set up and run one system of a sweep, returns one row of the results table.
+    Runs in a worker process, errors are reported in the row instead of raised
+    """
+    row = {f.name: getattr(s, f.name) for f in fields(MD_system)}
+    row.update(run_dir=s.run_dir, status="finished", error="")
+    start_time = time.time()
+    metrics = RunMetrics(s)
+    try:
+        with metrics.record():
+            setup_run(s, build=True, metrics=metrics)
+            metrics.step = execute_run(s, screen=False, metrics=metrics)
+    except Exception as e:
+        row.update(status="failed", error=str(e))
+    row["wall_time"] = time.time() - start_time
+    row.update({f"time_{name}": value for name, value in metrics.phases.items()})
+
+    timestep, temperature = read_thermo(s)
+    transition = read_transition(s) if os.path.isdir(s.run_dir) else None
+    row["transition_step"] = transition["step"] if transition else ""
+    row["transition_temperature"] = transition["temperature"] if transition else ""
+    row["steps"] = int(timestep[-1]) if len(timestep) else 0
+    row["final_temperature"] = float(temperature[-1]) if len(temperature) else float("nan")
+    return row
+
+
+def run_sweep(systems, max_workers=None, callback=None):
+    """
+    Run the systems concurrently in a process pool and return the results table as list of rows.
+    The table is also written to results.csv next to the run directories.
+    callback(row) is called in the main process whenever a run has finished
+    """
+    for s in systems:
+        if s.lattice_constant is None or s.start_temperature is None or s.end_temperature is None:
+            raise ValueError(f"{s.Project_name}: lattice_constant, start_temperature and end_temperature must be set")
+    if len(set(s.run_dir for s in systems)) != len(systems):
+        raise ValueError("Every system of a sweep needs its own Project_name")
+
+    rows = [None] * len(systems)
+    # ovito is not fork-safe and forked workers would inherit the Lammps instances and threads of the kernel
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(run_single, s): i for i, s in enumerate(systems)}
+        for future in as_completed(futures):
+            row = future.result()
+            rows[futures[future]] = row
+            if callback is not None:
+                callback(row)
+
+    roots = set(os.path.dirname(s.run_dir) for s in systems)
+    if len(roots) == 1:
+        with open(os.path.join(roots.pop(), "results.csv"), "w", newline="") as fw:
+            writer = csv.DictWriter(fw, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
     
     
 def input_melting(s:MD_system):
+    from ipywidgets import widgets, Layout, AppLayout, VBox
+    from ovito.io import import_file
+    from ovito.vis import Viewport
+    from ovito.data import DataCollection
     System_melting = MD_system()
 
     title_show = widgets.HTML(value="<h1>Molecular Dynamics Simulation of Melting</h1>", layout=Layout(height='10px', width='100%'))
@@ -444,7 +2722,7 @@ def input_melting(s:MD_system):
     box_length_show = widgets.BoundedIntText(
         value=4,
         min=3,
-        max=6,
+        max=10,
         step=1,
         description='Size:',
         layout=Layout(width='auto', height='5%'),
@@ -472,25 +2750,8 @@ def input_melting(s:MD_system):
            Error_status_show.value = ""
         System_melting.box_length = box_length_show.value
         System_melting.lattice_constant = aLat_show.value
-        lmp = lammps(cmdargs=["-sc", "log"])
-        
-        cmd = f"""
-    dimension 3
-    units metal
-    atom_style atomic
-    boundary p p p
-    lattice fcc {System_melting.lattice_constant}
-    region box block 0 {System_melting.box_length+0.1} 0 {System_melting.box_length+0.1} 0 {System_melting.box_length+0.1}
-    create_box 1 box
-    create_atoms 1 box
-    mass 1 {System_melting.lattice[2]}
-    write_data ./structures/initial_{System_melting.element}
-        """
-        
-        lmp.commands_string(cmd)
-        lmp.close()
-        pipeline = import_file(f"./structures/initial_{System_melting.element}", multiple_frames=True)
-        data = pipeline.compute()
+        # the structure is built into the run directory when the run is submitted
+        pipeline = structure_pipeline(build_structure(System_melting))
         pipeline.add_to_scene()
         
         def modify_pipeline_input(frame: int, data: DataCollection):
@@ -524,6 +2785,15 @@ def input_melting(s:MD_system):
         button_style='success'
     )
 
+    # stop a running calculation
+    cancel_button = widgets.Button(
+        description='Cancel',
+        layout=Layout(width='auto', height='5%'),
+        button_style='warning',
+        disabled=True
+    )
+    active_run = {}
+
 
     start_T_show = widgets.Text(
         placeholder='Start Temperature (int)',
@@ -554,12 +2824,18 @@ def input_melting(s:MD_system):
 
     # define a function which can obtain the value form the interactive surface
     def button_click(sender):
+        if "run" in active_run and active_run["run"].running:
+           Error_status_show.value = f"<h2>A calculation is still running!</h2>"
+           return
         if Project_name_show.value == "" or start_T_show.value == "" or end_T_show.value == "" or seed_show.value == "":
            Project_name_show.style.danger = True
            submit_button.button_style='danger'
            MD_status_show.value = ""
            MD_finish_show.value = ""
            Error_status_show.value = f"<h2>You have not provided all input values!</h2>"
+        elif System_melting.lattice_constant is None:
+           submit_button.button_style='danger'
+           Error_status_show.value = f"<h2>Press Preview first!</h2>"
         else:
            if submit_button.button_style=='danger':
               submit_button.button_style='success'
@@ -570,14 +2846,18 @@ def input_melting(s:MD_system):
            System_melting.seed = seed_show.value
            submit_button.button_style='danger'
            MD_finish_show.value = ""
-           MD_status_show.value = f"<h3>Molecular Dynamics is running ({System_melting.running_steps} steps)</h3>"
-           calculation(System_melting)
-           MD_finish_show.value = f"<h3>Molecular Dynamics is finished</h3>"
-           submit_button.button_style='success'
+           MD_status_show.value = f"<h3>Molecular Dynamics is running ({System_melting.total_steps} steps)</h3>"
+           active_run["run"] = submit_in_background(System_melting, submit_button, cancel_button, MD_status_show, MD_finish_show)
+
 
+    def cancel_click(sender):
+        if "run" in active_run:
+            active_run["run"].cancel()
+        cancel_button.disabled = True
 
     # connect the function with the button
     submit_button.on_click(button_click)
+    cancel_button.on_click(cancel_click)
 
     # show the widgets
     show_windows = AppLayout(header=title_show,
@@ -591,7 +2871,8 @@ def input_melting(s:MD_system):
                                                 start_T_show,
                                                 end_T_show,
                                                 seed_show,
-                                                submit_button]),
+                                                submit_button,
+                                                cancel_button]),
                              left_sidebar=None,
                              footer=VBox([Error_status_show, MD_status_show, MD_finish_show]),
                              pane_widths=['0px', '820px', '300px'],
@@ -603,6 +2884,10 @@ def input_melting(s:MD_system):
 
 
 def input_solid_to_solid(s:MD_system):
+    from ipywidgets import widgets, Layout, AppLayout, VBox
+    from ovito.io import import_file
+    from ovito.vis import Viewport
+    from ovito.data import DataCollection
     System_PT = MD_system()
 
     title_show = widgets.HTML(value="<h1>Molecular Dynamics Simulation of a solid-solid transformation</h1>", layout=Layout(width='100%', height='100px'))
@@ -657,7 +2942,7 @@ def input_solid_to_solid(s:MD_system):
     box_length_show = widgets.BoundedIntText(
         value=9,
         min=8,
-        max=11,
+        max=16,
         step=1,
         description='Size:',
         layout=Layout(width='auto', height='5%'),
@@ -684,25 +2969,8 @@ def input_solid_to_solid(s:MD_system):
            Error_status_show.value = ""
         System_PT.box_length = box_length_show.value
         System_PT.lattice_constant = aLat_show.value
-        write_sturcture_Ti(System_PT)
-        lmp = lammps(cmdargs=["-sc", "log"])
-        
-        cmd = f"""
-dimension 3
-units metal
-atom_style atomic
-boundary p p p
-
-read_data ./structures/hcp_Ti
-replicate {System_PT.box_length} {System_PT.box_length} 6
-
-write_data ./structures/initial_{System_PT.element}
-        """
-        
-        lmp.commands_string(cmd)
-        lmp.close()
-        pipeline = import_file(f"./structures/initial_{System_PT.element}", multiple_frames=True)
-        data = pipeline.compute()
+        # the structure is built into the run directory when the run is submitted
+        pipeline = structure_pipeline(build_structure(System_PT))
         pipeline.add_to_scene()
         
         def modify_pipeline_input(frame: int, data: DataCollection):
@@ -736,6 +3004,15 @@ write_data ./structures/initial_{System_PT.element}
         button_style='success'
     )
 
+    # stop a running calculation
+    cancel_button = widgets.Button(
+        description='Cancel',
+        layout=Layout(width='auto', height='5%'),
+        button_style='warning',
+        disabled=True
+    )
+    active_run = {}
+
     start_T_show = widgets.Text(
         placeholder='Start Temperature (int)',
         description='Start T (K):',
@@ -762,12 +3039,18 @@ write_data ./structures/initial_{System_PT.element}
     Error_status_show = widgets.HTML(layout=Layout(width='auto', height='auto', fontsize=200))
 
     def button_click(sender):
+        if "run" in active_run and active_run["run"].running:
+           Error_status_show.value = f"<h2>A calculation is still running!</h2>"
+           return
         if Project_name_show.value == "" or start_T_show.value == "" or end_T_show.value == "" or seed_show.value == "":
            Project_name_show.style.danger = True
            submit_button.button_style='danger'
            MD_status_show.value = ""
            MD_finish_show.value = ""
            Error_status_show.value = f"<h2>You have not provided all input values!</h2>"
+        elif System_PT.lattice_constant is None:
+           submit_button.button_style='danger'
+           Error_status_show.value = f"<h2>Press Preview first!</h2>"
         else:
            if submit_button.button_style=='danger':
               submit_button.button_style='success'
@@ -778,14 +3061,18 @@ write_data ./structures/initial_{System_PT.element}
            System_PT.seed = seed_show.value
            submit_button.button_style='danger'
            MD_finish_show.value = ""
-           MD_status_show.value = f"<h3>Molecular Dynamics is running (60000 steps)</h3>"
-           calculation(System_PT)
-           MD_finish_show.value = f"<h3>Molecular Dynamics is finished</h3>"
-           submit_button.button_style='success'
+           MD_status_show.value = f"<h3>Molecular Dynamics is running ({System_PT.total_steps} steps)</h3>"
+           active_run["run"] = submit_in_background(System_PT, submit_button, cancel_button, MD_status_show, MD_finish_show)
+
 
+    def cancel_click(sender):
+        if "run" in active_run:
+            active_run["run"].cancel()
+        cancel_button.disabled = True
 
     # connect the function with the button
     submit_button.on_click(button_click)
+    cancel_button.on_click(cancel_click)
 
     # show the widgets
     show_windows = AppLayout(header=title_show,
@@ -799,7 +3086,8 @@ write_data ./structures/initial_{System_PT.element}
                                                 start_T_show,
                                                 end_T_show,
                                                 seed_show,
-                                                submit_button]),
+                                                submit_button,
+                                                cancel_button]),
                              left_sidebar=None,
                              footer=VBox([Error_status_show, MD_status_show, MD_finish_show]),
                              pane_widths=['0px', '820px', '300px'],
@@ -0,0 +1,287 @@
+import os
+import pwd
+import json
+import time
+import uuid
+import heapq
+import fcntl
+import socket
+import getpass
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+
+
+# directory of the queue shared by all kernels of the machine and the cores it hands out
+QUEUE_DIR = os.environ.get("MD_QUEUE_DIR", os.path.join(tempfile.gettempdir(), "md_queue"))
+WORKERS = int(os.environ.get("MD_QUEUE_WORKERS", "0")) or os.cpu_count() or 1
+
+# finished jobs kept for the throughput estimate
+HISTORY = 50
+
+
+def queue_user():
+    """
+    User a job is queued for: MD_QUEUE_USER, the JupyterHub user or the OS user. Kernels of a single-user
+    deployment all run as the same OS user, the fair share needs the name of the person behind the kernel
+    """
+    return os.environ.get("MD_QUEUE_USER") or os.environ.get("JUPYTERHUB_USER") or getpass.getuser()
+
+
+class Job:
+    """
+    A job of the queue: owner, key of its input for deduplication, cores it occupies while running and its amount
+    of work in an arbitrary unit, which is only used for the ETA
+    """
+    def __init__(self, key, cores=1, work=0.0, name=""):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.cores = max(int(cores), 1)
+        self.work = float(work)
+        self.name = name
+        self.user = queue_user()
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.submitted = time.time()
+        self.started = None
+        self.cancelled = False
+
+    def ticket(self):
+        return {"id": self.id, "key": self.key, "cores": self.cores, "work": self.work, "name": self.name,
+                "user": self.user, "host": self.host, "pid": self.pid, "submitted": self.submitted,
+                "started": self.started}
+
+
+def owner(path):
+    # user name of the owner of a file, only the owner of a ticket may remove it
+    uid = os.stat(path).st_uid
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # process of another user
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Admission control of the runs of all kernels on a machine, without a server: every job is a ticket file in a
+    shared directory and waiting jobs admit themselves under a file lock.
+    At most `workers` cores are handed out (a job larger than that runs alone), waiting jobs are admitted round
+    robin over the users (queue_user), and a job identical to a queued or running one is held back until that one
+    has finished. The directory is shared like /tmp (sticky bit), tickets can only be written and removed by the
+    OS user owning them. Tickets of dead processes are ignored and removed by their owner
+    """
+    def __init__(self, directory=QUEUE_DIR, workers=WORKERS, poll=1.0):
+        self.directory = directory
+        self.workers = workers
+        self.poll = poll
+
+    @property
+    def jobs_dir(self):
+        return os.path.join(self.directory, "jobs")
+
+    def path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    @contextmanager
+    def locked(self):
+        if not os.path.isdir(self.jobs_dir):
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            # kernels of all users share the queue, only owners may remove or replace their files
+            for path in [self.directory, self.jobs_dir]:
+                try:
+                    os.chmod(path, 0o1777)
+                except OSError:
+                    pass
+        # flock works on a read-only descriptor, so the lock file needs no write permission for other users
+        fd = os.open(os.path.join(self.directory, "lock"), os.O_RDONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def write(self, path, data):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fw:
+            json.dump(data, fw)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    def tickets(self, clean=False):
+        """
+        Tickets of all live jobs with the OS user owning them, clean=True removes the tickets of dead processes
+        this OS user owns (only under the lock)
+        """
+        if not os.path.isdir(self.jobs_dir):
+            return []
+        host = socket.gethostname()
+        os_user = getpass.getuser()
+        result = []
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                with open(path) as fr:
+                    ticket = json.load(fr)
+                ticket["owner"] = owner(path)
+            except (OSError, ValueError):
+                continue
+            if ticket["host"] == host and not alive(ticket["pid"]):
+                if clean and ticket["owner"] == os_user:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            result.append(ticket)
+        return result
+
+    def order(self, tickets):
+        """
+        Running tickets, waiting tickets in admission order and the held back duplicates. Waiting jobs are ordered
+        by the number of running and earlier waiting jobs of their user, then by submission time
+        """
+        running = [t for t in tickets if t["started"] is not None]
+        keys = {t["key"] for t in running}
+        jobs = Counter(t["user"] for t in running)
+        waiting, held, rank = [], [], {}
+        for t in sorted((t for t in tickets if t["started"] is None), key=lambda t: t["submitted"]):
+            if t["key"] in keys:
+                held.append(t)
+                continue
+            keys.add(t["key"])
+            rank[t["id"]] = (jobs[t["user"]], t["submitted"])
+            jobs[t["user"]] += 1
+            waiting.append(t)
+        waiting.sort(key=lambda t: rank[t["id"]])
+        return running, waiting, held
+
+    def submit(self, job):
+        with self.locked():
+            self.write(self.path(job.id), job.ticket())
+        return job
+
+    def remove(self, job):
+        try:
+            os.remove(self.path(job.id))
+        except OSError:
+            pass
+
+    def wait(self, job, skip=None):
+        """
+        Block until the job is admitted, returns False when job.cancelled was set while waiting.
+        skip() is polled while waiting, once it is true the job leaves the queue and True is returned without a slot
+        """
+        while True:
+            if job.cancelled:
+                self.remove(job)
+                return False
+            if skip is not None and skip():
+                self.remove(job)
+                return True
+            with self.locked():
+                tickets = self.tickets(clean=True)
+                if job.id not in [t["id"] for t in tickets]:
+                    tickets.append(job.ticket())
+                running, waiting, _ = self.order(tickets)
+                free = self.workers - sum(t["cores"] for t in running)
+                if waiting and waiting[0]["id"] == job.id and (free >= job.cores or not running):
+                    job.started = time.time()
+                    self.write(self.path(job.id), job.ticket())
+                    return True
+            time.sleep(self.poll)
+
+    def status(self, job):
+        """
+        Queue state of a waiting job as dict: position (1 is next), length of the queue, estimated seconds until
+        the job starts and whether it waits for an identical job. None when the job is not waiting
+        """
+        if job.started is not None:
+            return None
+        running, waiting, held = self.order(self.tickets())
+        if job.id in [t["id"] for t in held]:
+            return {"position": None, "length": len(waiting) + len(held), "eta": None, "duplicate": True}
+        ids = [t["id"] for t in waiting]
+        if job.id not in ids:
+            return None
+        position = ids.index(job.id) + 1
+        return {"position": position, "length": len(waiting) + len(held), "eta": self.eta(running, waiting[:position]),
+                "duplicate": False}
+
+    def throughput(self):
+        """
+        Work per second of the recently finished jobs of all users, None without history
+        """
+        history = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.startswith("history-") and name.endswith(".json"):
+                    try:
+                        with open(os.path.join(self.directory, name)) as fr:
+                            history += json.load(fr)
+                    except (OSError, ValueError):
+                        pass
+        work, seconds = sum(w for w, _ in history), sum(t for _, t in history)
+        return work / seconds if work > 0 and seconds > 0 else None
+
+    def record(self, work, seconds):
+        """
+        Add a finished job to the throughput history of this user
+        """
+        if work <= 0 or seconds <= 0:
+            return
+        path = os.path.join(self.directory, f"history-{getpass.getuser()}.json")
+        with self.locked():
+            try:
+                with open(path) as fr:
+                    history = json.load(fr)
+            except (OSError, ValueError):
+                history = []
+            self.write(path, (history + [[work, seconds]])[-HISTORY:])
+
+    def eta(self, running, waiting):
+        """
+        Seconds until the last of the waiting jobs starts, simulated from the throughput of finished jobs
+        """
+        rate = self.throughput()
+        if rate is None or not waiting:
+            return None
+        now = time.time()
+        ends = [(max(t["started"] + t["work"] / rate, now), t["cores"]) for t in running]
+        heapq.heapify(ends)
+        free = self.workers - sum(cores for _, cores in ends)
+        start = now
+        for t in waiting:
+            while free < t["cores"] and ends:
+                end, cores = heapq.heappop(ends)
+                start, free = max(start, end), free + cores
+            heapq.heappush(ends, (start + t["work"] / rate, t["cores"]))
+            free -= t["cores"]
+        return start - now
+
+    def clear(self):
+        """
+        Remove the tickets of this queue user which this OS user owns
+        """
+        user, os_user = queue_user(), getpass.getuser()
+        for name in os.listdir(self.jobs_dir) if os.path.isdir(self.jobs_dir) else []:
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                with open(path) as fr:
+                    ticket = json.load(fr)
+                if owner(path) == os_user and ticket["user"] == user:
+                    os.remove(path)
+            except (OSError, ValueError, KeyError):
+                pass
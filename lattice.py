@@ -0,0 +1,86 @@
+import numpy as np
+
+
+# basis of the conventional cubic cells in lattice units
+BASIS = {
+    "sc": np.array([[0.0, 0.0, 0.0]]),
+    "bcc": np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.5]]),
+    "fcc": np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.0], [0.5, 0.0, 0.5], [0.0, 0.5, 0.5]]),
+}
+
+# primitive hcp cell of Ti (c/a = 1.588): triclinic cell vectors and basis in units of a
+HCP_CELL = np.array([[1.0, 0.0, 0.0], [0.5, 0.866025, 0.0], [0.0, 0.0, 1.588]])
+HCP_BASIS = np.array([[0.0, 0.0, 0.0], [0.0, 0.577350269189626, 0.794]])
+
+
+class Structure:
+    """
+    Atoms of a structure: Cartesian positions, cell matrix (cell vectors and origin as columns), periodicity,
+    1-based types and masses per type
+    """
+    def __init__(self, positions, cell, pbc=(True, True, True), types=None, masses=None):
+        self.positions = np.asarray(positions, dtype=float)
+        self.cell = np.asarray(cell, dtype=float)
+        self.pbc = tuple(bool(p) for p in pbc)
+        self.types = np.ones(len(self.positions), dtype=int) if types is None else np.asarray(types, dtype=int)
+        self.masses = masses or {}
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def cubic_block(kind, a, extent):
+    """
+    Atoms of a cubic lattice inside the block [0, extent) (in lattice units) like `create_atoms 1 box` of Lammps,
+    so an extent slightly above an integer closes the faces of the block
+    """
+    n = int(np.ceil(extent))
+    cells = np.array(np.meshgrid(*[np.arange(n)] * 3, indexing="ij")).reshape(3, -1).T
+    points = (cells[:, None, :] + BASIS[kind][None]).reshape(-1, 3)
+    points = points[np.all(points < extent, axis=1)]
+    cell = np.zeros((3, 4))
+    cell[:, :3] = np.eye(3) * extent * a
+    return Structure(points * a, cell)
+
+
+def hcp_block(a, repeat):
+    """
+    Replicated triclinic hcp cell, the same atoms as `replicate` of the Ti primitive cell
+    """
+    vectors = HCP_CELL * a
+    cells = np.array(np.meshgrid(*[np.arange(n) for n in repeat], indexing="ij")).reshape(3, -1).T
+    positions = (cells @ vectors)[:, None, :] + (HCP_BASIS * a)[None]
+    cell = np.zeros((3, 4))
+    cell[:, :3] = (vectors * np.array(repeat)[:, None]).T
+    return Structure(positions.reshape(-1, 3), cell)
+
+
+def add_vacuum(structure, vacuum):
+    """
+    Pad the cell with vacuum on every side and make it non-periodic
+    """
+    cell = structure.cell.copy()
+    units = cell[:, :3] / np.linalg.norm(cell[:, :3], axis=0)
+    cell[:, :3] += units * 2 * vacuum
+    cell[:, 3] -= units.sum(axis=1) * vacuum
+    return Structure(structure.positions, cell, (False, False, False), structure.types, structure.masses)
+
+
+def write_data(structure, path, comment="Start File for LAMMPS"):
+    """
+    Write a structure as atomic Lammps data file
+    """
+    (lx, xy, xz, xlo), (_, ly, yz, ylo), (_, _, lz, zlo) = structure.cell
+    n_types = max(int(structure.types.max()), len(structure.masses), 1) if len(structure) else 1
+    with open(path, "w") as fw:
+        fw.write(f"{comment}\n\n{len(structure)} atoms\n{n_types} atom types\n\n")
+        fw.write(f"{xlo:.10f} {xlo + lx:.10f} xlo xhi\n{ylo:.10f} {ylo + ly:.10f} ylo yhi\n{zlo:.10f} {zlo + lz:.10f} zlo zhi\n")
+        if xy or xz or yz:
+            fw.write(f"{xy:.10f} {xz:.10f} {yz:.10f} xy xz yz\n")
+        if structure.masses:
+            fw.write("\nMasses\n\n")
+            for type_id, mass in sorted(structure.masses.items()):
+                fw.write(f"{type_id} {mass}\n")
+        fw.write("\nAtoms # atomic\n\n")
+        atoms = np.column_stack([np.arange(1, len(structure) + 1), structure.types, structure.positions])
+        np.savetxt(fw, atoms, fmt=["%d", "%d", "%.10f", "%.10f", "%.10f"])
@@ -0,0 +1,22 @@
+import sys
+from mpi4py import MPI
+from lammps import lammps
+
+
+def main(argv):
+    """
+    Run a Lammps input file on all ranks of MPI.COMM_WORLD, started by run_mpi() of functions_library as
+    mpirun -np N python mpi_run.py input_file log_file [lammps arguments]
+    """
+    input_file, log, *args = argv
+    comm = MPI.COMM_WORLD
+    lmp = lammps(comm=comm, cmdargs=["-log", log, "-screen", "none"] + args)
+    lmp.file(input_file)
+    step = int(lmp.extract_global("ntimestep"))
+    lmp.close()
+    if comm.Get_rank() == 0:
+        print(f"step {step}", flush=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,23 @@
+import os
+import sys
+import types
+import pytest
+
+# the modules live in the repository root next to the notebooks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def lammps_constants(monkeypatch):
+    """
+    Stand-in for the lammps module where Lammps is not installed, the stages only import its constants and talk
+    to a fake instance
+    """
+    if "lammps" not in sys.modules:
+        try:
+            import lammps  # noqa: F401
+        except ImportError:
+            module = types.SimpleNamespace(LMP_STYLE_GLOBAL=0, LMP_STYLE_ATOM=1, LMP_TYPE_SCALAR=0, LMP_TYPE_VECTOR=1,
+                                           LMP_TYPE_ARRAY=2)
+            monkeypatch.setitem(sys.modules, "lammps", module)
+    return sys.modules["lammps"]
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import pytest
+import functions_library as fl
+
+
+class FakeLammps:
+    """
+    Instance which records the stride of the adaptive dump
+    """
+    def __init__(self, stride):
+        self.step = 0
+        self.stride = stride
+
+    def extract_global(self, name):
+        return self.step
+
+    def commands_string(self, commands):
+        pass
+
+    def command(self, cmd):
+        words = cmd.split()
+        if words[:2] == ["variable", "dump_stride"]:
+            self.stride = int(words[-1])
+
+
+def potential_energy(steps, seed, melt=None, rise=50.0, noise=2.0):
+    """
+    Potential energy of 500 atoms on a heating ramp, rising by `rise` eV over the steps of melt=(first, last)
+    """
+    rng = np.random.default_rng(seed)
+    pe = -1680.0 + 0.001 * steps + rng.normal(0, noise, len(steps))
+    if melt is not None:
+        first, last = melt
+        pe += rise * np.clip((steps - first) / (last - first), 0.0, 1.0)
+    return pe
+
+
+def run(s, seed, melt=None, rise=50.0):
+    """
+    Drive the dump through the chunks of a run, returns the dump and the steps of the frames Lammps writes:
+    the first frame and every multiple of the stride which was set at the start of a chunk
+    """
+    dump = fl.AdaptiveDump(s)
+    log = fl.ThermoLog(s.total_steps // s.thermo_time + 1)
+    fl.live_thermo[s.run_dir] = log
+    steps = np.arange(0, s.total_steps + 1, s.thermo_time)
+    pe = potential_energy(steps, seed, melt, rise)
+    lmp = FakeLammps(dump.sparse)
+    dump.setup(lmp)
+    frames, dense = [0], []
+    try:
+        for first in range(0, s.total_steps, dump.every):
+            last = min(first + dump.every, s.total_steps)
+            frames += list(range(first - first % lmp.stride + lmp.stride, last + 1, lmp.stride))
+            if lmp.stride != dump.sparse:
+                dense.append(first)
+            for step, value in zip(steps, pe):
+                if first < step <= last:
+                    log.append([step, 0, value, 0, 0, 0, 0, 0, 0])
+            lmp.step = last
+            dump.sample(lmp, last)
+    finally:
+        fl.live_thermo.pop(s.run_dir, None)
+    return dump, frames, dense
+
+
+@pytest.fixture
+def system(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    s = fl.MD_system(Project_name="run", element="Al", lattice_constant=4.05, start_temperature=300,
+                     end_temperature=1500, frame_budget=200, checkpoint_every=0)
+    os.makedirs(s.run_dir)
+    return s
+
+
+def test_budget_split(system):
+    dump = fl.AdaptiveDump(system)
+    assert dump.every == 10 * system.thermo_time
+    assert dump.sparse % system.dump_interval == 0
+    sparse_frames = system.total_steps // dump.sparse + 1
+    assert sparse_frames <= system.frame_budget // 2 + 1
+    assert sparse_frames + dump.dense_budget == system.frame_budget
+
+
+def test_quiet_run_stays_sparse(system):
+    chunks = system.total_steps // fl.AdaptiveDump(system).every
+    dense = sum(len(run(system, seed)[2]) for seed in range(20))
+    # single noisy chunks may turn dense, the fitted slope keeps them rare
+    assert dense < 0.01 * 20 * chunks
+
+
+def test_dense_around_melting(system):
+    dump, frames, dense = run(system, 0, melt=(70000, 80000))
+    assert dense and all(70000 <= step <= 80000 for step in dense)
+    assert dump.dense_frames > 0
+    assert len(set(frames)) <= system.frame_budget
+
+
+@pytest.mark.parametrize("budget", [20, 60, 200])
+def test_frames_within_budget(system, budget):
+    # a transition which stays active for most of the run uses up the dense budget
+    system.frame_budget = budget
+    dump, frames, dense = run(system, 1, melt=(20000, 140000), rise=2000.0)
+    assert dump.dense_frames <= dump.dense_budget < dump.dense_frames + dump.every // system.dump_interval
+    assert len(set(frames)) <= budget
+    assert frames == sorted(set(frames))
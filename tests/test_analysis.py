@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import analysis
+import lattice
+import trajectory
+
+
+A = 4.05
+
+
+def write_crystal(path, n_frames, scale=0.05, pbc=(True, True, True), seed=0):
+    """
+    Binary trajectory of an fcc Al block whose atoms jiggle by `scale` Angstrom around their sites
+    """
+    structure = lattice.cubic_block("fcc", A, 4)
+    rng = np.random.default_rng(seed)
+    with trajectory.TrajectoryWriter(path, len(structure), ["type", "x", "y", "z"], pbc) as writer:
+        for step in range(n_frames):
+            positions = structure.positions + rng.normal(scale=scale, size=structure.positions.shape)
+            writer.append(100 * step, structure.cell, np.column_stack([structure.types, positions]))
+    return structure
+
+
+def test_nearest_distance():
+    structure = lattice.cubic_block("fcc", A, 4)
+    assert analysis.nearest_distance(structure.positions, structure.cell, structure.pbc) == pytest.approx(A / np.sqrt(2))
+
+
+def test_minimum_image():
+    structure = lattice.cubic_block("fcc", A, 4)
+    d = np.array([[3.5 * A, 0.0, -0.5 * A]])
+    assert np.allclose(analysis.minimum_image(d, structure.cell, (True, True, False)), [[-0.5 * A, 0.0, -0.5 * A]])
+
+
+def test_periodic_crystal(tmp_path):
+    path = str(tmp_path / "melting")
+    write_crystal(path + trajectory.SUFFIX, 12, scale=0.05)
+    results = analysis.analyse_trajectory(path, chunk=5, max_workers=1)
+    assert len(results["series"]["step"]) == 12 and len(results["windows"]["lindemann"]) == 3
+    assert np.all(results["series"]["coordination"] == 12)
+    assert np.all(results["series"]["surface_fraction"] == 0)
+    # independent displacements of 0.05 Angstrom per component
+    assert np.mean(results["series"]["msd"][1:]) == pytest.approx(2 * 3 * 0.05 ** 2, rel=0.2)
+    assert 0 < results["lindemann"] < 0.05
+    stored = analysis.load_analysis(str(tmp_path / "analysis"))
+    assert np.allclose(stored["series"]["msd"], results["series"]["msd"])
+    assert stored["atom_coordination"].shape == (12, 256)
+
+
+def test_cluster_surface(tmp_path):
+    path = str(tmp_path / "melting")
+    write_crystal(path + trajectory.SUFFIX, 2, scale=0.0, pbc=(False, False, False))
+    results = analysis.analyse_trajectory(path, max_workers=1)
+    # 148 of the 256 atoms of the open 4x4x4 block have fewer than 10 neighbours
+    assert results["series"]["surface_fraction"][0] == pytest.approx(148 / 256)
+    assert results["series"]["coordination"][0] == pytest.approx(9.1875)
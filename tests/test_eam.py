@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import pytest
+import eam
+
+
+POTENTIALS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "potentials")
+
+
+class Crystal:
+    """
+    Periodic fcc block of n x n x n conventional cells
+    """
+    def __init__(self, a, n):
+        basis = np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.0], [0.5, 0.0, 0.5], [0.0, 0.5, 0.5]])
+        cells = np.array(np.meshgrid(*[np.arange(n)] * 3, indexing="ij")).reshape(3, -1).T
+        self.positions = ((cells[:, None, :] + basis[None]).reshape(-1, 3) * a)
+        self.cell = np.zeros((3, 4))
+        self.cell[:, :3] = np.eye(3) * n * a
+        self.pbc = (True, True, True)
+        self.types = np.ones(len(self.positions), dtype=int)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+@pytest.fixture(scope="module")
+def aluminium():
+    potential = eam.read_setfl(os.path.join(POTENTIALS, "Al03.eam.alloy"))
+    return eam.EAMCalculator(potential, "Al"), Crystal(4.05, 3)
+
+
+def test_cohesive_energy(aluminium):
+    calculator, structure = aluminium
+    energy, energies, forces = calculator.compute(structure.positions, structure.cell, structure.pbc, structure.types)
+    assert energy / len(structure) == pytest.approx(-3.36, abs=0.01)
+    assert np.allclose(energies, energies[0])
+    # every atom of the perfect crystal sits at an inversion centre
+    assert np.abs(forces).max() < 1e-8
+
+
+def test_forces_match_energy_gradient(aluminium):
+    calculator, structure = aluminium
+    rng = np.random.default_rng(1)
+    positions = structure.positions + rng.normal(scale=0.05, size=structure.positions.shape)
+    _, _, forces = calculator.compute(positions, structure.cell, structure.pbc, structure.types)
+    h = 1e-5
+    for atom, k in [(0, 0), (5, 1), (17, 2), (40, 0)]:
+        energies = []
+        for sign in (1, -1):
+            displaced = positions.copy()
+            displaced[atom, k] += sign * h
+            energies.append(calculator.compute(displaced, structure.cell, structure.pbc, structure.types)[0])
+        assert -(energies[0] - energies[1]) / (2 * h) == pytest.approx(forces[atom, k], abs=1e-4)
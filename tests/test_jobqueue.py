@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import socket
+import pytest
+import jobqueue
+
+
+def ticket(user, key, submitted, started=None, cores=1, work=0.0):
+    """
+    Ticket of a live job of this process
+    """
+    return {"id": f"{user}-{key}-{submitted}", "key": key, "cores": cores, "work": work, "name": key, "user": user,
+            "host": socket.gethostname(), "pid": os.getpid(), "submitted": submitted, "started": started}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobqueue.JobQueue(str(tmp_path / "queue"), workers=4, poll=0.01)
+
+
+def ids(tickets):
+    return [t["id"] for t in tickets]
+
+
+def test_queue_user(monkeypatch):
+    monkeypatch.delenv("MD_QUEUE_USER", raising=False)
+    monkeypatch.setenv("JUPYTERHUB_USER", "ada")
+    assert jobqueue.Job("key").user == "ada"
+    monkeypatch.setenv("MD_QUEUE_USER", "grace")
+    assert jobqueue.Job("key").user == "grace"
+
+
+def test_order_round_robin(queue):
+    tickets = [ticket("ada", "a1", 1), ticket("ada", "a2", 2), ticket("ada", "a3", 3),
+               ticket("bob", "b1", 4), ticket("bob", "b2", 5), ticket("eve", "e1", 6)]
+    running, waiting, held = queue.order(tickets)
+    assert running == [] and held == []
+    assert ids(waiting) == ["ada-a1-1", "bob-b1-4", "eve-e1-6", "ada-a2-2", "bob-b2-5", "ada-a3-3"]
+
+
+def test_order_counts_running_jobs(queue):
+    tickets = [ticket("ada", "a0", 0, started=0), ticket("ada", "a1", 1), ticket("bob", "b1", 2)]
+    running, waiting, _ = queue.order(tickets)
+    assert ids(running) == ["ada-a0-0"]
+    assert ids(waiting) == ["bob-b1-2", "ada-a1-1"]
+
+
+def test_order_holds_duplicates(queue):
+    tickets = [ticket("ada", "same", 0, started=0), ticket("bob", "same", 1), ticket("bob", "other", 2),
+               ticket("eve", "other", 3)]
+    _, waiting, held = queue.order(tickets)
+    assert ids(waiting) == ["bob-other-2"]
+    assert ids(held) == ["bob-same-1", "eve-other-3"]
+
+
+def write(queue, tickets):
+    os.makedirs(queue.jobs_dir, exist_ok=True)
+    for t in tickets:
+        with open(queue.path(t["id"]), "w") as fw:
+            json.dump(t, fw)
+
+
+def test_wait_admits_within_workers(queue):
+    write(queue, [ticket("ada", "a0", 0, started=time.time(), cores=2)])
+    job = queue.submit(jobqueue.Job("b1", cores=2))
+    assert queue.wait(job)
+    assert job.started is not None
+    with open(queue.path(job.id)) as fr:
+        assert json.load(fr)["started"] == job.started
+    assert queue.status(job) is None
+
+
+def test_wait_blocks_on_full_machine(queue):
+    write(queue, [ticket("ada", "a0", 0, started=time.time(), cores=3)])
+    job = queue.submit(jobqueue.Job("b1", cores=2))
+    assert queue.status(job)["position"] == 1
+    polls = []
+    # skip() ends the wait once it is true, the job leaves the queue without a slot
+    assert queue.wait(job, skip=lambda: polls.append(1) or len(polls) > 3)
+    assert job.started is None and len(polls) == 4
+    assert not os.path.exists(queue.path(job.id))
+
+
+def test_large_job_runs_alone(queue):
+    job = queue.submit(jobqueue.Job("big", cores=16))
+    assert queue.wait(job)
+
+
+def test_cancel_while_waiting(queue):
+    write(queue, [ticket("ada", "a0", 0, started=time.time(), cores=4)])
+    job = queue.submit(jobqueue.Job("b1"))
+    job.cancelled = True
+    assert not queue.wait(job)
+    assert not os.path.exists(queue.path(job.id))
+
+
+def test_dead_tickets_are_removed(queue):
+    dead = dict(ticket("ada", "a0", 0, started=0, cores=4), pid=2 ** 22 + 1)
+    write(queue, [dead])
+    assert queue.tickets() == []
+    job = queue.submit(jobqueue.Job("b1"))
+    assert queue.wait(job)
+    assert not os.path.exists(queue.path(dead["id"]))
+
+
+def test_eta_from_history(queue):
+    os.makedirs(queue.directory, exist_ok=True)
+    # 100 work units per second
+    queue.record(1000.0, 10.0)
+    assert queue.throughput() == pytest.approx(100.0)
+    now = time.time()
+    running = [ticket("ada", "a0", 0, started=now, cores=4, work=500.0)]
+    waiting = [ticket("bob", "b1", 1, cores=2, work=300.0), ticket("eve", "e1", 2, cores=4, work=100.0)]
+    # b1 starts when a0 ends after 5 s, e1 needs the whole machine after b1 ends 3 s later
+    assert queue.eta(running, waiting[:1]) == pytest.approx(5.0, abs=0.1)
+    assert queue.eta(running, waiting) == pytest.approx(8.0, abs=0.1)
+
+
+def test_eta_without_history(queue):
+    assert queue.eta([], [ticket("bob", "b1", 1)]) is None
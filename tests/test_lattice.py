@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import eam
+import lattice
+
+
+@pytest.mark.parametrize("kind, per_cell", [("sc", 1), ("bcc", 2), ("fcc", 4)])
+def test_cubic_block_counts(kind, per_cell):
+    assert len(lattice.cubic_block(kind, 4.05, 3)) == per_cell * 27
+
+
+def test_cubic_block_closes_faces():
+    # like create_atoms in a block of box_length + 0.1 lattice units: the fcc sites of a 7x7x7 grid of half
+    # lattice units, i.e. the points with an even sum of indices
+    assert len(lattice.cubic_block("fcc", 4.05, 3.1)) == (7 ** 3 + 1) // 2
+
+
+def test_hcp_block():
+    structure = lattice.hcp_block(2.95, (2, 3, 4))
+    assert len(structure) == 2 * 2 * 3 * 4
+    volume = abs(np.linalg.det(structure.cell[:, :3]))
+    assert volume == pytest.approx(24 * 0.866025 * 1.588 * 2.95 ** 3)
+    distances = np.linalg.norm(structure.positions[1:] - structure.positions[0], axis=1)
+    # c/a = 1.588 is below the ideal ratio, the nearest neighbours are in the adjacent planes
+    assert distances.min() == pytest.approx(2.95 * np.sqrt(1 / 3 + 0.794 ** 2))
+
+
+def test_write_data_round_trip(tmp_path):
+    structure = lattice.hcp_block(2.95, (2, 2, 2))
+    structure.masses = {1: 47.867}
+    path = str(tmp_path / "initial_Ti")
+    lattice.write_data(structure, path)
+    positions, cell, types, masses = eam.read_data(path)
+    assert np.allclose(positions, structure.positions)
+    assert np.allclose(cell[:, :3], structure.cell[:, :3])
+    assert list(types) == [1] * len(structure)
+    assert masses == {1: pytest.approx(47.867)}
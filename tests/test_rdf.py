@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pytest
+import analysis
+import trajectory
+from test_analysis import A, write_crystal
+
+
+def test_fcc_peaks(tmp_path):
+    path = str(tmp_path / "melting")
+    write_crystal(path + trajectory.SUFFIX, 6, scale=0.1)
+    results = analysis.rdf_trajectory(path, window=3, max_workers=1)
+    assert results["g"].shape == (2, 200) and results["S"].shape == (2, 231)
+    assert list(results["first_step"]) == [0, 300] and list(results["last_step"]) == [200, 500]
+    # first shell at a/sqrt(2), first peak of S(q) near the (111) reflection 2 pi sqrt(3) / a
+    assert np.all(np.abs(results["r"][results["g"].argmax(axis=1)] - A / np.sqrt(2)) < 0.05)
+    assert np.all(np.abs(results["q"][results["S"].argmax(axis=1)] - 2.75) < 0.1)
+    # no pairs inside the repulsive core, g(r) approaches 1 at large r
+    assert np.all(results["g"][:, results["r"] < 2.0] == 0)
+    assert np.mean(results["g"][:, results["r"] > 6.0]) == pytest.approx(1.0, abs=0.1)
+
+
+def test_cluster(tmp_path):
+    path = str(tmp_path / "melting")
+    write_crystal(path + trajectory.SUFFIX, 2, scale=0.1, pbc=(False, False, False))
+    results = analysis.rdf_trajectory(path, window=2, max_workers=1)
+    near = results["r"] < 4.0
+    assert results["r"][near][results["g"][0][near].argmax()] == pytest.approx(A / np.sqrt(2), abs=0.05)
+    # the Debye sum of a crystalline cluster peaks near the (111) reflection as well
+    beyond = results["q"] > 1.5
+    assert results["q"][beyond][results["S"][0][beyond].argmax()] == pytest.approx(2 * np.pi * np.sqrt(3) / A,
+                                                                                    abs=0.1)
+
+
+def test_cache(tmp_path):
+    path = str(tmp_path / "melting")
+    write_crystal(path + trajectory.SUFFIX, 4, scale=0.1)
+    first = analysis.rdf_trajectory(path, window=2, max_workers=1, cache=True)
+    assert len(os.listdir(tmp_path / "analysis")) == 1
+    second = analysis.rdf_trajectory(path, window=2, max_workers=1, cache=True)
+    assert np.array_equal(first["g"], second["g"]) and np.array_equal(first["S"], second["S"])
@@ -0,0 +1,118 @@
+import os
+import shutil
+from dataclasses import replace
+import pytest
+import functions_library as fl
+
+
+POTENTIALS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "potentials")
+
+
+def prepare(s):
+    """
+    Run directory with the potential and the initial structure, like setup_run
+    """
+    os.makedirs(s.run_dir, exist_ok=True)
+    shutil.copyfile(os.path.join(POTENTIALS, s.potential_name), os.path.join(s.run_dir, s.potential_name))
+    fl.write_structure(s, os.path.join(s.run_dir, f"initial_{s.element}"))
+    return s
+
+
+def finish(s, size=100):
+    """
+    Output files of a finished run of the system
+    """
+    for name in fl.result_cache.outputs(s):
+        with open(os.path.join(s.run_dir, name), "wb") as fw:
+            fw.write(b"x" * size)
+    return s
+
+
+@pytest.fixture
+def system(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return prepare(fl.MD_system(Project_name="run", element="Al", lattice_constant=4.05, start_temperature=300,
+                                end_temperature=1500, checkpoint_every=0))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return fl.ResultCache(str(tmp_path / "cache"))
+
+
+def test_key_ignores_execution_settings(system, cache):
+    other = prepare(replace(system, Project_name="other", accelerator="omp", threads=4, queue=False))
+    assert cache.key(other) == cache.key(system)
+
+
+@pytest.mark.parametrize("change", [{"thermo_time": 100}, {"dump_every": 400}, {"frame_budget": 500},
+                                    {"insitu_every": 1000}, {"seed": 7}, {"end_temperature": 1400}])
+def test_key_covers_physics_and_cadence(system, cache, change):
+    other = prepare(replace(system, Project_name="other", **change))
+    assert cache.key(other) != cache.key(system)
+
+
+def test_key_covers_structure(system, cache):
+    key = cache.key(system)
+    with open(os.path.join(system.run_dir, "initial_Al"), "a") as fw:
+        fw.write("\n")
+    assert cache.key(system) != key
+
+
+def test_store_and_restore(system, cache):
+    key = cache.key(finish(system))
+    assert not cache.usable(key, system)
+    cache.store(key, system, system.total_steps)
+    assert cache.usable(key, system)
+    stored = os.listdir(cache.path(key))
+    # inputs are not stored
+    assert "initial_Al" not in stored and system.potential_name not in stored
+
+    other = prepare(replace(system, Project_name="other"))
+    assert cache.restore(key, other) == system.total_steps
+    for name in cache.outputs(system):
+        assert os.path.getsize(os.path.join(other.run_dir, name)) == 100
+
+
+def test_entry_needs_the_requested_outputs(system, cache):
+    key = cache.key(finish(replace(system, dump_trajectory=False)))
+    cache.store(key, replace(system, dump_trajectory=False), system.total_steps)
+    assert cache.usable(key, replace(system, dump_trajectory=False))
+    # a run with a trajectory finds no trajectory in the entry, its store replaces the entry
+    assert not cache.usable(key, system)
+    assert cache.restore(key, system) is None
+    cache.store(key, finish(system), system.total_steps)
+    assert cache.usable(key, system)
+
+
+def test_evicts_least_recently_used(system, cache):
+    keys = []
+    for i, seed in enumerate([1, 2, 3]):
+        variant = finish(prepare(replace(system, Project_name=f"run{seed}", seed=seed)), size=1000)
+        keys.append(cache.key(variant))
+        cache.store(keys[-1], variant, system.total_steps)
+        os.utime(cache.path(keys[-1]), (1000 + i, 1000 + i))
+    # restoring the oldest entry makes it the most recently used one
+    assert cache.restore(keys[0], prepare(replace(system, Project_name="restored", seed=1))) is not None
+    cache.max_bytes = sum(size for _, size, _ in cache.entries()) - 1
+    cache.evict()
+    assert [os.path.basename(entry) for _, _, entry in cache.entries()] == [keys[2], keys[0]]
+    cache.max_bytes = 0
+    cache.evict()
+    assert cache.entries() == []
+
+
+def test_force_runs_despite_entry(system, cache, monkeypatch):
+    runs = []
+    monkeypatch.setattr(fl, "result_cache", cache)
+    monkeypatch.setattr(fl, "execution_config", lambda s: {})
+    monkeypatch.setattr(fl, "write_input", lambda s, metrics=None: None)
+    monkeypatch.setattr(fl, "finish_run", lambda s: None)
+    monkeypatch.setattr(fl, "run_lammps", lambda *args, **kwargs: runs.append(args) or system.total_steps)
+    system = replace(system, queue=False)
+    finish(system)
+    assert fl.execute_run(system, screen=False) == system.total_steps
+    assert fl.execute_run(system, screen=False) == system.total_steps
+    assert len(runs) == 1
+    assert fl.execute_run(system, screen=False, force=True) == system.total_steps
+    assert len(runs) == 2
@@ -0,0 +1,41 @@
+import os
+import shutil
+import pytest
+import eam
+import functions_library as fl
+
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(REPOSITORY, "potentials"), tmp_path / "potentials",
+                    ignore=shutil.ignore_patterns(".cache"))
+    os.makedirs(tmp_path / "structures")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(fl, "execute_run", lambda s, **kwargs: s.total_steps)
+    return tmp_path
+
+
+def system(name, box_length):
+    return fl.MD_system(Project_name=name, element="Al", lattice_constant=4.05, box_length=box_length,
+                        start_temperature=300, end_temperature=1500)
+
+
+def test_calculation_builds_into_run_dir(workdir):
+    small, large = system("small", 3), system("large", 4)
+    fl.calculation(large)
+    fl.calculation(small)
+    assert os.listdir(workdir / "structures") == []
+    # each run keeps its own structure, runs of the same element do not share a file
+    for s, n_atoms in [(small, 172), (large, 365)]:
+        positions, _, _, _ = eam.read_data(os.path.join(s.run_dir, "initial_Al"))
+        assert len(positions) == n_atoms
+
+
+def test_calculation_needs_lattice_constant(workdir):
+    s = system("run", 3)
+    s.lattice_constant = None
+    with pytest.raises(ValueError, match="Preview"):
+        fl.calculation(s)
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pytest
+import functions_library as fl
+import trajectory
+
+
+def row(step):
+    """
+    Thermo row of a heating run at `step`
+    """
+    return [step, 300 + 0.01 * step, -1680 + 0.001 * step, -1600 + 0.002 * step, 1.0, 2e4, 0, 0, 0]
+
+
+class FakeLammps:
+    """
+    Instance with the storage of fix vector: a row on every multiple of its interval from the step the fix was
+    defined on. Rows beyond the stored ones raise instead of reading garbage like the library does
+    """
+    def __init__(self, step=0):
+        self.step = step
+        self.interval = None
+        self.rows = []
+
+    def extract_global(self, name):
+        return self.step
+
+    def command(self, cmd):
+        words = cmd.split()
+        if words[:4] == ["fix", "thermo_capture", "all", "vector"]:
+            self.interval = int(words[4])
+            self.rows = []
+            self.stored = self.step - 1
+
+    def run(self, steps):
+        for step in range(self.stored + 1, self.step + steps + 1):
+            if step % self.interval == 0:
+                self.rows.append(row(step))
+        self.step += steps
+        self.stored = self.step
+
+    def extract_fix(self, name, style, kind, i, j):
+        return self.rows[i][j]
+
+
+@pytest.fixture
+def system(tmp_path, monkeypatch, lammps_constants):
+    monkeypatch.chdir(tmp_path)
+    s = fl.MD_system(Project_name="run", element="Al", lattice_constant=4.05, start_temperature=300,
+                     end_temperature=1500, running_steps=10000, checkpoint_every=0)
+    os.makedirs(s.run_dir)
+    return s
+
+
+def capture(s, lmp, chunk, stop=None, resume=False):
+    """
+    Run the capture like run_in_chunks: setup, the initial run 0 of a fresh run, then chunks of `chunk` steps
+    """
+    stage = fl.ThermoCapture(s, resume=resume)
+    stage.setup(lmp)
+    if not resume:
+        lmp.run(0)
+        stage.sample(lmp, lmp.step)
+    stop = s.total_steps if stop is None else stop
+    while lmp.step < stop:
+        lmp.run(min(chunk, stop - lmp.step))
+        stage.sample(lmp, lmp.step)
+        assert fl.live_thermo[s.run_dir] is stage.log
+    return stage
+
+
+def test_columns_round_trip(tmp_path):
+    path = str(tmp_path / "series.bin")
+    columns = {"step": np.arange(5.0), "pe": np.linspace(-3, -2, 5)}
+    trajectory.write_columns(path, columns, element="Al")
+    stored = trajectory.read_columns(path)
+    assert list(stored) == ["step", "pe"]
+    assert all(np.array_equal(stored[name], columns[name]) for name in columns)
+    trajectory.write_columns(path, {"step": np.zeros(0)})
+    assert len(trajectory.read_columns(path)["step"]) == 0
+    with open(path, "r+b") as fw:
+        fw.write(b"garbage!")
+    with pytest.raises(ValueError):
+        trajectory.read_columns(path)
+
+
+def test_log_grows_and_truncates(tmp_path):
+    log = fl.ThermoLog(capacity=2)
+    for step in range(0, 1000, 100):
+        log.append(row(step))
+    assert len(log) == 10 and np.array_equal(log.step, np.arange(0, 1000, 100))
+    assert log.latest()["pe"] == pytest.approx(row(900)[2])
+    log.truncate(450)
+    assert list(log.step) == [0, 100, 200, 300, 400]
+    log.truncate(400)
+    assert len(log) == 5
+    log.save(str(tmp_path / "thermo.bin"), element="Al")
+    loaded = fl.ThermoLog.load(str(tmp_path / "thermo.bin"), extra=3)
+    assert np.array_equal(loaded.data[:, :5], log.data[:, :5]) and loaded.data.shape[1] == 8
+    with pytest.raises(AttributeError):
+        log.enthalpy
+
+
+@pytest.mark.parametrize("chunk", [2000, 700, 10000])
+def test_capture_drains_every_row_once(system, chunk):
+    lmp = FakeLammps()
+    stage = capture(system, lmp, chunk)
+    assert np.array_equal(stage.log.step, np.arange(0, system.total_steps + 1, system.thermo_time))
+    stage.finish(lmp)
+    assert system.run_dir not in fl.live_thermo
+    saved = fl.thermo_log(system)
+    assert np.array_equal(saved.step, stage.log.step)
+    assert np.allclose(saved.pe, [row(step)[2] for step in saved.step])
+
+
+def test_capture_resumes_from_checkpoint(system):
+    # the interrupted run saved rows up to 7000, its checkpoint is at step 5100
+    lmp = FakeLammps()
+    capture(system, lmp, 700, stop=7000).save()
+    lmp = FakeLammps(step=5100)
+    stage = capture(system, lmp, 2000, resume=True)
+    stage.finish(lmp)
+    steps = fl.thermo_log(system).step
+    assert np.array_equal(steps, np.arange(0, system.total_steps + 1, system.thermo_time))
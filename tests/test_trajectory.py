@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+import trajectory
+
+
+# triclinic cell (cell vectors and origin as columns) like the hcp boxes of the Ti runs
+CELL = np.array([[8.85, 4.425, 0.0, 0.0], [0.0, 7.664, 0.0, 0.0], [0.0, 0.0, 9.369, 0.0]])
+
+
+def write_frames(path, timesteps, n_atoms=36, seed=0):
+    """
+    Binary trajectory of random atoms in CELL with one frame per timestep
+    """
+    rng = np.random.default_rng(seed)
+    fractional = rng.random((n_atoms, 3))
+    with trajectory.TrajectoryWriter(path, n_atoms, ["type", "x", "y", "z"], element="Ti") as writer:
+        for timestep in timesteps:
+            positions = (fractional + rng.normal(scale=0.005, size=fractional.shape)) @ CELL[:, :3].T
+            writer.append(timestep, CELL, np.column_stack([np.ones(n_atoms), positions]))
+
+
+@pytest.fixture
+def dump(tmp_path):
+    traj_path = str(tmp_path / "melting.mdtraj")
+    write_frames(traj_path, [0, 100, 200])
+    return trajectory.export_dump(traj_path, str(tmp_path / "melting"))
+
+
+def test_export_convert_round_trip(dump, tmp_path):
+    original = trajectory.Trajectory(str(tmp_path / "melting.mdtraj"))
+    converted = trajectory.Trajectory(trajectory.convert_dump(dump, str(tmp_path / "converted.mdtraj")))
+    assert list(converted.timesteps) == [0, 100, 200]
+    assert converted.columns == original.columns
+    for i in range(len(original)):
+        assert np.allclose(converted.cell(i), original.cell(i))
+        assert np.allclose(converted.positions(i), original.positions(i), atol=1e-4)
+
+
+def test_dump_reader_matches_trajectory(dump, tmp_path):
+    original = trajectory.Trajectory(str(tmp_path / "melting.mdtraj"))
+    reader = trajectory.DumpReader(dump)
+    assert len(reader) == 3 and reader.n_atoms == original.n_atoms
+    for i in [2, 0, -2]:
+        assert np.allclose(reader.positions(i), original.positions(i), atol=1e-4)
+        assert np.allclose(reader.cell(i), original.cell(i))
+
+
+def test_index_follows_appended_frames(dump):
+    first = trajectory.index_dump(dump)
+    with open(dump, "rb") as fr:
+        frame = fr.read(int(first[1, 0]))
+    # a frame which is still being written is not indexed
+    with open(dump, "ab") as fw:
+        fw.write(frame.replace(b"ITEM: TIMESTEP\n0\n", b"ITEM: TIMESTEP\n300\n")[:-40])
+    assert list(trajectory.index_dump(dump)[:, 1]) == [0, 100, 200]
+    with open(dump, "ab") as fw:
+        fw.write(frame[-40:])
+    index = trajectory.index_dump(dump)
+    assert list(index[:, 1]) == [0, 100, 200, 300]
+    assert np.array_equal(index[:3], first)
+    assert np.array_equal(np.fromfile(dump + trajectory.INDEX_SUFFIX, dtype=np.int64).reshape(-1, 3), index)
+
+
+def test_index_rebuilt_for_rewritten_dump(dump, tmp_path):
+    trajectory.index_dump(dump)
+    # a new run of the same system writes a longer dump with other timesteps
+    write_frames(str(tmp_path / "rerun.mdtraj"), [0, 500, 1000, 1500], seed=1)
+    trajectory.export_dump(str(tmp_path / "rerun.mdtraj"), dump)
+    assert list(trajectory.index_dump(dump)[:, 1]) == [0, 500, 1000, 1500]
+    assert np.allclose(trajectory.DumpReader(dump).positions(1),
+                       trajectory.Trajectory(str(tmp_path / "rerun.mdtraj")).positions(1), atol=1e-4)
+
+
+def test_open_trajectory_prefers_binary(dump, tmp_path):
+    assert isinstance(trajectory.open_trajectory(dump), trajectory.Trajectory)
+    os.remove(str(tmp_path / "melting.mdtraj"))
+    assert isinstance(trajectory.open_trajectory(dump), trajectory.DumpReader)
@@ -0,0 +1,134 @@
+import os
+import json
+import numpy as np
+import pytest
+import functions_library as fl
+
+
+N_ATOMS = 500
+
+
+class FakeLammps:
+    """
+    Instance of a heating run: the potential energy per atom follows the ramp temperature with noise, relaxes
+    during the first steps (velocity create puts all energy into kinetic energy) and jumps by latent_heat at melt_at.
+    sqrt(MSD) is a vibration amplitude until melt_at and grows afterwards
+    """
+    def __init__(self, s, seed, melt_at=None, latent_heat=0.1, noise=0.005):
+        self.system = s
+        self.rng = np.random.default_rng(seed)
+        self.melt_at = melt_at
+        self.latent_heat = latent_heat
+        self.noise = noise
+        self.step = 0
+        self.numpy = self
+
+    def temperature(self):
+        s = self.system
+        return s.start_temperature + (s.end_temperature - s.start_temperature) * min(self.step / s.total_steps, 1.0)
+
+    def melted(self):
+        return self.melt_at is not None and self.temperature() >= self.melt_at
+
+    def extract_global(self, name):
+        return self.step
+
+    def get_natoms(self):
+        return N_ATOMS
+
+    def command(self, cmd):
+        pass
+
+    def has_package(self, name):
+        return False
+
+    def extract_compute(self, name, style, kind):
+        if name == "thermo_temp":
+            return self.temperature()
+        if name == "transition_msd":
+            amplitude = 0.1 + (0.01 * (self.temperature() - self.melt_at) if self.melted() else 0.0)
+            return np.array([0.0, 0.0, 0.0, amplitude ** 2])
+        pe = -3.36 + 0.00026 * self.temperature() + self.rng.normal(0, self.noise)
+        if self.step < 500:
+            pe -= 0.04
+        if self.melted():
+            pe += self.latent_heat
+        return N_ATOMS * pe
+
+
+@pytest.fixture
+def system(tmp_path, monkeypatch, lammps_constants):
+    monkeypatch.chdir(tmp_path)
+    s = fl.MD_system(Project_name="run", element="Al", lattice_constant=4.05, start_temperature=300,
+                     end_temperature=1500, stop_on_transition="energy", checkpoint_every=0)
+    os.makedirs(s.run_dir)
+    return s
+
+
+def detect(s, lmp):
+    """
+    Temperature at which the order parameter first crosses 0, None without a crossing
+    """
+    detector = fl.TransitionDetector(s)
+    for step in range(0, s.total_steps + 1, s.transition_every):
+        lmp.step = step
+        if detector.order_parameter(lmp) > 0:
+            return lmp.temperature()
+    return None
+
+
+def test_energy_quiet_ramp(system):
+    # the relaxation of the first steps and the thermal slope do not count as a transition
+    assert [detect(system, FakeLammps(system, seed)) for seed in range(50)] == [None] * 50
+
+
+def test_energy_detects_melting(system):
+    for seed in range(20):
+        temperature = detect(system, FakeLammps(system, seed, melt_at=1000))
+        assert temperature is not None and 1000 <= temperature <= 1020
+
+
+def test_energy_needs_baseline_span(system):
+    # samples within baseline_span of the start of the ramp do not make a baseline
+    detector = fl.TransitionDetector(system)
+    lmp = FakeLammps(system, 0, melt_at=0)
+    for step in range(detector.equilibration, detector.equilibration + 10000, 1000):
+        lmp.step = step
+        assert detector.order_parameter(lmp) == -1.0
+
+
+def test_lindemann(system):
+    system.stop_on_transition = "lindemann"
+    assert detect(system, FakeLammps(system, 0)) is None
+    # sqrt(MSD) reaches 0.2 * 2.86 A 47 K above the melting point
+    assert detect(system, FakeLammps(system, 0, melt_at=1000)) == pytest.approx(1047, abs=10)
+
+
+def test_sample_stops_after_settling(system):
+    detector = fl.TransitionDetector(system)
+    lmp = FakeLammps(system, 0, melt_at=1000)
+    detector.setup(lmp)
+    for step in range(0, system.total_steps + 1, system.transition_every):
+        lmp.step = step
+        if detector.sample(lmp, step):
+            break
+    transition = fl.read_transition(system)
+    assert transition["criterion"] == "energy"
+    assert 1000 <= transition["temperature"] <= 1020
+    assert transition["stopped"] == transition["step"] + system.transition_settle == step
+    with open(os.path.join(system.run_dir, fl.TRANSITION_NAME)) as fr:
+        assert json.load(fr) == transition
+
+
+def test_unknown_criterion(system):
+    system.stop_on_transition = "entropy"
+    with pytest.raises(ValueError):
+        fl.TransitionDetector(system)
+
+
+@pytest.mark.parametrize("element, lattice_constant", [("Al", 4.05), ("Cu", 3.615), ("Ti", 2.95)])
+def test_nearest_distance(element, lattice_constant):
+    s = fl.MD_system(element=element, lattice_constant=lattice_constant)
+    structure = fl.build_structure(s)
+    distances = np.linalg.norm(structure.positions[1:] - structure.positions[0], axis=1)
+    assert s.nearest_distance == pytest.approx(distances.min())
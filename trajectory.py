@@ -0,0 +1,504 @@
+import os
+import json
+import itertools
+import numpy as np
+
+
+# Binary trajectory: a fixed-size header followed by fixed-size frame records, so frame i
+# starts at HEADER_SIZE + i*frame_size and is read through np.memmap without parsing.
+MAGIC = b"MDTRAJ01"
+HEADER_SIZE = 1024
+SUFFIX = ".mdtraj"
+
+
+def frame_dtype(n_atoms, columns):
+    """
+    Record layout of one frame: timestep, cell matrix (3 cell vectors and origin as columns) and float32 atom data
+    """
+    return np.dtype([("timestep", "<i8"),
+                     ("cell", "<f8", (3, 4)),
+                     ("data", "<f4", (n_atoms, len(columns)))])
+
+
+def read_header(path):
+    """
+    Read the header (n_atoms, columns, pbc and metadata) of a binary trajectory
+    """
+    with open(path, "rb") as fr:
+        head = fr.read(HEADER_SIZE)
+    if head[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a binary trajectory")
+    return json.loads(head[len(MAGIC):].rstrip(b"\0").decode())
+
+
+class TrajectoryWriter:
+    """
+    Append frames to a binary trajectory, an existing file with the same layout is continued
+    """
+    def __init__(self, path, n_atoms, columns, pbc=(True, True, True), **meta):
+        self.path = path
+        self.columns = list(columns)
+        self.dtype = frame_dtype(n_atoms, self.columns)
+        header = dict(meta, version=1, n_atoms=int(n_atoms), columns=self.columns, pbc=[bool(p) for p in pbc])
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            old = read_header(path)
+            if old["n_atoms"] != n_atoms or old["columns"] != self.columns:
+                raise ValueError(f"{path} has a different frame layout")
+            self.fw = open(path, "r+b")
+            # drop a partially written frame at the end
+            n_frames = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+            self.fw.truncate(HEADER_SIZE + n_frames * self.dtype.itemsize)
+            self.fw.seek(0, os.SEEK_END)
+        else:
+            encoded = MAGIC + json.dumps(header).encode()
+            if len(encoded) > HEADER_SIZE:
+                raise ValueError("Trajectory header is too large")
+            self.fw = open(path, "wb")
+            self.fw.write(encoded.ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, timestep, cell, data):
+        record = np.zeros(1, dtype=self.dtype)
+        record["timestep"] = timestep
+        record["cell"] = cell
+        record["data"] = data
+        self.fw.write(record.tobytes())
+
+    def close(self):
+        self.fw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Trajectory:
+    """
+    Memory-mapped binary trajectory, frames are accessed in O(1) by index
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.n_atoms = self.header["n_atoms"]
+        self.columns = self.header["columns"]
+        self.pbc = tuple(self.header["pbc"])
+        self.dtype = frame_dtype(self.n_atoms, self.columns)
+        self.frames = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Map the frames written so far, call again to see frames appended while a run is going on
+        """
+        n_frames = (os.path.getsize(self.path) - HEADER_SIZE) // self.dtype.itemsize
+        if n_frames == 0:
+            self.frames = np.zeros(0, dtype=self.dtype)
+        elif self.frames is None or len(self.frames) != n_frames:
+            self.frames = np.memmap(self.path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(n_frames,))
+        return len(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    @property
+    def timesteps(self):
+        return np.asarray(self.frames["timestep"])
+
+    def cell(self, i):
+        return np.asarray(self.frames[i]["cell"], dtype=np.float64)
+
+    def column(self, i, name):
+        return self.frames[i]["data"][:, self.columns.index(name)]
+
+    def positions(self, i):
+        return np.asarray(self.frames[i]["data"][:, [self.columns.index(c) for c in "xyz"]], dtype=np.float64)
+
+    def types(self, i):
+        return self.column(i, "type").astype(np.int32)
+
+
+## LAMMPS text dumps
+def dump_cell(bounds, tilt):
+    """
+    Cell matrix (cell vectors and origin as columns) from the BOX BOUNDS of a dump
+    """
+    (xlo, xhi), (ylo, yhi), (zlo, zhi) = bounds
+    xy, xz, yz = tilt
+    # a triclinic dump stores the bounding box of the cell
+    xlo -= min(0.0, xy, xz, xy + xz)
+    xhi -= max(0.0, xy, xz, xy + xz)
+    ylo -= min(0.0, yz)
+    yhi -= max(0.0, yz)
+    return np.array([[xhi - xlo, xy, xz, xlo],
+                     [0.0, yhi - ylo, yz, ylo],
+                     [0.0, 0.0, zhi - zlo, zlo]])
+
+
+def read_dump_frame(fr):
+    """
+    Read the next frame of a LAMMPS text dump from an open binary file.
+    Returns (timestep, cell, pbc, columns, data) with the rows sorted by atom id, or None at the end of the file
+    """
+    line = fr.readline()
+    if not line:
+        return None
+    timestep = int(fr.readline())
+    fr.readline()
+    n_atoms = int(fr.readline())
+    box_item = fr.readline().decode().split()
+    bounds = [[float(v) for v in fr.readline().split()] for _ in range(3)]
+    tilt = [b[2] if len(b) > 2 else 0.0 for b in bounds]
+    cell = dump_cell([b[:2] for b in bounds], tilt)
+    pbc = [flag.startswith("p") for flag in box_item[-3:]]
+    columns = fr.readline().decode().split()[2:]
+    block = b"".join(itertools.islice(fr, n_atoms))
+    data = np.array(block.split(), dtype=np.float64).reshape(n_atoms, len(columns))
+    if "id" in columns:
+        data = data[np.argsort(data[:, columns.index("id")], kind="stable")]
+    return timestep, cell, pbc, columns, data
+
+
+def iter_dump(path):
+    """
+    Iterate over the frames of a LAMMPS text dump
+    """
+    with open(path, "rb") as fr:
+        while True:
+            frame = read_dump_frame(fr)
+            if frame is None:
+                break
+            yield frame
+
+
+def cartesian(cell, data, columns):
+    """
+    Replace scaled coordinates (xs/xsu ...) of dump data by Cartesian x y z, the atom id is dropped
+    """
+    for scaled in (["xs", "ys", "zs"], ["xsu", "ysu", "zsu"]):
+        if all(c in columns for c in scaled):
+            s = data[:, [columns.index(c) for c in scaled]]
+            xyz = s @ cell[:, :3].T + cell[:, 3]
+            break
+    else:
+        xyz = data[:, [columns.index(c) for c in "xyz"]]
+    keep = [c for c in columns if c not in ("id", "x", "y", "z", "xs", "ys", "zs", "xsu", "ysu", "zsu")]
+    out = np.column_stack([data[:, [columns.index(c) for c in keep]], xyz]) if keep else xyz
+    return out, keep + ["x", "y", "z"]
+
+
+def convert_dump(dump_path, traj_path=None, remove=False, append=False, **meta):
+    """
+    Convert a LAMMPS text dump into a binary trajectory, optionally removing the text dump afterwards.
+    With append=True the frames continue an existing trajectory, frames it already holds are skipped
+    """
+    traj_path = traj_path or dump_path + SUFFIX
+    last = None
+    if append and os.path.exists(traj_path):
+        stored = Trajectory(traj_path)
+        if len(stored):
+            last = int(stored.timesteps[-1])
+    elif os.path.exists(traj_path):
+        os.remove(traj_path)
+    writer = None
+    try:
+        for timestep, cell, pbc, columns, data in iter_dump(dump_path):
+            if last is not None and timestep <= last:
+                continue
+            data, names = cartesian(cell, data, columns)
+            if writer is None:
+                writer = TrajectoryWriter(traj_path, len(data), names, pbc, **meta)
+            elif len(data) != writer.dtype["data"].shape[0]:
+                raise ValueError(f"{dump_path}: number of atoms changes at step {timestep}")
+            writer.append(timestep, cell, data)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None and last is None:
+        raise ValueError(f"{dump_path} contains no frames")
+    if remove:
+        os.remove(dump_path)
+    return traj_path
+
+
+def export_dump(traj_path, dump_path):
+    """
+    Write a binary trajectory back as LAMMPS text dump with Cartesian coordinates
+    """
+    traj = Trajectory(traj_path)
+    flags = " ".join("pp" if p else "ss" for p in traj.pbc)
+    with open(dump_path, "w") as fw:
+        for i in range(len(traj)):
+            cell = traj.cell(i)
+            (lx, xy, xz, xlo), (_, ly, yz, ylo), (_, _, lz, zlo) = cell
+            xlo_b = xlo + min(0.0, xy, xz, xy + xz)
+            xhi_b = xlo + lx + max(0.0, xy, xz, xy + xz)
+            ylo_b = ylo + min(0.0, yz)
+            yhi_b = ylo + ly + max(0.0, yz)
+            fw.write(f"ITEM: TIMESTEP\n{traj.timesteps[i]}\nITEM: NUMBER OF ATOMS\n{traj.n_atoms}\n")
+            fw.write(f"ITEM: BOX BOUNDS xy xz yz {flags}\n")
+            fw.write(f"{xlo_b:.10g} {xhi_b:.10g} {xy:.10g}\n{ylo_b:.10g} {yhi_b:.10g} {xz:.10g}\n{zlo:.10g} {zlo + lz:.10g} {yz:.10g}\n")
+            fw.write("ITEM: ATOMS id " + " ".join(traj.columns) + "\n")
+            data = np.column_stack([np.arange(1, traj.n_atoms + 1), traj[i]["data"]])
+            np.savetxt(fw, data, fmt=["%d"] + ["%.8g"] * len(traj.columns))
+    return dump_path
+
+
+## Frame index of text dumps
+INDEX_SUFFIX = ".idx"
+
+
+def scan_dump(fr, offset, size):
+    """
+    Scan complete frames of an open dump starting at offset, yields (offset, timestep, n_atoms).
+    A frame which is still being written is not reported
+    """
+    fr.seek(offset)
+    while offset < size:
+        head = list(itertools.islice(fr, 9))
+        if len(head) < 9 or not head[0].startswith(b"ITEM: TIMESTEP") or not head[8].endswith(b"\n"):
+            return
+        timestep, n_atoms = int(head[1]), int(head[3])
+        n_lines = sum(1 for line in itertools.islice(fr, n_atoms) if line.endswith(b"\n"))
+        if n_lines < n_atoms:
+            return
+        yield offset, timestep, n_atoms
+        offset = fr.tell()
+
+
+def frame_at(fr, row, size):
+    """
+    Whether the open dump has the frame of an index row (offset, timestep, n_atoms) at its offset
+    """
+    offset, timestep, n_atoms = (int(x) for x in row)
+    if offset >= size:
+        return False
+    fr.seek(offset)
+    head = list(itertools.islice(fr, 4))
+    try:
+        return head[0].startswith(b"ITEM: TIMESTEP") and int(head[1]) == timestep and int(head[3]) == n_atoms
+    except (IndexError, ValueError):
+        return False
+
+
+def index_dump(dump_path):
+    """
+    Build or extend the sidecar index (byte offset, timestep, atom count per frame) of a text dump.
+    Only the part of the dump after the last indexed frame is scanned
+    """
+    index_path = dump_path + INDEX_SUFFIX
+    size = os.path.getsize(dump_path)
+    index = np.zeros((0, 3), dtype=np.int64)
+    if os.path.exists(index_path):
+        index = np.fromfile(index_path, dtype=np.int64).reshape(-1, 3)
+        # the dump was rewritten (e.g. by a new run of the same length) unless the first and the last indexed
+        # frame are still where the index has them
+        with open(dump_path, "rb") as fr:
+            if len(index):
+                valid = frame_at(fr, index[0], size) and frame_at(fr, index[-1], size)
+            else:
+                valid = fr.readline().startswith(b"ITEM: TIMESTEP")
+        if not valid:
+            index = np.zeros((0, 3), dtype=np.int64)
+
+    # the last indexed frame is scanned again to find where the next one starts
+    start = index[-1, 0] if len(index) else 0
+    with open(dump_path, "rb") as fr:
+        new = np.array(list(scan_dump(fr, int(start), size)), dtype=np.int64).reshape(-1, 3)
+    if len(index):
+        new = new[1:]
+    index = np.concatenate([index, new])
+    if len(new) or not os.path.exists(index_path):
+        index.tofile(index_path)
+    return index
+
+
+class DumpReader:
+    """
+    Lazy reader of a LAMMPS text dump, frames are located through the sidecar index and parsed on access
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = np.zeros((0, 3), dtype=np.int64)
+        self._cache = (None, None)
+        self.refresh()
+        self.n_atoms = int(self.index[0, 2]) if len(self) else 0
+        first = self.frame(0) if len(self) else (None, None, (True, True, True), [], None)
+        self.pbc, self.columns = first[2], first[3]
+
+    def refresh(self):
+        self.index = index_dump(self.path)
+        return len(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def timesteps(self):
+        return self.index[:, 1]
+
+    def frame(self, i):
+        """
+        (timestep, cell, pbc, columns, data) of frame i with Cartesian coordinates in the last three columns
+        """
+        i = range(len(self))[i]
+        if self._cache[0] != i:
+            with open(self.path, "rb") as fr:
+                fr.seek(int(self.index[i, 0]))
+                timestep, cell, pbc, columns, data = read_dump_frame(fr)
+            data, columns = cartesian(cell, data, columns)
+            self._cache = (i, (timestep, cell, tuple(pbc), columns, data))
+        return self._cache[1]
+
+    def cell(self, i):
+        return self.frame(i)[1]
+
+    def column(self, i, name):
+        _, _, _, columns, data = self.frame(i)
+        return data[:, columns.index(name)]
+
+    def positions(self, i):
+        return self.frame(i)[4][:, -3:]
+
+    def types(self, i):
+        return self.column(i, "type").astype(np.int32)
+
+
+def open_trajectory(dump_path):
+    """
+    Reader for the trajectory of a run, the binary trajectory is preferred over the text dump
+    """
+    if os.path.exists(dump_path + SUFFIX):
+        return Trajectory(dump_path + SUFFIX)
+    return DumpReader(dump_path)
+
+
+## Time series
+SERIES_MAGIC = b"MDSERI01"
+
+
+class SeriesWriter:
+    """
+    Append rows of named float64 columns to a binary time series, every row is flushed so it can be read while a run is going on.
+    With append=True an existing series with the same columns is continued
+    """
+    def __init__(self, path, columns, append=False, **meta):
+        self.columns = list(columns)
+        if append and os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            if list(read_series(path).dtype.names) != self.columns:
+                raise ValueError(f"{path} has different columns")
+            self.fw = open(path, "r+b")
+            # drop a partially written row at the end
+            n_rows = (os.path.getsize(path) - HEADER_SIZE) // (8 * len(self.columns))
+            self.fw.truncate(HEADER_SIZE + n_rows * 8 * len(self.columns))
+            self.fw.seek(0, os.SEEK_END)
+            return
+        encoded = SERIES_MAGIC + json.dumps(dict(meta, version=1, columns=self.columns)).encode()
+        if len(encoded) > HEADER_SIZE:
+            raise ValueError("Time series header is too large")
+        self.fw = open(path, "wb")
+        self.fw.write(encoded.ljust(HEADER_SIZE, b"\0"))
+
+    def append(self, *values):
+        self.fw.write(np.asarray(values, dtype="<f8").tobytes())
+        self.fw.flush()
+
+    def close(self):
+        self.fw.close()
+
+
+def read_series(path):
+    """
+    Memory-mapped time series as structured array, e.g. read_series(path)["step"]
+    """
+    with open(path, "rb") as fr:
+        head = fr.read(HEADER_SIZE)
+    if head[:len(SERIES_MAGIC)] != SERIES_MAGIC:
+        raise ValueError(f"{path} is not a binary time series")
+    columns = json.loads(head[len(SERIES_MAGIC):].rstrip(b"\0").decode())["columns"]
+    dtype = np.dtype([(c, "<f8") for c in columns])
+    n_rows = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if n_rows == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(n_rows,))
+
+
+## Columnar files
+COLUMNS_MAGIC = b"MDCOLS01"
+
+
+def write_columns(path, columns, **meta):
+    """
+    Write equally long float64 arrays (dict name -> array) as one columnar file: the header, then every column
+    contiguous. The file is replaced atomically
+    """
+    names = list(columns)
+    n_rows = len(columns[names[0]]) if names else 0
+    encoded = COLUMNS_MAGIC + json.dumps(dict(meta, version=1, columns=names, n_rows=int(n_rows))).encode()
+    if len(encoded) > HEADER_SIZE:
+        raise ValueError("Columnar header is too large")
+    with open(f"{path}.tmp", "wb") as fw:
+        fw.write(encoded.ljust(HEADER_SIZE, b"\0"))
+        for name in names:
+            fw.write(np.ascontiguousarray(columns[name], dtype="<f8").tobytes())
+    os.replace(f"{path}.tmp", path)
+
+
+def read_columns(path):
+    """
+    Memory-mapped columns of a columnar file as dict name -> array
+    """
+    with open(path, "rb") as fr:
+        head = fr.read(HEADER_SIZE)
+    if head[:len(COLUMNS_MAGIC)] != COLUMNS_MAGIC:
+        raise ValueError(f"{path} is not a columnar file")
+    header = json.loads(head[len(COLUMNS_MAGIC):].rstrip(b"\0").decode())
+    names, n_rows = header["columns"], header["n_rows"]
+    if n_rows == 0:
+        return {name: np.zeros(0) for name in names}
+    data = np.memmap(path, dtype="<f8", mode="r", offset=HEADER_SIZE, shape=(len(names), n_rows))
+    return {name: data[i] for i, name in enumerate(names)}
+
+
+## Per-frame structure types
+TYPES_MAGIC = b"MDTYPE01"
+TYPES_SUFFIX = ".ptm"
+
+
+def write_frame_types(path, types, n_structures, **meta):
+    """
+    Store per-atom structure types of all frames (n_frames, n_atoms) as uint8 followed by the per-frame counts
+    of every structure type (n_frames, n_structures) as int32. The file is replaced atomically
+    """
+    types = np.ascontiguousarray(types, dtype=np.uint8)
+    counts = np.stack([np.bincount(t, minlength=n_structures)[:n_structures] for t in types]) if len(types) else \
+        np.zeros((0, n_structures), dtype=np.int32)
+    header = dict(meta, version=1, n_frames=int(types.shape[0]), n_atoms=int(types.shape[1]), n_structures=int(n_structures))
+    encoded = TYPES_MAGIC + json.dumps(header).encode()
+    if len(encoded) > HEADER_SIZE:
+        raise ValueError("Structure type header is too large")
+    with open(f"{path}.tmp", "wb") as fw:
+        fw.write(encoded.ljust(HEADER_SIZE, b"\0"))
+        fw.write(types.tobytes())
+        fw.write(counts.astype("<i4").tobytes())
+    os.replace(f"{path}.tmp", path)
+
+
+def read_frame_types(path):
+    """
+    Header, memory-mapped structure types (n_frames, n_atoms) and counts (n_frames, n_structures) of a type file
+    """
+    with open(path, "rb") as fr:
+        head = fr.read(HEADER_SIZE)
+    if head[:len(TYPES_MAGIC)] != TYPES_MAGIC:
+        raise ValueError(f"{path} is not a structure type file")
+    header = json.loads(head[len(TYPES_MAGIC):].rstrip(b"\0").decode())
+    n_frames, n_atoms, n_structures = header["n_frames"], header["n_atoms"], header["n_structures"]
+    if n_frames == 0:
+        return header, np.zeros((0, n_atoms), dtype=np.uint8), np.zeros((0, n_structures), dtype=np.int32)
+    types = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(n_frames, n_atoms))
+    counts = np.memmap(path, dtype="<i4", mode="r", offset=HEADER_SIZE + n_frames * n_atoms, shape=(n_frames, n_structures))
+    return header, types, counts